@@ -0,0 +1,83 @@
+"""Compares the clustering methods of `cluster_bounding_boxes` on synthetic element boxes.
+
+For each method reports the time, the Ward inertia (sum of squared distances of the box
+centroids to the mean of their cluster, lower is tighter), and the share of the screen
+covered by the cluster regions and by their overlaps (lower means a smaller composite
+with less duplicated content).
+
+Usage:
+    poetry run python benchmarks/bench_clustering.py [--boxes 100 1000 5000] [--clusters 10]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from robbieg2.canny_composite import CLUSTERING_METHODS, cluster_bounding_boxes
+
+WIDTH, HEIGHT = 2880, 1712
+# The agglomerative method needs O(n^2) memory, beyond this it is skipped
+AGGLOMERATIVE_MAX_BOXES = 8000
+
+
+def synthetic_boxes(count: int, seed: int) -> list:
+    """Element boxes gathered around a few UI areas (nav bar, sidebar, content, footer) plus noise."""
+    rng = np.random.default_rng(seed)
+    areas = [(0, 0, WIDTH, 80), (0, 80, 300, HEIGHT - 160), (400, 150, 2000, 1300), (0, HEIGHT - 80, WIDTH, 80)]
+    boxes = []
+    for i in range(count):
+        if rng.random() < 0.1:
+            left, top, width, height = 0, 0, WIDTH, HEIGHT
+        else:
+            left, top, width, height = areas[i % len(areas)]
+        x = int(rng.integers(left, left + width - 20))
+        y = int(rng.integers(top, top + height - 10))
+        boxes.append((x, y, int(rng.integers(10, 120)), int(rng.integers(8, 40))))
+    return boxes
+
+
+def quality(boxes: list, labels: np.ndarray, regions: list) -> tuple:
+    array = np.asarray(boxes, dtype=float)
+    centroids = array[:, :2] + array[:, 2:] / 2
+    inertia = sum(
+        ((centroids[labels == label] - centroids[labels == label].mean(axis=0)) ** 2).sum()
+        for label in np.unique(labels)
+    )
+    mask = np.zeros((HEIGHT, WIDTH), dtype=np.int32)
+    for x, y, w, h in regions:
+        mask[y:y + h, x:x + w] += 1
+    coverage = (mask > 0).mean()
+    overlap = (mask > 1).mean()
+    return inertia, coverage, overlap
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--boxes", type=int, nargs="+", default=[100, 1000, 5000, 20000])
+    parser.add_argument("--clusters", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Keep the sklearn import out of the first agglomerative timing
+    import sklearn.cluster  # noqa: F401
+
+    for count in args.boxes:
+        boxes = synthetic_boxes(count, args.seed)
+        array = np.asarray(boxes)
+        centroids = array[:, :2] + array[:, 2:] / 2
+        for method, labels_of in CLUSTERING_METHODS.items():
+            if method == "agglomerative" and count > AGGLOMERATIVE_MAX_BOXES:
+                print(f"{count} boxes, {method}: skipped (quadratic memory)")
+                continue
+            start = time.perf_counter()
+            regions = cluster_bounding_boxes(boxes, args.clusters, method=method)
+            elapsed = time.perf_counter() - start
+            inertia, coverage, overlap = quality(boxes, labels_of(centroids, args.clusters), regions)
+            print(
+                f"{count} boxes, {method}: {elapsed * 1000:.1f} ms, {len(regions)} regions, "
+                f"inertia {inertia:.3g}, screen coverage {coverage:.1%}, overlap {overlap:.1%}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Compares the vertical and the packed composite layouts on synthetic screenshots.
+
+For each layout reports the size of the composite in pixels, the size of the data URI sent to
+the model through the "composite" encode policy, and the render and encode times, with the packed
+layout relative to the vertical one. The vertical composite is much taller than any model input, so the model sees it
+scaled down far more than the packed one.
+
+Usage:
+    poetry run python benchmarks/bench_composite_layout.py [--elements 100 300 1000] [--clusters 10]
+"""
+import argparse
+import time
+
+from benchmarks.bench_group_elements import synthetic_ui
+from robbieg2.canny_composite import (
+    COMPOSITE_LAYOUTS,
+    cluster_bounding_boxes,
+    extract_bounding_boxes,
+    group_elements,
+    improved_canny,
+)
+from robbieg2.img import encode_image
+
+WIDTH, HEIGHT = 2880, 1712
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--elements", type=int, nargs="+", default=[100, 300, 1000])
+    parser.add_argument("--clusters", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'elements':>8} {'layout':>9} {'size':>11} {'pixels':>10} {'uri bytes':>10} {'render ms':>10} {'encode ms':>10}")
+    for count in args.elements:
+        rgb = synthetic_ui(WIDTH, HEIGHT, count, args.seed)
+        boxes = extract_bounding_boxes(group_elements(improved_canny(rgb[:, :, ::-1].copy())))
+        clustered = cluster_bounding_boxes(boxes, args.clusters)
+        baseline = None
+        # The original vertical layout first, as the baseline
+        for name, layout in sorted(COMPOSITE_LAYOUTS.items(), key=lambda item: item[0] != "vertical"):
+            start = time.perf_counter()
+            composite = layout(clustered, rgb)
+            rendered = time.perf_counter()
+            uri_bytes = len(encode_image(composite, "composite"))
+            encoded = time.perf_counter()
+            render_ms, encode_ms = (rendered - start) * 1000, (encoded - rendered) * 1000
+            pixels = composite.width * composite.height
+            size = f"{composite.width}x{composite.height}"
+            print(f"{count:>8} {name:>9} {size:>11} {pixels:>10} {uri_bytes:>10} {render_ms:>10.1f} {encode_ms:>10.1f}")
+            if baseline is None:
+                baseline = (pixels, uri_bytes, render_ms + encode_ms)
+            else:
+                print(
+                    f"{'':>8} {'':>9} {'':>11} {pixels / baseline[0]:>9.2f}x {uri_bytes / baseline[1]:>9.2f}x"
+                    f" {(render_ms + encode_ms) / baseline[2]:>9.2f}x (total)"
+                )
+
+
+if __name__ == "__main__":
+    main()
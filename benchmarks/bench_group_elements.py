@@ -0,0 +1,95 @@
+"""Benchmarks `group_elements` against the original quadratic implementation on dense synthetic UIs.
+
+Checks that both produce the same groups and reports the speedup.
+
+Usage:
+    poetry run python benchmarks/bench_group_elements.py [--elements 3000] [--seed 0]
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from robbieg2.canny_composite import group_elements, improved_canny
+
+
+def group_elements_quadratic(binary_image):
+    """The original implementation, kept here as the reference."""
+    contours, _ = cv2.findContours(binary_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    grouped_contours = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w * h < 100:  # Ignore very small contours
+            continue
+        merged = False
+        for group in grouped_contours:
+            if any(cv2.boundingRect(c)[0] - 10 <= x <= cv2.boundingRect(c)[0] + cv2.boundingRect(c)[2] + 10 and
+                   cv2.boundingRect(c)[1] - 10 <= y <= cv2.boundingRect(c)[1] + cv2.boundingRect(c)[3] + 10 for c in group):
+                group.append(contour)
+                merged = True
+                break
+        if not merged:
+            grouped_contours.append([contour])
+
+    return grouped_contours
+
+
+def synthetic_ui(width: int, height: int, elements: int, seed: int) -> np.ndarray:
+    """Draws a busy page: a jittered grid of separate buttons, icons and short words."""
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    columns = max(int(np.sqrt(elements * width / height)), 1)
+    rows = max(elements // columns, 1)
+    cell_w, cell_h = width // columns, height // rows
+    for row in range(rows):
+        for column in range(columns):
+            x = column * cell_w + int(rng.integers(0, max(cell_w // 4, 1)))
+            y = row * cell_h + int(rng.integers(0, max(cell_h // 4, 1)))
+            w, h = max(cell_w // 2, 12), max(cell_h // 2, 10)
+            color = tuple(int(c) for c in rng.integers(0, 200, 3))
+            kind = rng.integers(0, 3)
+            if kind == 0:
+                cv2.rectangle(image, (x, y), (x + w, y + h), color, -1)
+            elif kind == 1:
+                cv2.circle(image, (x + w // 2, y + h // 2), min(w, h) // 2, color, -1)
+            else:
+                cv2.putText(image, "ab", (x, y + h), cv2.FONT_HERSHEY_SIMPLEX, h / 30, color, 1)
+    return image
+
+
+def _signature(groups) -> list:
+    return [[cv2.boundingRect(contour) for contour in group] for group in groups]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=2880)
+    parser.add_argument("--height", type=int, default=1712)
+    parser.add_argument("--elements", type=int, nargs="+", default=[500, 1500, 3000])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for elements in args.elements:
+        edges = improved_canny(synthetic_ui(args.width, args.height, elements, args.seed))
+        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        start = time.perf_counter()
+        reference = group_elements_quadratic(edges)
+        reference_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        groups = group_elements(edges)
+        indexed_time = time.perf_counter() - start
+
+        same = _signature(reference) == _signature(groups)
+        print(
+            f"{elements} elements, {len(contours)} contours, {len(groups)} groups: "
+            f"quadratic {reference_time * 1000:.1f} ms, indexed {indexed_time * 1000:.1f} ms, "
+            f"speedup {reference_time / max(indexed_time, 1e-9):.1f}x, equivalent groups: {same}"
+        )
+
+
+if __name__ == "__main__":
+    main()
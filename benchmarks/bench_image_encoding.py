@@ -0,0 +1,66 @@
+"""Compares the image encoder policies on a screenshot: encoded bytes, base64 payload and encode time.
+
+Without a screenshot, a synthetic UI of the given size is used; real screenshots with text
+and gradients compress very differently, so prefer passing one.
+
+Usage:
+    poetry run python benchmarks/bench_image_encoding.py [--image screenshot.png] [--repeat 5]
+"""
+import argparse
+import base64
+import statistics
+import time
+
+from PIL import Image
+
+from benchmarks.bench_group_elements import synthetic_ui
+from robbieg2.img import IMAGE_POLICIES, EncodePolicy, _encode, encode_image, image_to_b64
+
+POLICIES = {
+    "png-6 (image_to_b64)": EncodePolicy("png", 6),
+    "png-1": EncodePolicy("png", 1),
+    "png-9": EncodePolicy("png", 9),
+    "webp-lossless-0": EncodePolicy("webp", 0),
+    "webp-lossless-50": EncodePolicy("webp", 50),
+    "jpeg-90": EncodePolicy("jpeg", 90),
+    "jpeg-80": EncodePolicy("jpeg", 80),
+}
+
+
+def timed(function, repeat: int) -> tuple:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", help="Screenshot to encode")
+    parser.add_argument("--width", type=int, default=2880)
+    parser.add_argument("--height", type=int, default=1712)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.image:
+        image = Image.open(args.image).convert("RGB")
+    else:
+        image = Image.fromarray(synthetic_ui(args.width, args.height, 300, 0))
+    print(f"image {image.width}x{image.height}")
+
+    _, baseline = timed(lambda: image_to_b64(image), args.repeat)
+    print(f"{'policy':>24} {'bytes':>10} {'b64 bytes':>10} {'ms':>8}")
+    for name, policy in POLICIES.items():
+        data, elapsed = timed(lambda: _encode(image, policy), args.repeat)
+        print(f"{name:>24} {len(data):>10} {len(base64.b64encode(data)):>10} {elapsed:>8.1f}")
+
+    print(f"\nconfigured policies (image_to_b64 took {baseline:.1f} ms)")
+    for kind, policy in IMAGE_POLICIES.items():
+        uri, elapsed = timed(lambda: encode_image(image, kind), args.repeat)
+        print(f"{kind:>24} {len(uri):>21} {elapsed:>8.1f}  {policy}")
+
+
+if __name__ == "__main__":
+    main()
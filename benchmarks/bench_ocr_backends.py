@@ -0,0 +1,95 @@
+"""Compares the OCR backends on a corpus of saved screenshots.
+
+Every backend runs in its own process, so that its peak RSS is measured on its own.
+Reports the mean OCR latency per screenshot, the peak RSS and the text-match accuracy
+against the fp32 baseline, i.e. the share of the fp32 text boxes found at the same place
+with the same text.
+
+Usage:
+    poetry run python benchmarks/bench_ocr_backends.py screenshot1.png [screenshot2.png ...]
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+BACKENDS = ["fp32", "int8", "onnx"]
+
+
+def run_backend(backend: str, paths: list) -> dict:
+    import numpy as np
+    from PIL import Image
+
+    from robbieg2.easyocr import _process_results, create_reader
+
+    reader = create_reader(backend=backend)
+    images = [np.asarray(Image.open(path).convert("RGB")) for path in paths]
+    # The first inference pays for lazy initializations, keep it out of the timings
+    reader.readtext(images[0])
+
+    latencies = []
+    results = []
+    for image in images:
+        start = time.perf_counter()
+        results.append(_process_results(reader.readtext(image)))
+        latencies.append(time.perf_counter() - start)
+    return {
+        "latency": sum(latencies) / len(latencies),
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "results": results,
+    }
+
+
+def _matches(expected: dict, found: dict) -> bool:
+    inter_w = min(expected["x"] + expected["w"], found["x"] + found["w"]) - max(expected["x"], found["x"])
+    inter_h = min(expected["y"] + expected["h"], found["y"] + found["h"]) - max(expected["y"], found["y"])
+    if inter_w <= 0 or inter_h <= 0:
+        return False
+    union = expected["w"] * expected["h"] + found["w"] * found["h"] - inter_w * inter_h
+    return inter_w * inter_h / union >= 0.5 and expected["text"].strip().lower() == found["text"].strip().lower()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("screenshots", nargs="+")
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_backend(args.worker, args.screenshots)))
+        return
+
+    reports = {}
+    for backend in ["fp32"] + [b for b in args.backends if b != "fp32"]:
+        process = subprocess.run(
+            [sys.executable, __file__, "--worker", backend, *args.screenshots],
+            capture_output=True, text=True,
+        )
+        if process.returncode != 0:
+            print(f"{backend}: failed\n{process.stderr[-2000:]}")
+            continue
+        reports[backend] = json.loads(process.stdout.strip().splitlines()[-1])
+
+    baseline = reports.get("fp32")
+    for backend, report in reports.items():
+        accuracy = "n/a"
+        if baseline:
+            expected = sum(len(results) for results in baseline["results"])
+            found = sum(
+                1
+                for expected_results, found_results in zip(baseline["results"], report["results"])
+                for result in expected_results
+                if any(_matches(result, other) for other in found_results)
+            )
+            accuracy = f"{found / max(expected, 1):.1%}"
+        print(
+            f"{backend}: latency {report['latency'] * 1000:.0f} ms/screenshot, "
+            f"peak RSS {report['rss_mb']:.0f} MB, text-match accuracy vs fp32 {accuracy}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Calibrates the fast SSIM of the cheap critic against the full resolution skimage SSIM.
+
+For every pair of frames, compares the decision at the critic threshold (continue the chain
+if the SSIM is above it) of the skimage SSIM with the ones of the fast SSIM at several pyramid
+levels, with and without the early exit, and reports the decision agreement rate, the mean
+SSIM difference (without early exits) and the speedup. Downscaled SSIM reads lower, so for
+every level it also reports the threshold that best reproduces the skimage decisions.
+
+Frames are read from a directory of screenshots recorded in capture order, each one compared
+with the next; without one, synthetic pairs are generated: identical screens, small edits,
+popups of several sizes, scrolls and full page changes.
+
+Usage:
+    poetry run python benchmarks/bench_ssim.py [--frames recorded_dir] [--levels 0 1 2] [--repeat 3]
+"""
+import argparse
+import glob
+import os
+import statistics
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+from skimage.metrics import structural_similarity
+
+from benchmarks.bench_group_elements import synthetic_ui
+from robbieg2.cheap_critic import SSIM_THRESHOLD, downscale, fast_ssim
+
+WIDTH, HEIGHT = 2880, 1712
+
+
+def recorded_pairs(directory: str) -> list:
+    paths = sorted(glob.glob(os.path.join(directory, "*.png")))
+    frames = [np.asarray(Image.open(path).convert("L")) for path in paths]
+    return [
+        (f"{os.path.basename(a)}->{os.path.basename(b)}", x, y)
+        for (a, x), (b, y) in zip(zip(paths, frames), zip(paths[1:], frames[1:]))
+        if x.shape == y.shape
+    ]
+
+
+def synthetic_pairs(seed: int) -> list:
+    rng = np.random.default_rng(seed)
+    base = cv2.cvtColor(synthetic_ui(WIDTH, HEIGHT, 300, seed), cv2.COLOR_RGB2GRAY)
+    pairs = [("identical", base, base.copy())]
+
+    for name, size in (("edit", (40, 200)), ("popup-small", (300, 500)), ("popup-medium", (700, 1100)),
+                       ("popup-large", (1100, 1800))):
+        changed = base.copy()
+        top, left = int(rng.integers(0, HEIGHT - size[0])), int(rng.integers(0, WIDTH - size[1]))
+        changed[top:top + size[0], left:left + size[1]] = 255
+        cv2.rectangle(changed, (left, top), (left + size[1] - 1, top + size[0] - 1), 0, 2)
+        pairs.append((name, base, changed))
+
+    for shift in (3, 30, 300):
+        pairs.append((f"scroll-{shift}", base, np.roll(base, -shift, axis=0)))
+
+    noisy = np.clip(base.astype(int) + rng.integers(-6, 7, base.shape), 0, 255).astype(np.uint8)
+    pairs.append(("noise", base, noisy))
+    other = cv2.cvtColor(synthetic_ui(WIDTH, HEIGHT, 300, seed + 1), cv2.COLOR_RGB2GRAY)
+    pairs.append(("new-page", base, other))
+    return pairs
+
+
+def timed(function, repeat: int) -> tuple:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", help="Directory of screenshots recorded in capture order")
+    parser.add_argument("--levels", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seeds", type=int, default=3, help="Synthetic screens to generate pairs from")
+    args = parser.parse_args()
+
+    if args.frames:
+        pairs = recorded_pairs(args.frames)
+    else:
+        pairs = [pair for seed in range(args.seeds) for pair in synthetic_pairs(seed)]
+    print(f"{len(pairs)} pairs, threshold {SSIM_THRESHOLD}")
+
+    reference = []
+    reference_time = 0.0
+    for name, x, y in pairs:
+        value, elapsed = timed(lambda: structural_similarity(x, y), args.repeat)
+        reference.append(value)
+        reference_time += elapsed
+
+    variants = [(level, early) for level in args.levels for early in (False, True)]
+    print(f"{'variant':>18} {'agreement':>10} {'mean |diff|':>12} {'total ms':>9} {'speedup':>8}")
+    print(f"{'skimage':>18} {'':>10} {'':>12} {reference_time * 1000:>9.1f} {'1.0x':>8}")
+    disagreements = []
+    calibrated = {}
+    for level, early in variants:
+        agree, diffs, total_time = 0, [], 0.0
+        for (name, x, y), expected in zip(pairs, reference):
+            threshold = SSIM_THRESHOLD if early else None
+            # The pyramid of a frame is computed once and shared, so only the SSIM itself is timed
+            small_x, small_y = downscale(x, level), downscale(y, level)
+            value, elapsed = timed(lambda: fast_ssim(small_x, small_y, threshold), args.repeat)
+            total_time += elapsed
+            if not early:
+                calibrated.setdefault(level, []).append((value, expected > SSIM_THRESHOLD))
+            if (value > SSIM_THRESHOLD) == (expected > SSIM_THRESHOLD):
+                agree += 1
+            else:
+                disagreements.append((f"level {level}", name, expected, value))
+            if not early or value > SSIM_THRESHOLD:
+                diffs.append(abs(value - expected))
+        variant = f"level {level}{' +exit' if early else ''}"
+        print(
+            f"{variant:>18} {agree / len(pairs):>9.1%} {statistics.mean(diffs):>12.4f} "
+            f"{total_time * 1000:>9.1f} {reference_time / total_time:>7.1f}x"
+        )
+
+    for variant, name, expected, value in disagreements:
+        print(f"disagreement: {variant} {name}: skimage {expected:.4f}, fast {value:.4f}")
+
+    print(f"\n{'level':>6} {'threshold':>10} {'agreement':>10}")
+    for level, results in calibrated.items():
+        values = sorted(value for value, _ in results)
+        candidates = [SSIM_THRESHOLD] + [(a + b) / 2 for a, b in zip(values, values[1:])]
+        best = max(candidates, key=lambda t: (sum((v > t) == above for v, above in results), -abs(t - SSIM_THRESHOLD)))
+        agreement = sum((v > best) == above for v, above in results) / len(results)
+        print(f"{level:>6} {best:>10.4f} {agreement:>9.1%}")
+
+
+if __name__ == "__main__":
+    main()
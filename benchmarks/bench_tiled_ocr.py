@@ -0,0 +1,75 @@
+"""Compares tiled, multi-process OCR with a single EasyOCR pass over whole screenshots.
+
+Reports the wall-clock time of both paths and the recall of the tiled path, i.e. the share
+of the text boxes found by the untiled pass that the tiled pass finds too.
+
+Usage:
+    poetry run python benchmarks/bench_tiled_ocr.py screenshot1.png [screenshot2.png ...]
+"""
+import argparse
+import time
+from difflib import SequenceMatcher
+
+from PIL import Image
+
+from robbieg2.easyocr import _read_text, _to_ocr_input, warmup_readers
+from robbieg2.ocr_tiles import OCR_TILE_OVERLAP, OCR_TILE_SIZE, find_all_text_tiled, shutdown_tile_pool, warmup_tile_pool
+
+
+def _matches(expected: dict, found: dict) -> bool:
+    inter_w = min(expected["x"] + expected["w"], found["x"] + found["w"]) - max(expected["x"], found["x"])
+    inter_h = min(expected["y"] + expected["h"], found["y"] + found["h"]) - max(expected["y"], found["y"])
+    if inter_w <= 0 or inter_h <= 0:
+        return False
+    union = expected["w"] * expected["h"] + found["w"] * found["h"] - inter_w * inter_h
+    return (
+        inter_w * inter_h / union >= 0.5
+        and SequenceMatcher(None, expected["text"].lower(), found["text"].lower()).ratio() >= 0.8
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("screenshots", nargs="+")
+    parser.add_argument("--tile-size", type=int, default=OCR_TILE_SIZE)
+    parser.add_argument("--overlap", type=int, default=OCR_TILE_OVERLAP)
+    args = parser.parse_args()
+
+    # Load the models up front, in every tile process too, so that neither path pays for it
+    warmup_readers()
+    warmup_tile_pool()
+
+    total_untiled = total_tiled = 0.0
+    total_expected = total_found = 0
+    for path in args.screenshots:
+        image = _to_ocr_input(Image.open(path))
+
+        start = time.perf_counter()
+        untiled = _read_text(image)
+        untiled_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        tiled = find_all_text_tiled(image, args.tile_size, args.overlap)
+        tiled_time = time.perf_counter() - start
+
+        found = sum(1 for expected in untiled if any(_matches(expected, result) for result in tiled))
+        recall = found / len(untiled) if untiled else 1.0
+        print(
+            f"{path}: {image.shape[1]}x{image.shape[0]}, untiled {untiled_time:.2f}s ({len(untiled)} boxes), "
+            f"tiled {tiled_time:.2f}s ({len(tiled)} boxes), recall {recall:.1%}"
+        )
+        total_untiled += untiled_time
+        total_tiled += tiled_time
+        total_expected += len(untiled)
+        total_found += found
+
+    print(
+        f"total: untiled {total_untiled:.2f}s, tiled {total_tiled:.2f}s, "
+        f"speedup {total_untiled / max(total_tiled, 1e-9):.2f}x, "
+        f"recall {total_found / max(total_expected, 1):.1%}"
+    )
+    shutdown_tile_pool()
+
+
+if __name__ == "__main__":
+    main()
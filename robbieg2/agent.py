@@ -1,6 +1,5 @@
 import logging
 import os
-import time
 import traceback
 from typing import Final, List, Optional, Tuple, Type
 
@@ -20,7 +19,9 @@ from toolfuse.util import AgentUtils
 from .tool import SemanticDesktop, router
 from .clicker import similarity_ratio
 from .cheap_critic import assess_action_result
-from .img import Box, b64_to_image, image_to_b64
+from .fingerprint import ScreenHistory, Visit
+from .vision_worker import vision
+from .img import Box, image_to_b64
 
 
 logging.basicConfig(level=logging.INFO)
@@ -29,6 +30,9 @@ logger.setLevel(int(os.getenv("LOG_LEVEL", str(logging.DEBUG))))
 
 console = Console(force_terminal=True)
 
+LOOP_DEPTH = int(os.getenv("LOOP_DEPTH", 10)) # Number of the last actions whose screens are looked at to catch the agent going in circles
+LOOP_SCREEN_REVISITS = int(os.getenv("LOOP_SCREEN_REVISITS", 1)) # Recent visits of the same screen that, along with a similar recent action, make a loop
+
 
 class RobbieG2Config(BaseModel):
     pass
@@ -102,6 +106,8 @@ class RobbieG2(TaskAgent):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.past_actions = []
+        # The screens the actions were taken on
+        self.screen_history = ScreenHistory()
 
 
     def record_action(self, action: dict) -> None:
@@ -171,7 +177,7 @@ class RobbieG2(TaskAgent):
             task.post_message("Body", f"opening site url {site}...")
             semdesk.desktop.open_url(site)
             console.print("waiting for browser to open...", style="blue")
-            time.sleep(5)
+            semdesk.wait_until_stable(load=True)
 
         # Get info about the desktop
         info = semdesk.desktop.info()
@@ -318,7 +324,7 @@ Let me know when you are ready and I'll send you the first screenshot.
                 console.print("task is done", style="green")
                 return task
 
-            time.sleep(2)
+            semdesk.wait_until_stable()
 
         task.status = TaskStatus.FAILED
         task.save()
@@ -336,16 +342,21 @@ Let me know when you are ready and I'll send you the first screenshot.
         semdesk: SemanticDesktop,
         task: Task,
         thread: RoleThread,
-        current_action: dict
+        current_action: dict,
+        revisits: Optional[List[Visit]] = None,
     ) -> dict:
         try:
             _thread = thread.copy()
-            screenshot_b64 = semdesk.desktop.take_screenshot()
+            screenshot = semdesk.take_frame()
+            revisit_note = (
+                f"The screen looks the same as it did {len(revisits)} time(s) in the last steps, "
+                "so the actions taken since may not have changed anything.\n"
+            ) if revisits else ""
             critic_prompt = f"""
 You task is {task.description}. The screenshot is attached.
 You are attempting to do the following action: {current_action}.
 You have already attempted to do very similar actions very recently. 
-Please assess if the previous actions very successful, and if you are sure that this action is exactly what needs to be done next.
+{revisit_note}Please assess if the previous actions very successful, and if you are sure that this action is exactly what needs to be done next.
 If you are not sure, please consider various alternative options and pick the action that is most likely to lead us toward completing
 the above-mentioned task. 
 Give me the action to be done next, along with yours reasons for that.
@@ -359,7 +370,7 @@ Please return just the raw JSON.
             msg = RoleMessage(
                 role="user",
                 text=critic_prompt,
-                images=[f"data:image/png;base64,{screenshot_b64}"],
+                images=[screenshot.encoded("actor")],
             )
             _thread.add_msg(msg)
 
@@ -438,11 +449,13 @@ Please return just the raw JSON.
             task.post_message("Actor", "🤔 I'm thinking...")
 
             # Take a screenshot of the desktop and post a message with it
-            screenshot_b64 = semdesk.desktop.take_screenshot()
+            # One frame per screenshot: it is encoded once for the debug thread and the actor,
+            # and decoded and converted only once if the critic needs its pixels
+            screenshot = semdesk.take_frame()
             task.post_message(
                 "Actor",
                 "Current image",
-                images=[f"data:image/png;base64,{screenshot_b64}"],
+                images=[screenshot.encoded("actor")],
                 thread="debug",
             )
 
@@ -470,7 +483,7 @@ Please return just the raw JSON.
             msg = RoleMessage(
                 role="user",
                 text=step_prompt,
-                images=[f"data:image/png;base64,{screenshot_b64}"],
+                images=[screenshot.encoded("actor")],
             )
             _thread.add_msg(msg)
 
@@ -522,7 +535,9 @@ Please return just the raw JSON.
                 task.save()
                 return _thread, True
 
-            im_start = b64_to_image(screenshot_b64)
+            im_start = screenshot
+            # The screen the next action of the chain is taken on
+            current = screenshot
             continue_chain = True
             interruption_requested = False
 
@@ -547,14 +562,24 @@ Please return just the raw JSON.
                         f"Closest actions to the current one: {closest_actions}",
                         thread="debug"
                     )
-                if len(closest_actions) >= 2:
+                # Coming back to a screen seen a few actions ago catches a circle even when the
+                # actions that brought us back looked different
+                revisits = self.screen_history.visit(current, depth=LOOP_DEPTH)
+                if revisits:
+                    task.post_message(
+                        "Body",
+                        f"The screen was already seen at steps {[visit.step for visit in revisits]}",
+                        thread="debug",
+                    )
+                # A similar action taken again on a screen we have already been on is a loop as well
+                if len(closest_actions) >= 2 or (len(closest_actions) >= 1 and len(revisits) >= LOOP_SCREEN_REVISITS):
                     task.post_message(
                         "Body",
-                        f"Too many repeated actions. Getting back to Critic.",
+                        f"Too many repeated actions or screens. Getting back to Critic.",
                         thread="debug"
                     )
                     # Well, look like it's time to interrupt the flow and reconsider our life choices. 
-                    new_action = self.interrupt_flow_and_ask_critic(semdesk, task, thread, next_action)
+                    new_action = self.interrupt_flow_and_ask_critic(semdesk, task, thread, next_action, revisits)
                     next_action = new_action
                     # We'll run this updated action and get out of the cycle.
                     interruption_requested = True
@@ -578,24 +603,23 @@ Please return just the raw JSON.
 
                 # We analyze if we want to continue to the next action here. A cheap critic looks at the new screenshot and 
                 # decides if we should continue the chain or not. 
-                screenshot_upd = semdesk.desktop.take_screenshot()
-                im_upd = b64_to_image(screenshot_upd)
+                im_upd = semdesk.take_frame()
                 ssim, continue_chain = assess_action_result(im_start, im_upd)
 
                 # If we were typing text, and the screen changed too much, then we probably hit some hot keys by accident
                 # and scrolled down. We should stop and scroll back up, forcing recovery.
                 if next_action.name == "type_text" and ssim < 0.9:
                     semdesk.desktop.scroll(30) # we may need to adjust this number
+                    semdesk.invalidate_frame()
                     break
 
                 # There is a chance that if the last action was a click, then the result didn't load yet, and the SSIM will be high
-                # while it should be low. To avoid this, we check once again for this specific case in 5 seconds:
+                # while it should be low. To avoid this, we check once again for this specific case once the page has loaded:
                 if next_action.name == "click_object" and ssim > 0.95:
                     task.post_message("Critic", f"😴 Waiting to be sure that the result is loaded...", thread="debug")
-                    time.sleep(5)
-                    screenshot_upd = semdesk.desktop.take_screenshot()
-                    im_upd = b64_to_image(screenshot_upd)
+                    im_upd = semdesk.wait_until_stable(load=True)
                     ssim, continue_chain = assess_action_result(im_start, im_upd)
+                current = im_upd
                 task.post_message("Critic", f"🔍 SSIM: {ssim}", thread="debug")
                 
             return _thread, False
@@ -689,7 +713,8 @@ Please return just the raw JSON.
     @classmethod
     def init(cls) -> None:
         """Initialize the agent class"""
-        return
+        # Load the OCR models once, so the clicks don't pay for that
+        vision.warmup()
 
 
 Agent = RobbieG2
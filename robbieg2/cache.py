@@ -0,0 +1,91 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+
+def content_hash(image: Union[Image.Image, np.ndarray]) -> str:
+    """Computes a fast hash of the pixel content of an image.
+
+    Args:
+        image (Union[Image.Image, np.ndarray]): The image to hash
+
+    Returns:
+        str: Hex digest identifying the pixels, the size and the layout of the image
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    if isinstance(image, Image.Image):
+        hasher.update(f"{image.mode}{image.size}".encode())
+        hasher.update(image.tobytes())
+    else:
+        hasher.update(f"{image.dtype}{image.shape}".encode())
+        hasher.update(np.ascontiguousarray(image).data)
+    return hasher.hexdigest()
+
+
+class LRUCache:
+    """A thread-safe LRU cache bounded both by the number of entries and by their total size in bytes.
+
+    The size of an entry is given by the caller when storing it, the cache itself does not
+    try to measure the values.
+    """
+
+    def __init__(self, max_entries: int = 128, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Returns the cached value for the key, or None if there is none."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int = 0) -> None:
+        """Stores a value, evicting the least recently used entries to stay within bounds.
+
+        Args:
+            key (Hashable): Cache key
+            value (Any): Value to store
+            size (int): Approximate size of the value in bytes. Defaults to 0.
+        """
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Returns the hit/miss counters and the current occupancy of the cache."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
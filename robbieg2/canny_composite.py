@@ -1,92 +1,214 @@
-import cv2
+import math
+import os
+from functools import lru_cache
+from typing import List, Optional
+
 import numpy as np
-from sklearn.cluster import AgglomerativeClustering
 from PIL import Image, ImageDraw, ImageFont
 
 
+GROUP_MARGIN = 10  # How far from a grouped contour the top-left corner of a new one may be to join its group
+MIN_CONTOUR_AREA = 100  # Contours with a smaller bounding box are ignored
+GROUP_INDEX_CELL_SIZE = 64  # Cell size of the spatial index used for grouping
+CLUSTERING_METHOD = os.getenv("CLUSTERING_METHOD", "grid")  # How element boxes are clustered, see CLUSTERING_METHODS
+CLUSTERING_CELLS_PER_CLUSTER = 4  # Grid cells per requested cluster for the grid method
+COMPOSITE_LAYOUT = os.getenv("COMPOSITE_LAYOUT", "vertical")  # Original "vertical" stack, or a "packed" 2D sheet
+COMPOSITE_MAX_PIXELS = int(os.getenv("COMPOSITE_MAX_PIXELS", 2_000_000))  # Pixel budget of a packed composite
+COMPOSITE_LABEL_WIDTH = 70  # Width of the number column of each section in a packed composite
+COMPOSITE_PADDING = 4  # Space around each section in a packed composite
+
+
 def improved_canny(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    import cv2
+
+    return improved_canny_gray(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+
+def improved_canny_gray(gray):
+    import cv2
+
     blurred = cv2.GaussianBlur(gray, (5, 5), 0)
     edges = cv2.Canny(blurred, 50, 150)
     dilated = cv2.dilate(edges, None, iterations=2)
     return dilated
 
+
+class _GridIndex:
+    """A uniform grid over rectangles, answering which of them contain a point."""
+
+    def __init__(self, cell_size: int = GROUP_INDEX_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.rects = []
+
+    def insert(self, item, left: int, top: int, right: int, bottom: int) -> None:
+        self.rects.append((item, left, top, right, bottom))
+        entry = len(self.rects) - 1
+        for cx in range(left // self.cell_size, right // self.cell_size + 1):
+            for cy in range(top // self.cell_size, bottom // self.cell_size + 1):
+                self.cells.setdefault((cx, cy), []).append(entry)
+
+    def query(self, x: int, y: int) -> list:
+        found = []
+        for entry in self.cells.get((x // self.cell_size, y // self.cell_size), ()):
+            item, left, top, right, bottom = self.rects[entry]
+            if left <= x <= right and top <= y <= bottom:
+                found.append(item)
+        return found
+
+
 def group_elements(binary_image):
+    """Groups the contours of the edge map.
+
+    A contour joins the first group (in order of creation) having a member whose bounding box,
+    grown by GROUP_MARGIN, contains the top-left corner of the contour's bounding box; otherwise
+    it starts a new group. The grown boxes are kept in a spatial index, so every contour is only
+    compared with the few members around its corner instead of with every grouped contour.
+    """
+    import cv2
+
     contours, _ = cv2.findContours(binary_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
+    if len(contours) == 0:
+        return []
+
+    rects = np.array([cv2.boundingRect(contour) for contour in contours])
+    index = _GridIndex()
     grouped_contours = []
-    for contour in contours:
-        x, y, w, h = cv2.boundingRect(contour)
-        if w * h < 100:  # Ignore very small contours
+    for contour, (x, y, w, h) in zip(contours, rects.tolist()):
+        if w * h < MIN_CONTOUR_AREA:  # Ignore very small contours
             continue
-        merged = False
-        for group in grouped_contours:
-            if any(cv2.boundingRect(c)[0] - 10 <= x <= cv2.boundingRect(c)[0] + cv2.boundingRect(c)[2] + 10 and
-                   cv2.boundingRect(c)[1] - 10 <= y <= cv2.boundingRect(c)[1] + cv2.boundingRect(c)[3] + 10 for c in group):
-                group.append(contour)
-                merged = True
-                break
-        if not merged:
+        matching_groups = index.query(x, y)
+        if matching_groups:
+            group_id = min(matching_groups)
+            grouped_contours[group_id].append(contour)
+        else:
+            group_id = len(grouped_contours)
             grouped_contours.append([contour])
-    
+        index.insert(group_id, x - GROUP_MARGIN, y - GROUP_MARGIN, x + w + GROUP_MARGIN, y + h + GROUP_MARGIN)
+
     return grouped_contours
 
 def extract_bounding_boxes(grouped_contours):
+    import cv2
+
     bounding_boxes = []
     for group in grouped_contours:
         x, y, w, h = cv2.boundingRect(np.concatenate(group))
         bounding_boxes.append((x, y, w, h))
     return bounding_boxes
 
-def cluster_bounding_boxes(bounding_boxes, num_clusters):
+def _cluster_labels_agglomerative(centroids: np.ndarray, num_clusters: int) -> np.ndarray:
+    """Ward agglomerative clustering of the centroids, quadratic in time and memory."""
+    from sklearn.cluster import AgglomerativeClustering
+
+    return AgglomerativeClustering(n_clusters=num_clusters).fit_predict(centroids)
+
+
+def _cluster_labels_grid(centroids: np.ndarray, num_clusters: int) -> np.ndarray:
+    """Grid-bucketing clustering of the centroids, linear in their number.
+
+    The centroids are bucketed into a grid of a few cells per requested cluster, then the
+    occupied cells are merged pairwise with the Ward criterion (the same as the agglomerative
+    method, but on a handful of weighted cells instead of on every box) until at most
+    `num_clusters` are left.
+    """
+    side = math.ceil(math.sqrt(CLUSTERING_CELLS_PER_CLUSTER * num_clusters))
+    low = centroids.min(axis=0)
+    extent = np.maximum(centroids.max(axis=0) - low, 1e-9)
+    cells = np.minimum(((centroids - low) / extent * side).astype(int), side - 1)
+    cell_ids = cells[:, 1] * side + cells[:, 0]  # Row-major, so clusters come out top to bottom
+
+    occupied, labels = np.unique(cell_ids, return_inverse=True)
+    counts = np.bincount(labels).astype(float)
+    means = np.stack([np.bincount(labels, weights=centroids[:, axis]) for axis in (0, 1)], axis=1) / counts[:, None]
+    members = [[i] for i in range(len(occupied))]
+
+    while len(members) > num_clusters:
+        # Ward cost of merging each pair of clusters
+        distances = ((means[:, None, :] - means[None, :, :]) ** 2).sum(axis=2)
+        costs = counts[:, None] * counts[None, :] / (counts[:, None] + counts[None, :]) * distances
+        np.fill_diagonal(costs, np.inf)
+        a, b = sorted(np.unravel_index(np.argmin(costs), costs.shape))
+        means[a] = (means[a] * counts[a] + means[b] * counts[b]) / (counts[a] + counts[b])
+        counts[a] += counts[b]
+        members[a] += members[b]
+        means = np.delete(means, b, axis=0)
+        counts = np.delete(counts, b)
+        del members[b]
+
+    cluster_of_cell = np.empty(len(occupied), dtype=int)
+    for cluster, cell_labels in enumerate(members):
+        cluster_of_cell[cell_labels] = cluster
+    return cluster_of_cell[labels]
+
+
+CLUSTERING_METHODS = {
+    "grid": _cluster_labels_grid,
+    "agglomerative": _cluster_labels_agglomerative,
+}
+
+
+def cluster_bounding_boxes(bounding_boxes, num_clusters, method: str = CLUSTERING_METHOD):
+    """Clusters the bounding boxes into at most `num_clusters` regions.
+
+    Args:
+        bounding_boxes: Boxes as (x, y, w, h)
+        num_clusters (int): Maximum number of regions
+        method (str): One of CLUSTERING_METHODS. Defaults to CLUSTERING_METHOD.
+
+    Returns:
+        The (x, y, w, h) box of each region, encompassing all its boxes
+    """
+    return cluster_members(bounding_boxes, num_clusters, method)[0]
+
+def cluster_members(bounding_boxes, num_clusters, method: str = CLUSTERING_METHOD):
+    """Same as `cluster_bounding_boxes`, also returning the indices of the boxes in each region."""
     if len(bounding_boxes) <= num_clusters:
-        return bounding_boxes
+        return list(bounding_boxes), [[i] for i in range(len(bounding_boxes))]
 
+    boxes = np.asarray(bounding_boxes)
     # Calculate the centroids of the bounding boxes
-    centroids = np.array([
-        [box[0] + box[2] / 2, box[1] + box[3] / 2] for box in bounding_boxes
-    ])
+    centroids = boxes[:, :2] + boxes[:, 2:] / 2
+    labels = CLUSTERING_METHODS[method](centroids, num_clusters)
 
-    # Apply Hierarchical clustering (Agglomerative Clustering)
-    agg_clustering = AgglomerativeClustering(n_clusters=num_clusters)
-    labels = agg_clustering.fit_predict(centroids)
+    # Calculate the bounding box that encompasses all boxes of each cluster
+    num_labels = labels.max() + 1
+    min_xy = np.full((num_labels, 2), np.iinfo(boxes.dtype).max, dtype=boxes.dtype)
+    max_xy = np.full((num_labels, 2), np.iinfo(boxes.dtype).min, dtype=boxes.dtype)
+    np.minimum.at(min_xy, labels, boxes[:, :2])
+    np.maximum.at(max_xy, labels, boxes[:, :2] + boxes[:, 2:])
 
-    # Calculate bounding boxes for each cluster
     cluster_bounding_boxes = []
-    for i in range(num_clusters):
-        cluster_boxes = [box for box, label in zip(bounding_boxes, labels) if label == i]
-        if cluster_boxes:
-            # Find the minimum and maximum coordinates for all boxes in the cluster
-            min_x = min(box[0] for box in cluster_boxes)
-            min_y = min(box[1] for box in cluster_boxes)
-            max_x = max(box[0] + box[2] for box in cluster_boxes)
-            max_y = max(box[1] + box[3] for box in cluster_boxes)
-            
-            # Calculate the dimensions of the bounding box that encompasses all boxes
-            width = max_x - min_x
-            height = max_y - min_y
-            
-            # Create a new bounding box that encompasses all boxes in the cluster
-            cluster_box = (min_x, min_y, width, height)
-            cluster_bounding_boxes.append(cluster_box)
-
-    return cluster_bounding_boxes
-
-def create_composite_image(bounding_boxes, image):
+    members = []
+    for i in range(num_labels):
+        if min_xy[i, 0] <= max_xy[i, 0]:
+            width, height = (max_xy[i] - min_xy[i]).tolist()
+            cluster_bounding_boxes.append((int(min_xy[i, 0]), int(min_xy[i, 1]), width, height))
+            members.append(np.flatnonzero(labels == i).tolist())
+
+    return cluster_bounding_boxes, members
+
+def _section(image: np.ndarray, box, upscale: int = 1) -> Image.Image:
+    """Crops a section of the image, upscaled with the same pixels as a nearest-neighbour resize."""
+    crop = image[box[1]:box[1] + box[3], box[0]:box[0] + box[2]]
+    if upscale != 1:
+        crop = np.repeat(np.repeat(crop, upscale, axis=0), upscale, axis=1)
+    return Image.fromarray(crop)
+
+def create_composite_image(bounding_boxes, image, upscale: int = 1):
+    if isinstance(image, Image.Image):
+        image = _to_rgb_array(image)
+    # The sections are cropped from the image as is and only then upscaled
+    sizes = [(box[2] * upscale, box[3] * upscale) for box in bounding_boxes]
     number_column_width = 100
-    image_column_width = max(box[2] for box in bounding_boxes)
-    row_heights = [box[3] + 4 for box in bounding_boxes]
+    image_column_width = max(width for width, _ in sizes)
+    row_heights = [height + 4 for _, height in sizes]
     total_width = number_column_width + image_column_width + 1  # +1 for rightmost line
     total_height = sum(row_heights) + len(bounding_boxes) + 1  # +1 for each row separator and bottom line
     
     composite = Image.new('RGB', (total_width, total_height), color='white')
     draw = ImageDraw.Draw(composite)
     
-    try:
-        font = ImageFont.truetype("./font/arialbd.ttf", 30)
-    except IOError:
-        font = ImageFont.load_default()
-        print("Arial font not found in ./font directory. Using default font.")
+    font = _load_font(30)
     
     # Draw grid lines
     for i in range(len(bounding_boxes) + 1):
@@ -107,14 +229,14 @@ def create_composite_image(bounding_boxes, image):
         draw.text((text_x, text_y), number_text, font=font, fill='red')
         
         # Paste image slice
-        box_pil = image.crop((box[0], box[1], box[0] + box[2], box[1] + box[3]))
+        box_pil = _section(image, box, upscale)
         paste_x = number_column_width + 1
         composite.paste(box_pil, (paste_x, y_offset + 2))
         # Draw a rectangle around the pasted image
         draw.rectangle(
             [
                 (paste_x, y_offset + 2),
-                (paste_x + box[2] - 1, y_offset + 2 + box[3] - 1)
+                (paste_x + sizes[i][0] - 1, y_offset + 2 + sizes[i][1] - 1)
             ],
             outline="green",
             width=2
@@ -124,13 +246,226 @@ def create_composite_image(bounding_boxes, image):
     
     return composite
 
-def create_composite(image_path, num_clusters):
-    image = cv2.imread(image_path)
-    pil_image = Image.open(image_path)
+@lru_cache(maxsize=8)
+def _load_font(size: int):
+    try:
+        return ImageFont.truetype("./font/arialbd.ttf", size)
+    except IOError:
+        print("Arial font not found in ./font directory. Using default font.")
+        return ImageFont.load_default()
+
+def _shelf_pack(sizes, sheet_width):
+    """Places the cells on shelves of the given width, tallest first; returns their positions and the sheet height."""
+    positions = [None] * len(sizes)
+    x = y = shelf_height = 0
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+        width, height = sizes[i]
+        if x > 0 and x + width > sheet_width:
+            y += shelf_height
+            x = shelf_height = 0
+        positions[i] = (x, y)
+        x += width
+        shelf_height = max(shelf_height, height)
+    return positions, y + shelf_height
+
+def pack_cells(sizes):
+    """Packs cells of the given (width, height) sizes into a compact 2D sheet.
+
+    Tries a few sheet widths around the square root of the total area and keeps the packing
+    with the shortest long side, i.e. the one closest to a square without wasting space.
+
+    Returns:
+        The (x, y) position of every cell, and the width and height of the sheet
+    """
+    widest = max(width for width, _ in sizes)
+    area = sum(width * height for width, height in sizes)
+    candidates = {widest, sum(width for width, _ in sizes)}
+    candidates |= {max(widest, int(math.sqrt(area) * factor)) for factor in (0.8, 1.0, 1.2, 1.5, 2.0)}
+
+    best = None
+    for sheet_width in sorted(candidates):
+        positions, sheet_height = _shelf_pack(sizes, sheet_width)
+        used_width = max(x + width for (x, _), (width, _) in zip(positions, sizes))
+        score = (max(used_width, sheet_height), used_width * sheet_height)
+        if best is None or score < best[0]:
+            best = (score, positions, used_width, sheet_height)
+    return best[1], best[2], best[3]
+
+def create_packed_composite_image(bounding_boxes, image, upscale: int = 1, max_pixels=COMPOSITE_MAX_PIXELS):
+    """Creates the composite as a compact 2D sheet of numbered sections.
+
+    Section `i + 1` shows `bounding_boxes[i]`, like in the vertical layout, but the sections are
+    shelf-packed instead of stacked, and scaled down together if needed so that the sheet stays
+    within `max_pixels`. The sections are resized once, from the image as is to their final size.
+    """
+    if isinstance(image, Image.Image):
+        image = _to_rgb_array(image)
+    font = _load_font(30)
+    min_height = 40  # Room for the number
+
+    scale = float(upscale)
+    for _ in range(5):
+        crop_sizes = [(max(round(box[2] * scale), 1), max(round(box[3] * scale), 1)) for box in bounding_boxes]
+        cell_sizes = [
+            (COMPOSITE_LABEL_WIDTH + width + 2 * COMPOSITE_PADDING, max(height, min_height) + 2 * COMPOSITE_PADDING)
+            for width, height in crop_sizes
+        ]
+        positions, total_width, total_height = pack_cells(cell_sizes)
+        if total_width * total_height <= max_pixels:
+            break
+        scale *= math.sqrt(max_pixels / (total_width * total_height)) * 0.97
+
+    composite = Image.new('RGB', (total_width, total_height), color='white')
+    draw = ImageDraw.Draw(composite)
+    for i, (box, (x, y), (cell_width, cell_height), (width, height)) in enumerate(
+        zip(bounding_boxes, positions, cell_sizes, crop_sizes)
+    ):
+        draw.rectangle([(x, y), (x + cell_width - 1, y + cell_height - 1)], outline='black', width=1)
+
+        # Draw number
+        number_text = str(i + 1)
+        text_bbox = draw.textbbox((0, 0), number_text, font=font)
+        text_x = x + (COMPOSITE_LABEL_WIDTH - (text_bbox[2] - text_bbox[0])) // 2
+        text_y = y + (cell_height - (text_bbox[3] - text_bbox[1])) // 2 - text_bbox[1]
+        draw.text((text_x, text_y), number_text, font=font, fill='red')
+
+        # Paste image slice
+        box_pil = Image.fromarray(image[box[1]:box[1] + box[3], box[0]:box[0] + box[2]])
+        if (width, height) != box_pil.size:
+            # Enlarged sections keep the crisp pixels of the zoomed region the model also sees
+            resample = Image.NEAREST if scale >= 1 else Image.LANCZOS
+            box_pil = box_pil.resize((width, height), resample=resample)
+        paste_x = x + COMPOSITE_LABEL_WIDTH
+        paste_y = y + COMPOSITE_PADDING
+        composite.paste(box_pil, (paste_x, paste_y))
+        draw.rectangle([(paste_x, paste_y), (paste_x + width - 1, paste_y + height - 1)], outline="green", width=2)
+
+    return composite
+
+COMPOSITE_LAYOUTS = {
+    "packed": create_packed_composite_image,
+    "vertical": create_composite_image,
+}
+
+def _to_rgb_array(image) -> np.ndarray:
+    """Decodes the image once into an RGB array; arrays are assumed to be RGB(A) or grayscale already."""
+    if isinstance(image, str):
+        image = Image.open(image)
+    if isinstance(image, Image.Image):
+        return np.asarray(image if image.mode == "RGB" else image.convert("RGB"))
+    if image.ndim == 2:
+        return np.repeat(image[:, :, None], 3, axis=2)
+    return image[:, :, :3]
+
+class RegionNode:
+    """A region of a screenshot with the element boxes inside it, all as absolute (x, y, w, h).
+
+    Its children are the clusters of its elements, computed on first access and then kept,
+    so that zooming into the same region again costs nothing.
+    """
+
+    def __init__(self, tree: "RegionTree", box: tuple, elements: list):
+        self.tree = tree
+        self.box = box
+        self.elements = elements
+        self._children: Optional[List["RegionNode"]] = None
+
+    def children(self) -> List["RegionNode"]:
+        if self._children is None:
+            self._children = []
+            # A single element cannot be split any further by clustering
+            if len(self.elements) > 1:
+                regions, members = cluster_members(self.elements, self.tree.num_clusters)
+                for region, indices in zip(regions, members):
+                    self._children.append(self.tree.add(region, [self.elements[i] for i in indices]))
+        return self._children
+
+
+class RegionTree:
+    """Hierarchy of the clustered regions of a screenshot.
+
+    It is built from the element boxes of the screenshot, found once at the native resolution
+    by its `features.FeatureStore`, and every zoom level only clusters the elements of the
+    selected region. Regions that were not produced by the tree, like a grid cell, get an
+    ad-hoc node with the elements clipped to them.
+    """
+
+    def __init__(self, elements: list, width: int, height: int, num_clusters: int):
+        self.num_clusters = num_clusters
+        self.width, self.height = width, height
+        self._nodes = {}
+        self.root = self.add((0, 0, width, height), elements)
+
+    def add(self, box: tuple, elements: list) -> RegionNode:
+        node = self._nodes.get(box)
+        if node is None:
+            node = self._nodes[box] = RegionNode(self, box, elements)
+        return node
+
+    def clip(self, box) -> tuple:
+        """Converts a `Box` or an (x, y, w, h) to an (x, y, w, h) inside the screenshot."""
+        if hasattr(box, "left"):
+            box = (box.left, box.top, box.right - box.left, box.bottom - box.top)
+        left, top = max(int(box[0]), 0), max(int(box[1]), 0)
+        right, bottom = min(int(box[0] + box[2]), self.width), min(int(box[1] + box[3]), self.height)
+        return (left, top, max(right - left, 0), max(bottom - top, 0))
+
+    def node(self, box=None) -> RegionNode:
+        """Returns the node of an absolute region, given as a `Box` or as (x, y, w, h); the root if None."""
+        if box is None:
+            return self.root
+        box = self.clip(box)
+        if box in self._nodes:
+            return self._nodes[box]
+        return self.add(box, clip_boxes(self.root.elements, box))
+
+
+def clip_boxes(boxes, region) -> list:
+    """Clips (x, y, w, h) boxes to a region, dropping the ones outside of it."""
+    left, top, width, height = region
+    right, bottom = left + width, top + height
+    clipped = []
+    for x, y, w, h in boxes:
+        x1, y1 = max(x, left), max(y, top)
+        x2, y2 = min(x + w, right), min(y + h, bottom)
+        if x1 < x2 and y1 < y2:
+            clipped.append((x1, y1, x2 - x1, y2 - y1))
+    return clipped
+
+def create_region_composite(image, num_clusters, box=None, upscale: int = 1, image_hash: Optional[str] = None):
+    """Builds the composite of the sections of a region of a screenshot from its region tree.
+
+    Nothing is computed on the upscaled region: its sections are the children of its node in
+    the tree of the screenshot, and a region whose elements cannot be split any further is
+    split by grouping its own part of the native edge map. Only the sections of the composite
+    are upscaled, since that is the image the model sees.
+
+    Args:
+        image: The whole screenshot, as a PIL image, an RGB array or a path to a file
+        num_clusters (int): Maximum number of sections
+        box: The region, as an absolute `Box` or (x, y, w, h). Defaults to None, the whole screenshot.
+        upscale (int): Upscale of the region image the caller works with. Defaults to 1.
+        image_hash (str): Content hash of the screenshot, computed if not given. Defaults to None.
+
+    Returns:
+        The composite image and the (x, y, w, h) boxes of its sections, relative to the
+        region upscaled by `upscale`
+    """
+    from .features import feature_store
+
+    features = feature_store(image, image_hash)
+    tree = features.region_tree(num_clusters)
+    node = tree.node(box)
+    children = node.children()
+    if len(children) < 2:
+        # Within the region, contours are no longer merged with the ones around it
+        node = RegionNode(tree, node.box, features.elements_in(node.box))
+        children = node.children() or [node]
 
-    edges = improved_canny(image)
-    grouped_contours = group_elements(edges)
-    bounding_boxes = extract_bounding_boxes(grouped_contours)
-    clustered_boxes = cluster_bounding_boxes(bounding_boxes, num_clusters)
-    composite_image = create_composite_image(clustered_boxes, pil_image)
-    return composite_image, clustered_boxes
+    left, top = node.box[:2]
+    composite_image = COMPOSITE_LAYOUTS[COMPOSITE_LAYOUT]([child.box for child in children], features.rgb, upscale)
+    section_boxes = [
+        ((x - left) * upscale, (y - top) * upscale, w * upscale, h * upscale)
+        for x, y, w, h in (child.box for child in children)
+    ]
+    return composite_image, section_boxes
@@ -0,0 +1,105 @@
+import os
+from typing import List, NamedTuple, Union
+
+import numpy as np
+from PIL import Image
+
+from .img import Box, ImageHandle, as_handle
+
+CHANGE_BLOCK_SIZE = int(os.getenv("CHANGE_BLOCK_SIZE", 16)) # Side of the blocks the frames are compared by
+CHANGE_PIXEL_THRESHOLD = int(os.getenv("CHANGE_PIXEL_THRESHOLD", 16)) # Smallest gray level difference of a changed pixel
+CHANGE_BLOCK_MIN_PIXELS = int(os.getenv("CHANGE_BLOCK_MIN_PIXELS", 4)) # Changed pixels for a block to be changed, filters noise
+CHANGE_MERGE_GAP = int(os.getenv("CHANGE_MERGE_GAP", 2)) # Changed blocks at most this many blocks apart end up in one rectangle
+
+
+class Changes(NamedTuple):
+    """Where two frames differ."""
+    boxes: List[Box]  # Merged rectangles covering all the changed blocks
+    fraction: float  # Share of the frame covered by changed blocks
+    blocks: int = 0  # Number of changed blocks
+
+    def __bool__(self) -> bool:
+        return bool(self.boxes)
+
+
+def _gray(image: Union[Image.Image, ImageHandle, np.ndarray]) -> np.ndarray:
+    if isinstance(image, np.ndarray):
+        return image
+    return as_handle(image).gray
+
+
+def detect_changes(
+    before: Union[Image.Image, ImageHandle, np.ndarray],
+    after: Union[Image.Image, ImageHandle, np.ndarray],
+    block_size: int = CHANGE_BLOCK_SIZE,
+) -> Changes:
+    """Finds the regions that changed between two frames of the same size.
+
+    Pixels differing by more than CHANGE_PIXEL_THRESHOLD are counted per block with one
+    vectorized reduction, and neighbouring changed blocks are merged into rectangles with
+    connected components.
+
+    Args:
+        before: The earlier frame, as an image, a handle or a grayscale array
+        after: The later frame
+        block_size (int): Side of the blocks. Defaults to CHANGE_BLOCK_SIZE.
+
+    Returns:
+        Changes: The changed rectangles in pixel coordinates, the changed share of the frame and the number of changed blocks
+    """
+    import cv2
+
+    gray1, gray2 = _gray(before), _gray(after)
+    if gray1.shape != gray2.shape:
+        height, width = gray2.shape[:2]
+        return Changes([Box(0, 0, width, height)], 1.0, -(-height // block_size) * -(-width // block_size))
+
+    height, width = gray1.shape
+    changed = cv2.absdiff(gray1, gray2) > CHANGE_PIXEL_THRESHOLD
+
+    # Pad to whole blocks, then count the changed pixels of every block at once
+    rows, cols = -(-height // block_size), -(-width // block_size)
+    padded = np.zeros((rows * block_size, cols * block_size), dtype=np.uint8)
+    padded[:height, :width] = changed
+    counts = padded.reshape(rows, block_size, cols, block_size).sum(axis=(1, 3))
+    blocks = (counts >= CHANGE_BLOCK_MIN_PIXELS).astype(np.uint8)
+    if not blocks.any():
+        return Changes([], 0.0)
+    fraction = float(blocks.mean())
+    changed_blocks = int(blocks.sum())
+
+    if CHANGE_MERGE_GAP > 0:
+        kernel = np.ones((2 * CHANGE_MERGE_GAP + 1, 2 * CHANGE_MERGE_GAP + 1), dtype=np.uint8)
+        merged = cv2.dilate(blocks, kernel)
+    else:
+        merged = blocks
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(merged, connectivity=8)
+
+    boxes = []
+    for label in range(1, count):
+        # Shrink the dilated component back to the changed blocks inside it
+        ys, xs = np.nonzero((labels == label) & (blocks > 0))
+        if len(xs) == 0:
+            continue
+        boxes.append(Box(
+            int(xs.min()) * block_size,
+            int(ys.min()) * block_size,
+            min((int(xs.max()) + 1) * block_size, width),
+            min((int(ys.max()) + 1) * block_size, height),
+        ))
+    return Changes(boxes, fraction, changed_blocks)
+
+
+def overlaps(box: Box, x: int, y: int, w: int, h: int) -> bool:
+    return x < box.right and x + w > box.left and y < box.bottom and y + h > box.top
+
+
+def unaffected(results: List[dict], changes: Changes) -> List[dict]:
+    """Returns the results with an (x, y, w, h) box, like text boxes, that no changed region touches.
+
+    Caches of results located on the screen keep these and only recompute the changed regions.
+    """
+    return [
+        result for result in results
+        if not any(overlaps(box, result["x"], result["y"], result["w"], result["h"]) for box in changes.boxes)
+    ]
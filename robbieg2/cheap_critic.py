@@ -1,20 +1,67 @@
-import cv2
+import os
+from typing import Optional, Union
+
 from PIL import Image
 import numpy as np
-from skimage.metrics import structural_similarity as ssim
 
-def assess_action_result(starting_image: Image.Image, updated_image: Image.Image) -> (float, bool):
+from .change_detection import detect_changes
+from .img import ImageHandle, as_handle
+from .vision_worker import vision
+
+SSIM_THRESHOLD = 0.9 # The chain of actions continues while the screen stays more similar than this
+SSIM_METHOD = os.getenv("SSIM_METHOD", "fast") # "fast" box-filter SSIM on a pyramid level, or the full resolution "skimage" one
+SSIM_LEVEL = int(os.getenv("SSIM_LEVEL", 0)) # Pyramid level of the fast SSIM, each level halves the width and the height
+# Above level 0 the SSIM reads lower than at full resolution, see benchmarks/bench_ssim.py for a matching threshold
+SSIM_BAND_ROWS = 64 # Rows of a band of the fast SSIM, the early exit is checked after each band
+
+# Constants of skimage.metrics.structural_similarity for 8-bit images and its default 7x7 window
+_WIN_SIZE = 7
+_C1 = (0.01 * 255) ** 2
+_C2 = (0.03 * 255) ** 2
+_COV_NORM = _WIN_SIZE ** 2 / (_WIN_SIZE ** 2 - 1)
+
+
+def assess_action_result(
+    starting_image: Union[Image.Image, ImageHandle], updated_image: Union[Image.Image, ImageHandle]
+) -> (float, bool):
     """Cheap critic returns True if the chain of actions can be continued and False otherwise.
     In the current version, we continue if the SSIM is above a threshold (i.e. the images are visually similar).
+    The grayscale versions of handles are computed once, so comparing against the same start is cheaper.
+    When nothing changed at all, the SSIM is not computed.
     """
-    threshold = 0.9
-    ssim = compare_images(starting_image, updated_image)
+    threshold = SSIM_THRESHOLD
+    if not detect_changes(starting_image, updated_image):
+        return 1.0, True
+    if SSIM_METHOD == "fast":
+        # Only the pyramid level is handed over, frames keep theirs for the next comparison
+        ssim = vision.compare_images(
+            _pyramid_level(starting_image), _pyramid_level(updated_image), level=0, threshold=threshold
+        ).result()
+    else:
+        ssim = vision.compare_images(
+            as_handle(starting_image).gray, as_handle(updated_image).gray, method="skimage"
+        ).result()
     if ssim > threshold:
         return ssim, True
     else:
         return ssim, False
 
+def _pyramid_level(image: Union[Image.Image, ImageHandle], level: int = SSIM_LEVEL) -> np.ndarray:
+    if hasattr(image, "pyramid"):
+        return image.pyramid(level)
+    return downscale(as_handle(image).gray, level)
+
+def downscale(gray: np.ndarray, level: int) -> np.ndarray:
+    """Halves a grayscale image `level` times with area averaging, like `Frame.pyramid`"""
+    import cv2
+
+    for _ in range(level):
+        gray = cv2.resize(gray, (max(gray.shape[1] // 2, 1), max(gray.shape[0] // 2, 1)), interpolation=cv2.INTER_AREA)
+    return gray
+
 def _pil_to_cv2(pil_image):
+    import cv2
+
     # Ensure the image is in RGB mode
     if pil_image.mode != 'RGB':
         pil_image = pil_image.convert('RGB')
@@ -24,16 +71,89 @@ def _pil_to_cv2(pil_image):
     cv2_image = cv2.cvtColor(np_image, cv2.COLOR_RGB2BGR)
     return cv2_image
 
-def compare_images(image1, image2):
-    image1 = _pil_to_cv2(image1)
-    image2 = _pil_to_cv2(image2)
+def _to_gray(image):
+    import cv2
+
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return image
+        image = Image.fromarray(image)
+    return cv2.cvtColor(_pil_to_cv2(image), cv2.COLOR_BGR2GRAY)
+
+def fast_ssim(gray1: np.ndarray, gray2: np.ndarray, threshold: Optional[float] = None) -> float:
+    """SSIM of two 8-bit grayscale images, the same as skimage's default one, computed with box filters.
+
+    The SSIM map is computed band by band and only summed, never kept. With a threshold, the
+    computation stops as soon as the mean cannot exceed it anymore, even if every remaining
+    window were identical; the returned value is then that upper bound, which is below the threshold.
 
-    # Convert the images to grayscale
-    gray1 = cv2.cvtColor(image1, cv2.COLOR_BGR2GRAY)
-    gray2 = cv2.cvtColor(image2, cv2.COLOR_BGR2GRAY)
+    Args:
+        gray1 (np.ndarray): First image
+        gray2 (np.ndarray): Second image, of the same size
+        threshold (Optional[float]): Threshold of the decision the SSIM is used for. Defaults to None.
+
+    Returns:
+        float: The mean SSIM, or an upper bound of it below the threshold
+    """
+    import cv2
+
+    if gray1.shape != gray2.shape:
+        raise ValueError("Images must have the same dimensions.")
+    pad = (_WIN_SIZE - 1) // 2
+    height, width = gray1.shape
+    rows, cols = height - 2 * pad, width - 2 * pad
+    if rows <= 0 or cols <= 0:
+        raise ValueError(f"Images must be at least {_WIN_SIZE}x{_WIN_SIZE}")
+    total = rows * cols
+
+    def box(values: np.ndarray) -> np.ndarray:
+        # Mean over the window, keeping only the windows that fit in the band
+        return cv2.boxFilter(values, -1, (_WIN_SIZE, _WIN_SIZE), normalize=True)[pad:-pad, pad:-pad]
+
+    ssim_sum = 0.0
+    done = 0
+    for start in range(pad, height - pad, SSIM_BAND_ROWS):
+        end = min(start + SSIM_BAND_ROWS, height - pad)
+        x = gray1[start - pad:end + pad].astype(np.float32)
+        y = gray2[start - pad:end + pad].astype(np.float32)
+
+        ux, uy = box(x), box(y)
+        vx = _COV_NORM * (box(x * x) - ux * ux)
+        vy = _COV_NORM * (box(y * y) - uy * uy)
+        vxy = _COV_NORM * (box(x * y) - ux * uy)
+        ssim_map = ((2 * ux * uy + _C1) * (2 * vxy + _C2)) / ((ux * ux + uy * uy + _C1) * (vx + vy + _C2))
+
+        ssim_sum += float(ssim_map.sum(dtype=np.float64))
+        done += ssim_map.size
+        # The remaining windows can add at most 1 each
+        if threshold is not None and (ssim_sum + (total - done)) / total < threshold:
+            return (ssim_sum + (total - done)) / total
+    return ssim_sum / total
+
+def compare_images(image1, image2, level: int = SSIM_LEVEL, threshold: Optional[float] = None, method: str = SSIM_METHOD):
+    """SSIM between two images or grayscale arrays.
+
+    Args:
+        image1: First image
+        image2: Second image
+        level (int): Pyramid level the fast method works on. Defaults to SSIM_LEVEL.
+        threshold (Optional[float]): Lets the fast method stop early below it, see `fast_ssim`. Defaults to None.
+        method (str): "fast" or "skimage". Defaults to SSIM_METHOD.
+
+    Returns:
+        float: The SSIM
+    """
+    # Grayscale arrays are compared as they are
+    gray1 = _to_gray(image1)
+    gray2 = _to_gray(image2)
+
+    if method == "fast":
+        similarity_index = fast_ssim(downscale(gray1, level), downscale(gray2, level), threshold)
+    else:
+        from skimage.metrics import structural_similarity as ssim
 
-    # Compute SSIM between the two images
-    similarity_index, diff = ssim(gray1, gray2, full=True)
+        # Compute SSIM between the two images
+        similarity_index = ssim(gray1, gray2)
 
     print(f"SSIM: {similarity_index}")
     return similarity_index
@@ -3,22 +3,25 @@ import logging
 import os
 import re
 
-from typing import List, Optional, Tuple
+from typing import List, Optional, Tuple, Union
 
+import numpy as np
 from PIL import Image, ImageDraw
 from difflib import SequenceMatcher
-from mllm import RoleMessage, RoleThread, Router
+from mllm import RoleMessage, RoleThread
 from pydantic import BaseModel, Field
 from rich.console import Console
 from rich.json import JSON
 from threadmem import RoleThread, RoleMessage
 
-from .img import Box, b64_to_image, image_to_b64
-from .grid import create_grid_image, zoom_in, superimpose_images
-from .easyocr import find_all_text_with_bounding_boxes
-from .canny_composite import create_composite
+from .change_detection import detect_changes
+from .frame import Frame
+from .img import Box, ImageHandle, as_handle, encode_image
+from .region import Region
+from .grid import overlay_grid, zoom_in
+from .router import router
+from .vision_worker import vision
 
-router = Router.from_env()
 console = Console()
 
 logger = logging.getLogger(__name__)
@@ -31,6 +34,9 @@ NUM_CLUSTERS = int(os.getenv("NUM_CLUSTERS", 10)) # Number of clusters to use fo
 UPSCALE_FACTOR = int(os.getenv("UPSCALE_FACTOR", 3)) # How much we upscale the image on each step of zooming in
 FIRST_OCR_THRESHOLD = float(os.getenv("FIRST_OCR_THRESHOLD", 0.9)) # Threshold for the first OCR pass
 SECOND_OCR_THRESHOLD = float(os.getenv("SECOND_OCR_THRESHOLD", 0.7)) # Threshold for the second OCR pass
+OCR_REFINE_REGION = os.getenv("OCR_REFINE_REGION", "true") == "true" # Reuse the first OCR pass boxes in the second one
+OCR_UPDATE_MAX_FRACTION = float(os.getenv("OCR_UPDATE_MAX_FRACTION", 0.3)) # Share of the screen that may change for the first OCR pass to only read the changes
+SAVE_DEBUG_IMAGES = os.getenv("SAVE_DEBUG_IMAGES", "false") == "true" # Whether to save intermediate images to disk
 
 
 class ZoomSelection(BaseModel):
@@ -81,13 +87,15 @@ def find_coordinates(semdesk, description: str, text: str) -> dict:
 
     # - Setting up the stage
 
-    starting_img_b64 = semdesk.desktop.take_screenshot()
-    starting_img = b64_to_image(starting_img_b64)
-    starting_img_path = os.path.join(semdesk.img_path, f"{click_hash}_starting.png")
-    starting_img.save(starting_img_path)
+    # The screenshot is decoded once, every zoom level below is a view of it
+    screenshot = semdesk.take_frame()
+    starting_img = screenshot.pil
+    starting_img_path = _save_debug_image(semdesk, starting_img, f"{click_hash}_starting.png")
+    starting_img_hash = screenshot.content_hash
     bounding_boxes.append(Box(0, 0, starting_img.width, starting_img.height))
 
     method = recall_best_method_on_first_iteration(description)
+    first_ocr_results = None
 
     # - OCR on the starting image
 
@@ -97,7 +105,8 @@ def find_coordinates(semdesk, description: str, text: str) -> dict:
             msg=f"Attempting OCR for: {search_text}",
             thread="debug",
         )
-        ocr_results = find_all_text_with_bounding_boxes(starting_img_path)
+        ocr_results = _ocr_result(_find_text(screenshot))
+        first_ocr_results = ocr_results
 
         best_matches = [box for box in ocr_results if similarity_ratio(box['text'], search_text) >= FIRST_OCR_THRESHOLD]
         if len(best_matches) == 1:
@@ -120,7 +129,7 @@ def find_coordinates(semdesk, description: str, text: str) -> dict:
                 role="Clicker",
                 msg=f"Final debug img",
                 thread="debug",
-                images=[image_to_b64(debug_img)],
+                images=[encode_image(debug_img, "debug")],
             )
             return {
                 "x": x_mid,
@@ -146,14 +155,17 @@ def find_coordinates(semdesk, description: str, text: str) -> dict:
         msg=f"Looking for a region of interest...",
         thread="debug",
     )
-    region_of_interest, bounding_box = method(semdesk, starting_img, starting_img_path, description, click_hash, "region")
+    region_of_interest, bounding_box = method(
+        semdesk, screenshot, starting_img_path, description, click_hash, "region",
+        source=screenshot.rgb, source_hash=starting_img_hash, parent_box=bounding_boxes[-1], upscale=1
+    )
 
     # Escape exit, if we didn't find the region of interest because the element is not on a screen:
     # we fall back to bruteforce method
     if region_of_interest is None:
         return backup_find_coordinates(semdesk, description)
     
-    region_of_interest_b64 = image_to_b64(region_of_interest)
+    region_of_interest_b64 = encode_image(region_of_interest, "debug")
     semdesk.task.post_message(
         role="Clicker",
         msg=f"Found region of interest",
@@ -161,8 +173,8 @@ def find_coordinates(semdesk, description: str, text: str) -> dict:
         images=[region_of_interest_b64],
     )
     bounding_boxes.append(bounding_box)
-    region_of_interest_path = os.path.join(semdesk.img_path, f"{click_hash}_region_of_interest.png")
-    region_of_interest.save(region_of_interest_path)
+    if SAVE_DEBUG_IMAGES:
+        region_of_interest.save(os.path.join(semdesk.img_path, f"{click_hash}_region_of_interest.png"))
 
     # - OCR on the region we found
     if search_text:
@@ -171,11 +183,22 @@ def find_coordinates(semdesk, description: str, text: str) -> dict:
             msg=f"Attempting OCR for: {search_text} on a region of interest",
             thread="debug",
         )
-        zoomed_region_of_interest = region_of_interest.copy()
-        zoomed_region_of_interest = zoomed_region_of_interest.resize((zoomed_region_of_interest.width * UPSCALE_FACTOR, zoomed_region_of_interest.height * UPSCALE_FACTOR), resample=0)
-        zoomed_region_of_interest_path = os.path.join(semdesk.img_path, f"{click_hash}_zoomed_region_of_interest.png")
-        zoomed_region_of_interest.save(zoomed_region_of_interest_path)
-        ocr_results = find_all_text_with_bounding_boxes(zoomed_region_of_interest_path)
+        zoomed_region_of_interest_path = None
+        if SAVE_DEBUG_IMAGES:
+            zoomed_region_of_interest_path = os.path.join(semdesk.img_path, f"{click_hash}_zoomed_region_of_interest.png")
+        # The region of interest is always a crop of the starting image, so we read it from there:
+        # this way identical pixels hit the OCR cache without even being cropped
+        if OCR_REFINE_REGION and first_ocr_results is not None:
+            # Only recognize again, at a higher resolution, the text the first pass has already detected
+            ocr_results = _ocr_result(vision.refine_text_in_region(
+                starting_img, bounding_box, UPSCALE_FACTOR, first_ocr_results,
+                debug_path=zoomed_region_of_interest_path, image_hash=starting_img_hash
+            ))
+        else:
+            ocr_results = _ocr_result(vision.find_text_in_region(
+                starting_img, bounding_box, UPSCALE_FACTOR,
+                debug_path=zoomed_region_of_interest_path, image_hash=starting_img_hash
+            ))
         best_matches = [box for box in ocr_results if similarity_ratio(box['text'], search_text) >= SECOND_OCR_THRESHOLD]
 
         # We trust OCR only of exactly one match over the threshold is found. Otherwise, we fall back to Grid/Composite.
@@ -206,7 +229,7 @@ def find_coordinates(semdesk, description: str, text: str) -> dict:
                 role="Clicker",
                 msg=f"Final debug img",
                 thread="debug",
-                images=[image_to_b64(debug_img)],
+                images=[encode_image(debug_img, "debug")],
             )
             return {
                 "x": x_mid,
@@ -215,42 +238,35 @@ def find_coordinates(semdesk, description: str, text: str) -> dict:
 
     # - Two passes of Grid/Composite + Zoom
 
-    total_upscale = 1
     method = recall_best_method_on_second_iteration(description)
 
-    region = region_of_interest.copy()
-    region = region.resize((region.width * UPSCALE_FACTOR, region.height * UPSCALE_FACTOR), resample=0)
-    region_of_interest_path = os.path.join(semdesk.img_path, f"{click_hash}_region_of_interest_zoom_1.png")
-    region.save(region_of_interest_path)
-    total_upscale *= UPSCALE_FACTOR
-    new_region_of_interest, relative_bounding_box = method(semdesk, region, region_of_interest_path, description, click_hash, "zoom_1")
+    region = Region(starting_img, bounding_boxes[-1], UPSCALE_FACTOR)
+    region_of_interest_path = _save_debug_image(semdesk, region, f"{click_hash}_region_of_interest_zoom_1.png")
+    new_region_of_interest, relative_bounding_box = method(
+        semdesk, region.handle(), region_of_interest_path, description, click_hash, "zoom_1",
+        source=screenshot.rgb, source_hash=starting_img_hash, parent_box=region.box, upscale=region.scale
+    )
 
     # Escape exit, if we didn't find the region of interest because the element is not on a screen:
     # we fall back to bruteforce method
     if new_region_of_interest is None:
         return backup_find_coordinates(semdesk, description)
 
-    absolute_box_zoomed = relative_bounding_box.to_absolute_with_upscale(
-        bounding_boxes[-1], total_upscale
-    )
-    bounding_boxes.append(absolute_box_zoomed)
+    bounding_boxes.append(region.to_absolute(relative_bounding_box))
     
-    region = new_region_of_interest.copy()
-    region = region.resize((region.width * UPSCALE_FACTOR, region.height * UPSCALE_FACTOR), resample=0)
-    region_of_interest_path = os.path.join(semdesk.img_path, f"{click_hash}_region_of_interest_zoom_2.png")
-    region.save(region_of_interest_path)
-    total_upscale *= UPSCALE_FACTOR
-    last_region_of_interest, relative_bounding_box = method(semdesk, region, region_of_interest_path, description, click_hash, "zoom_2")
+    region = region.zoom(relative_bounding_box, UPSCALE_FACTOR)
+    region_of_interest_path = _save_debug_image(semdesk, region, f"{click_hash}_region_of_interest_zoom_2.png")
+    last_region_of_interest, relative_bounding_box = method(
+        semdesk, region.handle(), region_of_interest_path, description, click_hash, "zoom_2",
+        source=screenshot.rgb, source_hash=starting_img_hash, parent_box=region.box, upscale=region.scale
+    )
 
     # Escape exit, if we didn't find the region of interest because the element is not on a screen:
     # we fall back to bruteforce method
     if last_region_of_interest is None:
         return backup_find_coordinates(semdesk, description)
 
-    absolute_box_zoomed = relative_bounding_box.to_absolute_with_upscale(
-        bounding_boxes[-1], total_upscale
-    )
-    bounding_boxes.append(absolute_box_zoomed)
+    bounding_boxes.append(region.to_absolute(relative_bounding_box))
 
     x_mid, y_mid = bounding_boxes[-1].center()
     logger.info(f"clicking exact coords {x_mid}, {y_mid}")
@@ -269,7 +285,7 @@ def find_coordinates(semdesk, description: str, text: str) -> dict:
         role="Clicker",
         msg=f"Final debug img",
         thread="debug",
-        images=[image_to_b64(debug_img)],
+        images=[encode_image(debug_img, "debug")],
     )
     return {
         "x": x_mid,
@@ -288,16 +304,14 @@ def backup_find_coordinates(semdesk, description: str) -> dict:
 
     click_hash = hashlib.md5(description.encode()).hexdigest()[:5]
     bounding_boxes = []
-    total_upscale = 1
     method = run_grid
 
-    starting_img_b64 = semdesk.desktop.take_screenshot()
-    starting_img = b64_to_image(starting_img_b64)
-    starting_img_path = os.path.join(semdesk.img_path, f"{click_hash}_starting.png")
-    starting_img.save(starting_img_path)
+    starting_img = semdesk.take_frame().pil
+    _save_debug_image(semdesk, starting_img, f"{click_hash}_starting.png")
     bounding_boxes.append(Box(0, 0, starting_img.width, starting_img.height))
 
-    region_of_interest = starting_img.copy()
+    # Every level is a view of the one decoded screenshot, upscaled once more
+    region = Region(starting_img)
 
     for i in [0, 1, 2]:
         semdesk.task.post_message(
@@ -306,12 +320,9 @@ def backup_find_coordinates(semdesk, description: str) -> dict:
             thread="debug",
         )
 
-        region = region_of_interest.copy()
-        region = region.resize((region.width * UPSCALE_FACTOR, region.height * UPSCALE_FACTOR), resample=0)
-        region_of_interest_path = os.path.join(semdesk.img_path, f"{click_hash}_grid_region_{i}.png")
-        region.save(region_of_interest_path)
-        total_upscale *= UPSCALE_FACTOR
-        region_of_interest, relative_bounding_box = method(semdesk, region, region_of_interest_path, description, click_hash, "zoom_{i}")
+        region = Region(starting_img, bounding_boxes[-1], region.scale * UPSCALE_FACTOR)
+        region_of_interest_path = _save_debug_image(semdesk, region, f"{click_hash}_grid_region_{i}.png")
+        region_of_interest, relative_bounding_box = method(semdesk, region.handle(), region_of_interest_path, description, click_hash, f"zoom_{i}")
 
         # Escape exit, if we didn't find the region of interest because the element is not on a screen.
         if region_of_interest is None:
@@ -322,10 +333,7 @@ def backup_find_coordinates(semdesk, description: str) -> dict:
             )
             return None
 
-        absolute_box_zoomed = relative_bounding_box.to_absolute_with_upscale(
-            bounding_boxes[-1], total_upscale
-        )
-        bounding_boxes.append(absolute_box_zoomed)
+        bounding_boxes.append(region.to_absolute(relative_bounding_box))
 
     x_mid, y_mid = bounding_boxes[-1].center()
     logger.info(f"clicking exact coords {x_mid}, {y_mid}")
@@ -344,7 +352,7 @@ def backup_find_coordinates(semdesk, description: str) -> dict:
         role="Clicker",
         msg=f"Final debug img",
         thread="debug",
-        images=[image_to_b64(debug_img)],
+        images=[encode_image(debug_img, "debug")],
     )
     return {
         "x": x_mid,
@@ -352,27 +360,57 @@ def backup_find_coordinates(semdesk, description: str) -> dict:
     }
 
 
+def _save_debug_image(semdesk, image, name: str) -> Optional[str]:
+    """Saves an intermediate image, a `Region` or a PIL image, if SAVE_DEBUG_IMAGES; returns its path or None"""
+    if not SAVE_DEBUG_IMAGES:
+        return None
+    path = os.path.join(semdesk.img_path, name)
+    (image.image() if isinstance(image, Region) else image).save(path)
+    return path
+
+
 def similarity_ratio(a, b):
     return SequenceMatcher(None, a.lower(), b.lower()).ratio()
 
 
-def run_grid(semdesk, starting_image: Image.Image, starting_path: str, 
-             description: str, click_hash: str, postfix: str) -> dict:
-    img_width, img_height = starting_image.size
-    starting_image_b64 = image_to_b64(starting_image)
+def _find_text(screenshot: Frame):
+    """Future of the text on the screenshot, reading only what changed since the previous frame when its text is known"""
+    from .easyocr import ocr_cache, ocr_cache_key
 
-    grid_path = os.path.join(semdesk.img_path, f"{click_hash}_grid_{postfix}.png")
-    create_grid_image(
-        img_width, img_height, COLOR_CIRCLE, COLOR_NUMBER, GRID_SIZE, grid_path
-    )
+    previous = screenshot.previous
+    if previous is not None and previous.size == screenshot.size:
+        previous_results = ocr_cache.get(ocr_cache_key("full", previous.content_hash))
+        if previous_results is not None:
+            changes = detect_changes(previous.gray, screenshot.gray)
+            if changes.fraction <= OCR_UPDATE_MAX_FRACTION:
+                return vision.update_text(
+                    screenshot.rgb, previous_results, changes.boxes, image_hash=screenshot.content_hash
+                )
+    return vision.find_text(screenshot.rgb, image_hash=screenshot.content_hash)
+
+
+def _ocr_result(future) -> [dict]:
+    """Waits for an OCR request; a failed or timed out OCR finds no text, so we fall back to the other methods"""
+    try:
+        return future.result()
+    except Exception as e:
+        logger.warning(f"OCR request failed: {e}")
+        return []
 
-    merged_image_path = os.path.join(
-        semdesk.img_path, f"{click_hash}_merge_{postfix}.png"
-    )
-    merged_image = superimpose_images(starting_path, grid_path, 1)
-    merged_image.save(merged_image_path)
 
-    merged_image_b64 = image_to_b64(merged_image)
+def run_grid(semdesk, starting_image: Union[Image.Image, ImageHandle], starting_path: str, 
+             description: str, click_hash: str, postfix: str, **region) -> dict:
+    # The grid only depends on the size of the image, so it ignores the region of the screenshot (see run_composite)
+    starting = as_handle(starting_image)
+    starting_image = starting.pil
+    starting_image_b64 = starting.encoded("grid")
+
+    # The overlay of a given size is rendered once and blended in memory
+    merged_image = overlay_grid(starting_image, COLOR_CIRCLE, COLOR_NUMBER, GRID_SIZE, 1)
+    if SAVE_DEBUG_IMAGES:
+        merged_image.save(os.path.join(semdesk.img_path, f"{click_hash}_merge_{postfix}.png"))
+
+    merged_image_b64 = encode_image(merged_image, "grid")
     semdesk.task.post_message(
         role="Clicker",
         msg=f"Merged image",
@@ -432,7 +470,7 @@ def run_grid(semdesk, starting_image: Image.Image, starting_path: str,
         return None, None
 
     region_of_interest, top_left, bottom_right = zoom_in(
-        starting_path, GRID_SIZE, chosen_number, 1
+        starting_image, GRID_SIZE, chosen_number, 1
     )
     bounding_box = Box(
         top_left[0], top_left[1], bottom_right[0], bottom_right[1]
@@ -440,14 +478,25 @@ def run_grid(semdesk, starting_image: Image.Image, starting_path: str,
     return region_of_interest, bounding_box
 
 
-def run_composite(semdesk, starting_image: Image.Image, starting_path: str, 
-                  description: str, click_hash: str, postfix: str) -> dict:
-    composite_path = os.path.join(semdesk.img_path, f"{click_hash}_composite_{postfix}.png")
-    composite_pil, bounding_boxes = create_composite(starting_path, NUM_CLUSTERS)
-    composite_pil.save(composite_path)
-    composite_b64 = image_to_b64(composite_pil)
+def run_composite(semdesk, starting_image: Union[Image.Image, ImageHandle], starting_path: str, 
+                  description: str, click_hash: str, postfix: str,
+                  source: Optional[np.ndarray] = None, source_hash: Optional[str] = None,
+                  parent_box: Optional[Box] = None, upscale: int = 1) -> dict:
+    # When the screenshot and the absolute box of `starting_image` in it are given, the sections come
+    # from the region tree of the screenshot, built once for all the zoom levels
+    starting = as_handle(starting_image)
+    starting_image = starting.pil
+    if source is not None and parent_box is not None:
+        composite_future = vision.create_composite(
+            source, NUM_CLUSTERS, box=parent_box, upscale=upscale, image_hash=source_hash
+        )
+    else:
+        composite_future = vision.create_composite(starting_image, NUM_CLUSTERS)
+    composite_pil, bounding_boxes = composite_future.result()
+    _save_debug_image(semdesk, composite_pil, f"{click_hash}_composite_{postfix}.png")
+    composite_b64 = encode_image(composite_pil, "composite")
 
-    starting_image_b64 = image_to_b64(starting_image)
+    starting_image_b64 = starting.encoded("grid")
 
     semdesk.task.post_message(
         role="Clicker",
@@ -463,7 +512,7 @@ def run_composite(semdesk, starting_image: Image.Image, starting_path: str,
     You see a composite of several section of the screenshpt of the web application.
     You also see the entire screenshot for the reference.
 
-    I have drawn some big {COLOR_NUMBER} numbers on the left panel of the composite image. 
+    I have drawn some big {COLOR_NUMBER} numbers to the left of each section of the composite image. 
     Please tell me the number of the section of the composite image that contains the {description}.
         
     It may be the case, there is no {description} anywhere on the screenshot that you see.
@@ -1,21 +1,569 @@
-import easyocr
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple, Union
 
-def find_all_text_with_bounding_boxes(path: str) -> [dict]:
+import numpy as np
+from PIL import Image
+
+from .cache import LRUCache, content_hash
+from .img import Box
+
+if TYPE_CHECKING:
+    import easyocr
+
+logger = logging.getLogger(__name__)
+logger.setLevel(int(os.getenv("LOG_LEVEL", logging.DEBUG)))
+
+OCR_LANGUAGES = os.getenv("OCR_LANGUAGES", "en").split(",")
+# "int8" runs EasyOCR's own dynamically quantized CPU models, "fp32" the unquantized ones and "onnx" their ONNX Runtime export
+OCR_BACKEND = os.getenv("OCR_BACKEND", "int8")
+OCR_READER_POOL_SIZE = int(os.getenv("OCR_READER_POOL_SIZE", 1)) # Number of EasyOCR readers kept in memory
+OCR_LEASE_TIMEOUT = float(os.getenv("OCR_LEASE_TIMEOUT", 300)) # Seconds to wait for a free reader
+OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", 64)) # Max number of cached OCR results
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", 4 * 1024 * 1024)) # Max total size of cached OCR results
+OCR_TILED = os.getenv("OCR_TILED", "false") == "true" # Read large images as tiles on a process pool
+OCR_TILED_MIN_PIXELS = int(os.getenv("OCR_TILED_MIN_PIXELS", 2560 * 1440)) # Smallest image read as tiles
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", 8)) # Max number of crops read in a single batched inference
+OCR_BATCH_MAX_PADDING = float(os.getenv("OCR_BATCH_MAX_PADDING", 0.5)) # Padding pixels a batch may add, as a share of the pixels of its crops
+OCR_REFINE_MIN_GAP = int(os.getenv("OCR_REFINE_MIN_GAP", 8)) # Min height (in screen pixels) of an empty band that is worth detecting text in
+OCR_UPDATE_MARGIN = int(os.getenv("OCR_UPDATE_MARGIN", 16)) # Margin around a changed region read again, so that words cut by it are read whole
+
+
+def create_reader(languages: List[str] = OCR_LANGUAGES, backend: str = OCR_BACKEND) -> "easyocr.Reader":
+    """Creates an EasyOCR reader running on the given backend.
+
+    Args:
+        languages (List[str]): Languages to read. Defaults to OCR_LANGUAGES.
+        backend (str): "int8", "fp32" or "onnx". Defaults to OCR_BACKEND.
+
+    Returns:
+        easyocr.Reader: The reader
+    """
+    # EasyOCR pulls in torch, so it is only imported once we actually need a reader
+    import easyocr
+
+    if backend == "int8":
+        # On CPU, EasyOCR applies dynamic int8 quantization to its models by default
+        return easyocr.Reader(languages, quantize=True)
+    if backend == "fp32":
+        return easyocr.Reader(languages, quantize=False)
+    if backend == "onnx":
+        from .ocr_onnx import use_onnx_runtime
+
+        return use_onnx_runtime(easyocr.Reader(languages, quantize=False))
+    raise ValueError(f"Unknown OCR backend '{backend}', expected 'int8', 'fp32' or 'onnx'")
+
+
+class ReaderPool:
+    """A pool of EasyOCR readers that are loaded once and leased to callers.
+
+    Loading the detection and recognition models from disk is more expensive than
+    running the OCR itself, so the readers are created once (ideally at server startup
+    through `warmup`) and handed out one caller at a time, since a single reader is
+    not safe to share between threads.
+    """
+
+    def __init__(self, size: int = OCR_READER_POOL_SIZE, languages: List[str] = OCR_LANGUAGES):
+        self.size = max(size, 1)
+        self.languages = languages
+        self._readers: queue.Queue = queue.Queue()
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def warmup(self) -> None:
+        """Load all the readers of the pool, if this has not been done yet."""
+        with self._lock:
+            if self._ready.is_set():
+                return
+            # The readers only join the pool once all of them are loaded, so that a failed warmup
+            # does not leave some behind for the next one to add to
+            readers = []
+            for i in range(self.size):
+                logger.info(f"loading {OCR_BACKEND} EasyOCR reader {i + 1}/{self.size} for {self.languages}")
+                readers.append(create_reader(self.languages))
+            for reader in readers:
+                self._readers.put(reader)
+            self._ready.set()
+
+    def is_ready(self) -> bool:
+        """Whether all the readers are loaded and resident in memory."""
+        return self._ready.is_set()
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = OCR_LEASE_TIMEOUT) -> Iterator["easyocr.Reader"]:
+        """Lease a reader for the duration of the context.
+
+        Args:
+            timeout (Optional[float]): Seconds to wait for a free reader. Defaults to OCR_LEASE_TIMEOUT.
+
+        Yields:
+            easyocr.Reader: The leased reader
+        """
+        if not self.is_ready():
+            self.warmup()
+        try:
+            reader = self._readers.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No EasyOCR reader became available in {timeout}s")
+        try:
+            yield reader
+        finally:
+            self._readers.put(reader)
+
+
+reader_pool = ReaderPool()
+
+
+def warmup_readers() -> None:
+    """Load the shared EasyOCR readers into memory, and those of the tile processes when tiled OCR is on."""
+    reader_pool.warmup()
+    if OCR_TILED:
+        from .ocr_tiles import warmup_tile_pool
+
+        warmup_tile_pool()
+
+
+def readers_ready() -> bool:
+    """Whether the shared readers, and those of the tile processes when tiled OCR is on, are loaded."""
+    if OCR_TILED:
+        from .ocr_tiles import is_tile_pool_ready
+
+        if not is_tile_pool_ready():
+            return False
+    return reader_pool.is_ready()
+
+
+ocr_cache = LRUCache(max_entries=OCR_CACHE_MAX_ENTRIES, max_bytes=OCR_CACHE_MAX_BYTES)
+
+
+def ocr_cache_key(
+    kind: str, image_hash: str, box: Optional[Box] = None, upscale: int = 1, hints: Optional[List[dict]] = None
+) -> tuple:
+    """Builds the OCR cache key of a read of the image with the given content hash."""
+    key = (kind, image_hash)
+    if box is not None:
+        key += (box.left, box.top, box.right, box.bottom, upscale)
+    if hints is not None:
+        key += (tuple((hint["x"], hint["y"], hint["w"], hint["h"]) for hint in hints),)
+    return key
+
+
+def _results_size(results: [dict]) -> int:
+    """Approximate memory footprint of OCR results, used to bound the cache."""
+    return sum(200 + len(result["text"]) for result in results)
+
+
+def _to_ocr_input(image: Union[str, Image.Image, np.ndarray]) -> Union[str, np.ndarray]:
+    """Converts a PIL image to the RGB array EasyOCR works on; paths and arrays are passed as is."""
+    if isinstance(image, Image.Image):
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return np.asarray(image)
+    return image
+
+
+def _process_results(results: list, offset_x: int = 0, offset_y: int = 0) -> [dict]:
+    """Converts raw EasyOCR results to our text boxes, shifted by the given offset."""
+    processed_results = []
+    for box in results:
+        result = {
+            "x": int(box[0][0][0]) + offset_x,
+            "y": int(box[0][0][1]) + offset_y,
+            "w": int(box[0][2][0] - box[0][0][0]),
+            "h": int(box[0][2][1] - box[0][0][1]),
+            "text": box[1],
+            "confidence": float(box[2])
+        }
+        processed_results.append(result)
+    return processed_results
+
+
+def _read_text(ocr_input: Union[str, np.ndarray]) -> [dict]:
+    with reader_pool.lease() as reader:
+        results = reader.readtext(ocr_input)
+    return _process_results(results)
+
+
+def find_all_text_with_bounding_boxes(
+    image: Union[str, Image.Image, np.ndarray],
+    debug_path: Optional[str] = None,
+    image_hash: Optional[str] = None,
+) -> [dict]:
+    """Finds all the text in the image along with its bounding boxes.
+
+    Results for in-memory images are cached by the hash of their pixels, so reading
+    the same screen again only costs the hash.
+
+    Args:
+        image (Union[str, Image.Image, np.ndarray]): The image to read, either in memory
+            (a PIL image or an RGB / grayscale array) or as a path to an image file
+        debug_path (Optional[str]): If set, the image is also saved there for debugging. Defaults to None.
+        image_hash (Optional[str]): Precomputed `content_hash` of the image. Defaults to None.
+
+    Returns:
+        [dict]: Text boxes with the keys x, y, w, h, text and confidence
+    """
+    try:
+        cache_key = None
+        if not isinstance(image, str):
+            cache_key = ocr_cache_key("full", image_hash or content_hash(image))
+            cached = ocr_cache.get(cache_key)
+            if cached is not None:
+                return list(cached)
+
+        ocr_input = _to_ocr_input(image)
+        if debug_path and not isinstance(ocr_input, str):
+            Image.fromarray(ocr_input).save(debug_path)
+        if OCR_TILED and not isinstance(ocr_input, str) and ocr_input.shape[0] * ocr_input.shape[1] >= OCR_TILED_MIN_PIXELS:
+            from .ocr_tiles import find_all_text_tiled
+
+            processed_results = find_all_text_tiled(ocr_input)
+        else:
+            processed_results = _read_text(ocr_input)
+        if cache_key:
+            ocr_cache.put(cache_key, processed_results, _results_size(processed_results))
+        return list(processed_results)
+    except Exception as e:
+        print(f"EasyOCR failed: {str(e)}")
+        return []
+
+
+def find_all_text_in_region(
+    image: Image.Image,
+    box: Box,
+    upscale: int = 1,
+    debug_path: Optional[str] = None,
+    image_hash: Optional[str] = None,
+) -> [dict]:
+    """Finds all the text in a region of the image, upscaled with nearest neighbour.
+
+    Results are cached by the hash of the whole image plus the region and the upscale,
+    so the crop is neither materialized nor read again for pixels we have already seen.
+
+    Args:
+        image (Image.Image): The full image
+        box (Box): The region to read
+        upscale (int): How much the region is upscaled before reading it. Defaults to 1.
+        debug_path (Optional[str]): If set, the upscaled region is saved there for debugging. Defaults to None.
+        image_hash (Optional[str]): Precomputed `content_hash` of the full image. Defaults to None.
+
+    Returns:
+        [dict]: Text boxes in the coordinates of the upscaled region
+    """
     try:
-        reader = easyocr.Reader(['en'])
-        results = reader.readtext(path)
-        processed_results = []
-        for box in results:
-            result = {
-                "x": int(box[0][0][0]),
-                "y": int(box[0][0][1]),
-                "w": int(box[0][2][0] - box[0][0][0]),
-                "h": int(box[0][2][1] - box[0][0][1]),
-                "text": box[1],
-                "confidence": float(box[2])
-            }
-            processed_results.append(result)
-        return processed_results
+        cache_key = ocr_cache_key("region", image_hash or content_hash(image), box, upscale)
+        cached = ocr_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+
+        region = box.crop_image(image)
+        if upscale != 1:
+            region = region.resize((region.width * upscale, region.height * upscale), resample=0)
+        ocr_input = _to_ocr_input(region)
+        if debug_path:
+            Image.fromarray(ocr_input).save(debug_path)
+        processed_results = _read_text(ocr_input)
+        ocr_cache.put(cache_key, processed_results, _results_size(processed_results))
+        return list(processed_results)
+    except Exception as e:
+        print(f"EasyOCR failed: {str(e)}")
+        return []
+
+
+def _uncovered_rects(hints: [dict], box: Box, min_gap: int) -> List[Box]:
+    """Finds the rectangles of the box, relative to its top left corner, not covered by any of the hints.
+
+    The box is cut into horizontal slices at the top and bottom edges of the hints. Every gap
+    between the hints of a slice is grown up and down until it meets a hint, which gives the
+    largest uncovered rectangles, also next to the hints on the same row.
+    """
+    width, height = box.width(), box.height()
+    rects = [
+        (
+            max(hint["x"] - box.left, 0), max(hint["y"] - box.top, 0),
+            min(hint["x"] + hint["w"] - box.left, width), min(hint["y"] + hint["h"] - box.top, height),
+        )
+        for hint in hints
+    ]
+    edges = sorted({0, height} | {min(max(y, 0), height) for _, top, _, bottom in rects for y in (top, bottom)})
+
+    found = set()
+    for y0, y1 in zip(edges, edges[1:]):
+        gaps, cursor = [], 0
+        for left, right in sorted((left, right) for left, top, right, bottom in rects if top < y1 and bottom > y0):
+            if left > cursor:
+                gaps.append((cursor, left))
+            cursor = max(cursor, right)
+        if cursor < width:
+            gaps.append((cursor, width))
+
+        for x0, x1 in gaps:
+            if x1 - x0 < min_gap:
+                continue
+            # The hints across the gap are either above or below the slice
+            blockers = [(top, bottom) for left, top, right, bottom in rects if left < x1 and right > x0]
+            top = max((bottom for _, bottom in blockers if bottom <= y0), default=0)
+            bottom = min((top for top, _ in blockers if top >= y1), default=height)
+            if bottom - top >= min_gap:
+                found.add((x0, top, x1, bottom))
+
+    # Slices with the same gap grow into the same rectangle, and narrower gaps may grow into one inside a wider one
+    return [
+        Box(*rect) for rect in sorted(found)
+        if not any(
+            other != rect and other[0] <= rect[0] and other[1] <= rect[1] and other[2] >= rect[2] and other[3] >= rect[3]
+            for other in found
+        )
+    ]
+
+
+def hints_in_region(hints: [dict], box: Box) -> [dict]:
+    """Returns the text boxes that overlap the region."""
+    return [
+        hint for hint in hints
+        if hint["x"] < box.right and hint["x"] + hint["w"] > box.left
+        and hint["y"] < box.bottom and hint["y"] + hint["h"] > box.top
+    ]
+
+
+def refine_text_in_region(
+    image: Image.Image,
+    box: Box,
+    upscale: int,
+    hints: [dict],
+    debug_path: Optional[str] = None,
+    image_hash: Optional[str] = None,
+) -> [dict]:
+    """Reads the text of a region of the image, reusing the text boxes found on the full image.
+
+    Instead of detecting the text from scratch on the upscaled region, the boxes from the full
+    image pass that fall inside the region are only recognized again at the higher resolution.
+    Full detection runs only on the rectangles of the region that none of them covers, so that
+    the text the first pass missed, also next to the text it found, is still read.
+
+    Args:
+        image (Image.Image): The full image
+        box (Box): The region to read
+        upscale (int): How much the region is upscaled before reading it
+        hints ([dict]): Text boxes found on the full image, in its coordinates
+        debug_path (Optional[str]): If set, the upscaled region is saved there for debugging. Defaults to None.
+        image_hash (Optional[str]): Precomputed `content_hash` of the full image. Defaults to None.
+
+    Returns:
+        [dict]: Text boxes in the coordinates of the upscaled region, like `find_all_text_in_region`
+    """
+    inside = hints_in_region(hints, box)
+    if not inside:
+        return find_all_text_in_region(image, box, upscale, debug_path=debug_path, image_hash=image_hash)
+
+    try:
+        cache_key = ocr_cache_key("refine", image_hash or content_hash(image), box, upscale, inside)
+        cached = ocr_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+
+        region = box.crop_image(image).convert("RGB")
+        region = region.resize((region.width * upscale, region.height * upscale), resample=0)
+        if debug_path:
+            region.save(debug_path)
+        region_rgb = np.asarray(region)
+        region_grey = np.asarray(region.convert("L"))
+        height, width = region_grey.shape
+
+        # Boxes in the coordinates of the upscaled region, as [x_min, x_max, y_min, y_max]
+        horizontal_list = [
+            [
+                max((hint["x"] - box.left) * upscale, 0),
+                min((hint["x"] + hint["w"] - box.left) * upscale, width),
+                max((hint["y"] - box.top) * upscale, 0),
+                min((hint["y"] + hint["h"] - box.top) * upscale, height),
+            ]
+            for hint in inside
+        ]
+        with reader_pool.lease() as reader:
+            processed_results = _process_results(
+                reader.recognize(region_grey, horizontal_list=horizontal_list, free_list=[])
+            )
+            detected = []
+            for rect in _uncovered_rects(inside, box, OCR_REFINE_MIN_GAP):
+                crop = np.ascontiguousarray(
+                    region_rgb[rect.top * upscale:rect.bottom * upscale, rect.left * upscale:rect.right * upscale]
+                )
+                detected += _process_results(
+                    reader.readtext(crop), offset_x=rect.left * upscale, offset_y=rect.top * upscale
+                )
+        if detected:
+            from .ocr_tiles import merge_text_boxes
+
+            # Uncovered rectangles overlap, so the same text may have been found in several of them
+            processed_results += merge_text_boxes(detected)
+
+        ocr_cache.put(cache_key, processed_results, _results_size(processed_results))
+        return list(processed_results)
     except Exception as e:
         print(f"EasyOCR failed: {str(e)}")
         return []
+
+
+def _group_batches(
+    shapes: List[Tuple[int, int]], batch_size: int = OCR_BATCH_SIZE, max_padding: float = OCR_BATCH_MAX_PADDING
+) -> List[List[int]]:
+    """Groups crops of similar sizes into batches, since every crop of a batch is padded to the largest height and width.
+
+    Args:
+        shapes (List[Tuple[int, int]]): (height, width) of the crops
+        batch_size (int): Max number of crops in a batch. Defaults to OCR_BATCH_SIZE.
+        max_padding (float): Padding pixels a batch may add, as a share of the pixels of its crops.
+            Defaults to OCR_BATCH_MAX_PADDING.
+
+    Returns:
+        List[List[int]]: The indices of the crops in every batch
+    """
+    batches = []
+    batch, height, width, pixels = [], 0, 0, 0
+    for i in sorted(range(len(shapes)), key=lambda i: shapes[i], reverse=True):
+        crop_height, crop_width = shapes[i]
+        grown_height, grown_width = max(height, crop_height), max(width, crop_width)
+        grown_pixels = pixels + crop_height * crop_width
+        if batch and (
+            len(batch) >= batch_size or grown_height * grown_width * (len(batch) + 1) > (1 + max_padding) * grown_pixels
+        ):
+            batches.append(batch)
+            batch, grown_height, grown_width, grown_pixels = [], crop_height, crop_width, crop_height * crop_width
+        batch.append(i)
+        height, width, pixels = grown_height, grown_width, grown_pixels
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def find_all_text_in_crops(
+    image: Image.Image,
+    boxes: List[Box],
+    upscale: int = 1,
+    image_hash: Optional[str] = None,
+) -> List[List[dict]]:
+    """Finds all the text in several regions of the image with batched inference.
+
+    The regions are upscaled with nearest neighbour, grouped by size into batches of at most
+    OCR_BATCH_SIZE, padded to a common size and read together, so detection runs as one
+    forward pass per batch instead of one per region. Regions already in the OCR cache are
+    not read again.
+
+    Args:
+        image (Image.Image): The full image
+        boxes (List[Box]): The regions to read
+        upscale (int): How much the regions are upscaled before reading them. Defaults to 1.
+        image_hash (Optional[str]): Precomputed `content_hash` of the full image. Defaults to None.
+
+    Returns:
+        List[List[dict]]: For each region, its text boxes in the absolute coordinates of the image
+    """
+    image_hash = image_hash or content_hash(image)
+    keys = [ocr_cache_key("region", image_hash, box, upscale) for box in boxes]
+    relative_results: List[Optional[List[dict]]] = [ocr_cache.get(key) for key in keys]
+
+    missing = [i for i, results in enumerate(relative_results) if results is None]
+    shapes = [(boxes[i].height() * upscale, boxes[i].width() * upscale) for i in missing]
+    for group in _group_batches(shapes):
+        batch = [missing[j] for j in group]
+        crops = []
+        for i in batch:
+            crop = boxes[i].crop_image(image).convert("RGB")
+            if upscale != 1:
+                crop = crop.resize((crop.width * upscale, crop.height * upscale), resample=0)
+            crops.append(np.asarray(crop))
+
+        # Batched detection needs images of the same size: pad on the right and the bottom,
+        # so the coordinates within each crop stay the same
+        max_height = max(crop.shape[0] for crop in crops)
+        max_width = max(crop.shape[1] for crop in crops)
+        padded = np.full((len(crops), max_height, max_width, 3), 255, dtype=np.uint8)
+        for j, crop in enumerate(crops):
+            padded[j, :crop.shape[0], :crop.shape[1]] = crop
+
+        try:
+            with reader_pool.lease() as reader:
+                batch_results = reader.readtext_batched(list(padded), batch_size=OCR_BATCH_SIZE)
+        except Exception as e:
+            print(f"EasyOCR failed: {str(e)}")
+            for i in batch:
+                relative_results[i] = []
+            continue
+
+        for i, results in zip(batch, batch_results):
+            relative_results[i] = _process_results(results)
+            ocr_cache.put(keys[i], relative_results[i], _results_size(relative_results[i]))
+
+    absolute_results = []
+    for box, results in zip(boxes, relative_results):
+        absolute = []
+        for result in results:
+            text_box = Box(
+                result["x"], result["y"], result["x"] + result["w"], result["y"] + result["h"]
+            ).to_absolute_with_upscale(box, upscale)
+            absolute.append({
+                **result,
+                "x": text_box.left,
+                "y": text_box.top,
+                "w": text_box.width(),
+                "h": text_box.height(),
+            })
+        absolute_results.append(absolute)
+    return absolute_results
+
+
+def update_text(
+    image: Union[Image.Image, np.ndarray],
+    previous_results: [dict],
+    changed_boxes: List[Box],
+    image_hash: Optional[str] = None,
+) -> [dict]:
+    """Finds all the text in the image from the results on an earlier frame and the regions that changed since.
+
+    The text boxes that no changed region touches are kept, and only the changed regions, with
+    a margin of OCR_UPDATE_MARGIN, are read again in one batch. The result is cached as the full
+    read of the image.
+
+    Args:
+        image (Union[Image.Image, np.ndarray]): The new frame
+        previous_results ([dict]): The text boxes of the earlier frame, as `find_all_text_with_bounding_boxes` returns them
+        changed_boxes (List[Box]): The changed regions, see `change_detection.detect_changes`
+        image_hash (Optional[str]): Precomputed `content_hash` of the image. Defaults to None.
+
+    Returns:
+        [dict]: Text boxes with the keys x, y, w, h, text and confidence
+    """
+    from .change_detection import Changes, overlaps, unaffected
+    from .ocr_tiles import merge_text_boxes
+
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    image_hash = image_hash or content_hash(image)
+    cache_key = ocr_cache_key("full", image_hash)
+    cached = ocr_cache.get(cache_key)
+    if cached is not None:
+        return list(cached)
+
+    kept = unaffected(previous_results, Changes(changed_boxes, 0.0))
+    regions = [
+        Box(
+            max(box.left - OCR_UPDATE_MARGIN, 0), max(box.top - OCR_UPDATE_MARGIN, 0),
+            min(box.right + OCR_UPDATE_MARGIN, image.width), min(box.bottom + OCR_UPDATE_MARGIN, image.height),
+        )
+        for box in changed_boxes
+    ]
+    read = []
+    for results in find_all_text_in_crops(image, regions, image_hash=image_hash):
+        # What the margins read outside of the changed regions is already in the kept boxes
+        read += [
+            result for result in results
+            if any(overlaps(box, result["x"], result["y"], result["w"], result["h"]) for box in changed_boxes)
+        ]
+
+    results = merge_text_boxes(kept + read)
+    ocr_cache.put(cache_key, results, _results_size(results))
+    return results
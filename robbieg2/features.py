@@ -0,0 +1,100 @@
+import logging
+import os
+from functools import cached_property
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .cache import LRUCache, content_hash
+from .canny_composite import (
+    RegionTree,
+    _to_rgb_array,
+    extract_bounding_boxes,
+    group_elements,
+    improved_canny_gray,
+)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(int(os.getenv("LOG_LEVEL", logging.DEBUG)))
+
+FEATURE_CACHE_SIZE = int(os.getenv("FEATURE_CACHE_SIZE", 8)) # Number of screenshots whose features are kept
+FEATURE_CACHE_MAX_BYTES = int(os.getenv("FEATURE_CACHE_MAX_BYTES", 256 * 1024 * 1024)) # Memory bound of the kept features
+
+
+class FeatureStore:
+    """Vision features of a screenshot, computed once at its native resolution.
+
+    Every feature is computed on first use and kept. The zoom levels of the clicker work on
+    upscaled crops of the screenshot, but nearest-neighbour upscaling adds no information, so
+    instead of computing anything on those crops they reuse the features of the screenshot.
+    """
+
+    def __init__(self, rgb: np.ndarray, image_hash: str):
+        self.rgb = rgb
+        self.image_hash = image_hash
+        self.height, self.width = rgb.shape[:2]
+        self._trees: Dict[int, RegionTree] = {}
+        self._region_elements: Dict[tuple, list] = {}
+
+    @cached_property
+    def gray(self) -> np.ndarray:
+        import cv2
+
+        return cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+
+    @cached_property
+    def edges(self) -> np.ndarray:
+        """Dilated Canny edge map"""
+        return improved_canny_gray(self.gray)
+
+    @cached_property
+    def elements(self) -> List[tuple]:
+        """(x, y, w, h) boxes of the grouped contours of the whole screenshot"""
+        return extract_bounding_boxes(group_elements(self.edges))
+
+    def elements_in(self, box: tuple) -> List[tuple]:
+        """Element boxes found by grouping only the contours of the edge map inside an (x, y, w, h) region.
+
+        Unlike the clipped elements of the whole screenshot, contours here are not merged with
+        the ones around the region, so this splits regions covered by one large element.
+        """
+        if box not in self._region_elements:
+            x, y, w, h = box
+            edges = np.ascontiguousarray(self.edges[y:y + h, x:x + w])
+            elements = extract_bounding_boxes(group_elements(edges)) if edges.size else []
+            self._region_elements[box] = [(ex + x, ey + y, ew, eh) for ex, ey, ew, eh in elements]
+        return self._region_elements[box]
+
+    def region_tree(self, num_clusters: int) -> RegionTree:
+        if num_clusters not in self._trees:
+            self._trees[num_clusters] = RegionTree(self.elements, self.width, self.height, num_clusters)
+        return self._trees[num_clusters]
+
+    def size(self) -> int:
+        """Approximate memory held by the store once its maps are computed, in bytes."""
+        # The RGB array, plus the grayscale and the edge maps of one byte per pixel
+        return self.rgb.nbytes + 2 * self.width * self.height
+
+
+_stores = LRUCache(max_entries=FEATURE_CACHE_SIZE, max_bytes=FEATURE_CACHE_MAX_BYTES)
+
+
+def feature_store(image, image_hash: Optional[str] = None) -> FeatureStore:
+    """Returns the feature store of a screenshot, shared by every request on the same content.
+
+    Args:
+        image: The screenshot, as a PIL image, an RGB array or a path
+        image_hash (str): Content hash of the screenshot, computed if not given. Defaults to None.
+
+    Returns:
+        FeatureStore: The store, created empty on the first request for the screenshot
+    """
+    rgb = _to_rgb_array(image)
+    image_hash = image_hash or content_hash(rgb)
+    store = _stores.get(image_hash)
+    if store is None:
+        # The store outlives the request, and the array may be a view of a buffer that does not,
+        # like the shared memory a vision worker gets its images in
+        store = FeatureStore(np.array(rgb), image_hash)
+        _stores.put(image_hash, store, store.size())
+    return store
@@ -0,0 +1,130 @@
+import logging
+import os
+from collections import deque
+from typing import List, NamedTuple, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from .change_detection import detect_changes
+from .frame import Frame
+from .img import ImageHandle, as_handle
+
+logger = logging.getLogger(__name__)
+logger.setLevel(int(os.getenv("LOG_LEVEL", logging.DEBUG)))
+
+FINGERPRINT_SIZE = int(os.getenv("FINGERPRINT_SIZE", 32)) # Side of the difference grid, the fingerprint has FINGERPRINT_SIZE^2 bits
+FINGERPRINT_LEVEL = int(os.getenv("FINGERPRINT_LEVEL", 2)) # Pyramid level of a frame the fingerprint and the thumbnail are computed from
+FINGERPRINT_DISTANCE = int(os.getenv("FINGERPRINT_DISTANCE", 8)) # Max Hamming distance between two fingerprints of the same screen
+FINGERPRINT_BLOCK_SIZE = int(os.getenv("FINGERPRINT_BLOCK_SIZE", 8)) # Side of the blocks two thumbnails of matching fingerprints are compared by
+FINGERPRINT_MAX_CHANGED_BLOCKS = int(os.getenv("FINGERPRINT_MAX_CHANGED_BLOCKS", 2)) # Blocks allowed to differ on the same screen, e.g. for a blinking cursor
+FINGERPRINT_HISTORY = int(os.getenv("FINGERPRINT_HISTORY", 32)) # Number of screens kept
+
+
+def _reduced(image: Union[Image.Image, ImageHandle, np.ndarray]) -> np.ndarray:
+    """The grayscale screen at FINGERPRINT_LEVEL; arrays are taken as they are"""
+    if isinstance(image, np.ndarray):
+        return image
+    if not isinstance(image, Frame):
+        image = Frame(as_handle(image).pil)
+    return image.pyramid(FINGERPRINT_LEVEL)
+
+
+def screen_fingerprint(image: Union[Image.Image, ImageHandle, np.ndarray], size: int = FINGERPRINT_SIZE) -> int:
+    """Computes a difference hash of the screen, which stays the same under small changes like a blinking cursor.
+
+    The screen is shrunk to a grid of size+1 by size cells, and every bit tells whether a
+    cell is brighter than its right neighbour. Small changes, like focusing a field or typing
+    in it, only flip a few bits, so a matching fingerprint only makes a candidate for the same
+    screen, see `ScreenHistory`.
+
+    Args:
+        image (Union[Image.Image, ImageHandle, np.ndarray]): The screen, a frame or a grayscale array
+        size (int): Side of the grid. Defaults to FINGERPRINT_SIZE.
+
+    Returns:
+        int: The fingerprint, size^2 bits
+    """
+    import cv2
+
+    cells = cv2.resize(_reduced(image), (size + 1, size), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = np.packbits(cells[:, 1:] > cells[:, :-1])
+    return int.from_bytes(bits.tobytes(), "big")
+
+
+def hamming_distance(fingerprint1: int, fingerprint2: int) -> int:
+    return (fingerprint1 ^ fingerprint2).bit_count()
+
+
+class Visit(NamedTuple):
+    step: int # Step the screen was seen at
+    fingerprint: int
+    thumbnail: Optional[np.ndarray] # The grayscale screen at FINGERPRINT_LEVEL, to confirm a matching fingerprint
+
+
+class ScreenHistory:
+    """A ring buffer of the last screens, to tell when the agent is back on a screen it has seen.
+
+    Screens are looked up by the Hamming distance of their fingerprints, and a match is
+    confirmed by comparing the thumbnails block by block, which tells apart the changes too
+    small for the fingerprint, like a focused field or a typed word.
+    """
+
+    def __init__(self, capacity: int = FINGERPRINT_HISTORY):
+        self.visits: deque = deque(maxlen=capacity)
+        self.steps = 0
+
+    def record(self, fingerprint: int, thumbnail: Optional[np.ndarray] = None) -> int:
+        """Adds the current screen and returns its step"""
+        step = self.steps
+        self.visits.append(Visit(step, fingerprint, thumbnail))
+        self.steps += 1
+        return step
+
+    def revisits(
+        self,
+        fingerprint: int,
+        thumbnail: Optional[np.ndarray] = None,
+        depth: int = FINGERPRINT_HISTORY,
+        max_distance: int = FINGERPRINT_DISTANCE,
+    ) -> List[Visit]:
+        """Finds the earlier visits of the same screen.
+
+        The last step is left out: staying on the same screen for one step is not going in circles.
+
+        Args:
+            fingerprint (int): Fingerprint of the screen
+            thumbnail (Optional[np.ndarray]): Thumbnail of the screen, compared with those of the
+                matching visits when both are known. Defaults to None.
+            depth (int): Number of the last steps to look at. Defaults to FINGERPRINT_HISTORY.
+            max_distance (int): Max Hamming distance to the fingerprint. Defaults to FINGERPRINT_DISTANCE.
+
+        Returns:
+            List[Visit]: The visits of the screen, the most recent first
+        """
+        return [
+            visit for visit in reversed(self.visits)
+            if self.steps - depth <= visit.step < self.steps - 1
+            and hamming_distance(visit.fingerprint, fingerprint) <= max_distance
+            and not self._differ(visit.thumbnail, thumbnail)
+        ]
+
+    def visit(self, image: Union[Image.Image, ImageHandle, np.ndarray], depth: int = FINGERPRINT_HISTORY) -> List[Visit]:
+        """Records the screen and returns its earlier visits in the last `depth` steps, see `revisits`"""
+        thumbnail = _reduced(image)
+        fingerprint = screen_fingerprint(thumbnail)
+        revisits = self.revisits(fingerprint, thumbnail, depth=depth)
+        self.record(fingerprint, thumbnail)
+        return revisits
+
+    def clear(self) -> None:
+        self.visits.clear()
+        self.steps = 0
+
+    @staticmethod
+    def _differ(thumbnail1: Optional[np.ndarray], thumbnail2: Optional[np.ndarray]) -> bool:
+        if thumbnail1 is None or thumbnail2 is None:
+            return False
+        changes = detect_changes(thumbnail1, thumbnail2, block_size=FINGERPRINT_BLOCK_SIZE)
+        # A count rather than a share of the blocks, so that a typed word still tells two large screens apart
+        return changes.blocks > FINGERPRINT_MAX_CHANGED_BLOCKS
@@ -0,0 +1,56 @@
+import time
+from functools import cached_property
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+from .cache import content_hash
+from .img import ImageHandle
+
+
+class Frame(ImageHandle):
+    """One capture of the desktop, shared by everything that looks at it during a step.
+
+    On top of the encodings of an `ImageHandle`, a frame lazily computes and keeps the views
+    the vision code works on: the RGB array, the grayscale array, a downscaled grayscale
+    pyramid and the content hash, so the screenshot is decoded and converted only once.
+    """
+
+    def __init__(self, image: Optional[Image.Image] = None, b64: Optional[str] = None, captured_at: Optional[float] = None):
+        super().__init__(image=image, b64=b64)
+        self.captured_at = captured_at if captured_at is not None else time.time()
+        self._pyramid: List[np.ndarray] = []
+        # The frame captured just before this one, so that the views can be updated from its changes
+        self.previous: Optional["Frame"] = None
+
+    @cached_property
+    def rgb(self) -> np.ndarray:
+        image = self.pil
+        return np.asarray(image if image.mode == "RGB" else image.convert("RGB"))
+
+    @cached_property
+    def gray(self) -> np.ndarray:
+        import cv2
+
+        return cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+
+    @cached_property
+    def content_hash(self) -> str:
+        return content_hash(self.rgb)
+
+    def pyramid(self, level: int) -> np.ndarray:
+        """The grayscale frame halved `level` times, with area averaging; level 0 is the grayscale frame itself"""
+        import cv2
+
+        if not self._pyramid:
+            self._pyramid.append(self.gray)
+        while len(self._pyramid) <= level:
+            previous = self._pyramid[-1]
+            size = (max(previous.shape[1] // 2, 1), max(previous.shape[0] // 2, 1))
+            self._pyramid.append(cv2.resize(previous, size, interpolation=cv2.INTER_AREA))
+        return self._pyramid[level]
+
+    def age(self) -> float:
+        """Seconds since the capture"""
+        return time.time() - self.captured_at
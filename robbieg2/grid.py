@@ -1,10 +1,31 @@
+import os
+from functools import lru_cache
+
+import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
+from .cache import LRUCache
+
+GRID_OVERLAY_CACHE_SIZE = int(os.getenv("GRID_OVERLAY_CACHE_SIZE", 16)) # Number of grid overlays kept in memory, in their sparse form
+GRID_OVERLAY_CACHE_MAX_BYTES = int(os.getenv("GRID_OVERLAY_CACHE_MAX_BYTES", 32 * 1024 * 1024)) # Memory bound of the kept overlays
+
 # We need a simple grid: numbers from 1 to 9 in points on an intersection of nxn grid.
 # The font size may be 1/5 of the size of the height of the cell.
 # Therefore, we need the size of the image and colors, and the file_name. 
 
-def create_grid_image(image_width, image_height, color_circle, color_number, n, file_name):
+@lru_cache(maxsize=32)
+def _load_font(size):
+    return ImageFont.truetype("font/arialbd.ttf", size)
+
+def create_grid_image(image_width, image_height, color_circle, color_number, n, file_name=None):
+    """Returns the transparent grid overlay for an image of the given size, also saving it if a file name is given."""
+    img = grid_overlay(image_width, image_height, color_circle, color_number, n)
+    if file_name:
+        img.save(file_name)
+    return img
+
+def grid_overlay(image_width, image_height, color_circle, color_number, n):
+    """Renders the transparent grid overlay for an image of the given size."""
     cell_width = image_width // n
     cell_height = image_height // n
     font_size = max(cell_height // 5, 20)
@@ -15,7 +36,7 @@ def create_grid_image(image_width, image_height, color_circle, color_number, n,
     draw = ImageDraw.Draw(img)
 
     # Load a font
-    font = ImageFont.truetype("font/arialbd.ttf", font_size)
+    font = _load_font(font_size)
 
     # Set the number of cells in each dimension
     num_cells_x = n - 1 
@@ -34,11 +55,50 @@ def create_grid_image(image_width, image_height, color_circle, color_number, n,
             offset_x = font_size / 4 if number < 10 else font_size / 2
             draw.text((x - offset_x, y - font_size / 2), text, font=font, fill=color_number)
 
-    # Save the image
-    img.save(file_name)
+    return img
+
+_sparse_overlays = LRUCache(max_entries=GRID_OVERLAY_CACHE_SIZE, max_bytes=GRID_OVERLAY_CACHE_MAX_BYTES)
+
+def _sparse_overlay(image_width, image_height, color_circle, color_number, n):
+    # Only the circles are drawn, so the blend only needs the few pixels that are not transparent;
+    # only those are kept, the zoomed regions have a different size on almost every click
+    key = (image_width, image_height, color_circle, color_number, n)
+    sparse = _sparse_overlays.get(key)
+    if sparse is None:
+        rgba = np.asarray(grid_overlay(*key)).reshape(-1, 4)
+        index = np.flatnonzero(rgba[:, 3]).astype(np.int32 if rgba.shape[0] < 2 ** 31 else np.int64)
+        sparse = (index, rgba[index])
+        _sparse_overlays.put(key, sparse, index.nbytes + sparse[1].nbytes)
+    index, pixels = sparse
+    pixels = pixels.astype(np.float32)
+    return index, pixels[:, :3], pixels[:, 3:] / 255
+
+def overlay_grid(image, color_circle, color_number, n, opacity=1):
+    """Draws the grid over a grayscale version of the image, in memory.
+
+    Gives the same result as saving the grid with `create_grid_image` and merging the files with
+    `superimpose_images`, but only the opaque pixels of the overlay are kept and blended.
+
+    Args:
+        image (Image.Image): The image
+        color_circle (str): Color of the circles
+        color_number (str): Color of the numbers
+        n (int): Grid size, the grid has (n-1)^2 points
+        opacity (float): Opacity of the grid. Defaults to 1.
+
+    Returns:
+        Image.Image: The RGB merged image
+    """
+    index, color, alpha = _sparse_overlay(image.width, image.height, color_circle, color_number, n)
+    gray = np.asarray(image.convert("L"))
+    merged = np.repeat(gray.reshape(-1, 1), 3, axis=1)
+    # Same as blending the overlay with a transparent image, then alpha compositing it over the gray one
+    alpha = alpha * opacity
+    merged[index] = np.clip(color * opacity * alpha + merged[index] * (1 - alpha) + 0.5, 0, 255).astype(np.uint8)
+    return Image.fromarray(merged.reshape(image.height, image.width, 3))
 
 def zoom_in(image_path, n, index, upscale):
-    img = Image.open(image_path)
+    img = Image.open(image_path) if isinstance(image_path, str) else image_path
     width, height = img.size
     # we need to calculate the cell size
     cell_width = width // n
@@ -60,8 +120,8 @@ def zoom_in(image_path, n, index, upscale):
 
 def superimpose_images(image1_path, image2_path, opacity):
     # Open the images
-    image1 = Image.open(image1_path)
-    image2 = Image.open(image2_path)
+    image1 = Image.open(image1_path) if isinstance(image1_path, str) else image1_path
+    image2 = Image.open(image2_path) if isinstance(image2_path, str) else image2_path
 
     # Ensure both images have the same size
     if image1.size != image2.size:
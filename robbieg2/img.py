@@ -1,8 +1,11 @@
-from typing import Tuple, List
+from functools import cached_property
+from typing import Dict, NamedTuple, Optional, Tuple, List, Union
 from PIL import Image, ImageDraw, ImageFont
 import base64
+import os
 from io import BytesIO
 from PIL import Image, ImageDraw
+import numpy as np
 
 
 class Box:
@@ -363,6 +366,93 @@ def image_to_b64(img: Image.Image, image_format="PNG") -> str:
     return f"data:{mime_type};base64,{base64_encoded_data}"
 
 
+class EncodePolicy(NamedTuple):
+    """How images of one kind are encoded for the model.
+
+    Attributes:
+        format (str): "png", "webp" (lossless) or "jpeg"
+        quality (int): PNG compress level (0-9), lossless WebP effort (0-100) or JPEG quality (1-95)
+        max_pixels (int): Larger images are downscaled to this many pixels, 0 for no limit
+        max_bytes (int): Larger encodings are downscaled until they fit, 0 for no limit
+    """
+    format: str = "png"
+    quality: int = 6
+    max_pixels: int = 0
+    max_bytes: int = 0
+
+
+# Quality of a format when a policy changes the format without giving one, the scales differ between formats
+DEFAULT_QUALITY = {"png": 6, "webp": 80, "jpeg": 85}
+
+
+def _policy_from_env(kind: str, default: EncodePolicy) -> EncodePolicy:
+    """Reads IMAGE_POLICY_<KIND>, e.g. "format=jpeg,quality=85,max_pixels=2000000", over the default"""
+    spec = os.getenv(f"IMAGE_POLICY_{kind.upper()}", "")
+    fields = dict(item.split("=", 1) for item in spec.split(",") if "=" in item)
+    policy = default._replace(**{
+        key: value if key == "format" else int(value) for key, value in fields.items() if key in EncodePolicy._fields
+    })
+    if policy.format != default.format and "quality" not in fields:
+        policy = policy._replace(quality=DEFAULT_QUALITY[policy.format])
+    return policy
+
+
+# PNG level 6, the default, keeps the uploads small: level 1 saves about 55ms per screenshot but makes
+# it about 24% larger. Lossless WebP is usually smaller than any PNG, but not every model API accepts it
+IMAGE_POLICIES: Dict[str, EncodePolicy] = {
+    kind: _policy_from_env(kind, default)
+    for kind, default in {
+        "actor": EncodePolicy("png", 6),  # Screenshots for the actor and the critic
+        "grid": EncodePolicy("png", 6),  # Screenshots with the grid overlay, and the regions shown for reference
+        # Composites of the sections of a screenshot. No pixel budget: downscaling the tall vertical layout blurs
+        # its sections and, on busy screens, makes its PNG larger; the packed layout is the one that keeps it small
+        "composite": EncodePolicy("png", 6),
+        "debug": EncodePolicy("jpeg", 80, max_pixels=1_000_000),  # Images only posted to the debug thread
+    }.items()
+}
+
+
+def _encode(img: Image.Image, policy: EncodePolicy) -> bytes:
+    buffer = BytesIO()
+    if policy.format == "jpeg":
+        img.convert("RGB").save(buffer, format="JPEG", quality=policy.quality)
+    elif policy.format == "webp":
+        img.save(buffer, format="WEBP", lossless=True, quality=policy.quality, method=4)
+    else:
+        img.save(buffer, format="PNG", compress_level=policy.quality)
+    return buffer.getvalue()
+
+
+def _downscale(img: Image.Image, factor: float) -> Image.Image:
+    size = (max(int(img.width * factor), 1), max(int(img.height * factor), 1))
+    return img.resize(size, resample=Image.LANCZOS)
+
+
+def encode_image(img: Image.Image, kind: str = "actor") -> str:
+    """Encodes an image for the model as a data URI, following the policy of its kind.
+
+    Args:
+        img (Image.Image): The image
+        kind (str): One of IMAGE_POLICIES. Defaults to "actor".
+
+    Returns:
+        str: A base64 data URI of the image, downscaled if needed to fit the budget of the policy
+    """
+    policy = IMAGE_POLICIES[kind]
+    if policy.max_pixels and img.width * img.height > policy.max_pixels:
+        img = _downscale(img, (policy.max_pixels / (img.width * img.height)) ** 0.5)
+
+    data = _encode(img, policy)
+    # Bytes grow roughly with the number of pixels, a few attempts are enough to fit
+    for _ in range(4):
+        if not policy.max_bytes or len(data) <= policy.max_bytes:
+            break
+        img = _downscale(img, (policy.max_bytes / len(data)) ** 0.5 * 0.9)
+        data = _encode(img, policy)
+
+    return f"data:image/{policy.format};base64,{base64.b64encode(data).decode('utf-8')}"
+
+
 def b64_to_image(base64_str: str) -> Image.Image:
     """Converts a base64 string to a PIL Image object.
 
@@ -381,6 +471,73 @@ def b64_to_image(base64_str: str) -> Image.Image:
     return image
 
 
+class ImageHandle:
+    """One image with all its representations, each computed at most once.
+
+    A handle is created either from a PIL image or from a base64 PNG, as the desktop returns
+    screenshots, and every consumer of the same pixels should share it: the decoded image,
+    the grayscale array, the PNG bytes and the encodings for the model are then produced
+    only when first asked for, and only once.
+    """
+
+    def __init__(self, image: Optional[Image.Image] = None, b64: Optional[str] = None):
+        if image is None and b64 is None:
+            raise ValueError("An image handle needs either an image or a base64 string")
+        if image is not None:
+            self.__dict__["pil"] = image
+        if b64 is not None:
+            # Strip the MIME type prefix if present
+            self.__dict__["b64"] = b64.split(",", 1)[1] if b64.startswith("data:") else b64
+        self._encoded: Dict[str, str] = {}
+
+    @cached_property
+    def pil(self) -> Image.Image:
+        image = Image.open(BytesIO(self.png_bytes))
+        image.load()
+        return image
+
+    @cached_property
+    def png_bytes(self) -> bytes:
+        if "b64" in self.__dict__:
+            data = base64.b64decode(self.b64)
+            if data.startswith(b"\x89PNG"):
+                return data
+            return _encode(Image.open(BytesIO(data)), EncodePolicy("png", 6))
+        return _encode(self.pil, EncodePolicy("png", 6))
+
+    @cached_property
+    def b64(self) -> str:
+        return base64.b64encode(self.png_bytes).decode("utf-8")
+
+    @cached_property
+    def data_uri(self) -> str:
+        return f"data:image/png;base64,{self.b64}"
+
+    @cached_property
+    def gray(self) -> np.ndarray:
+        return np.asarray(self.pil.convert("L"))
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.pil.size
+
+    def encoded(self, kind: str = "actor") -> str:
+        """The data URI of the image for the model, following the policy of its kind, see `encode_image`"""
+        if kind not in self._encoded:
+            policy = IMAGE_POLICIES[kind]
+            if policy.format == "png" and not policy.max_pixels and not policy.max_bytes and "b64" in self.__dict__:
+                # The PNG we already have is as good, whatever its compression level
+                self._encoded[kind] = self.data_uri
+            else:
+                self._encoded[kind] = encode_image(self.pil, kind)
+        return self._encoded[kind]
+
+
+def as_handle(image: Union[Image.Image, ImageHandle]) -> ImageHandle:
+    """Wraps an image in a handle, handles are returned as they are"""
+    return image if isinstance(image, ImageHandle) else ImageHandle(image)
+
+
 def load_image_base64(filepath: str) -> str:
     # Load the image from the file path
     image = Image.open(filepath)
@@ -0,0 +1,96 @@
+import logging
+import os
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import easyocr
+
+logger = logging.getLogger(__name__)
+logger.setLevel(int(os.getenv("LOG_LEVEL", logging.DEBUG)))
+
+OCR_ONNX_DIR = os.getenv("OCR_ONNX_DIR", os.path.expanduser("~/.EasyOCR/onnx")) # Where the exported models are kept
+
+
+class OnnxModule:
+    """Stands in for an EasyOCR torch model, running its ONNX export with ONNX Runtime instead.
+
+    EasyOCR calls its models with torch tensors and reads torch tensors back, so the
+    wrapper converts on the way in and out.
+    """
+
+    def __init__(self, path: str):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("OCR_BACKEND=onnx needs onnxruntime, please `pip install onnxruntime`")
+
+        self.session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def eval(self) -> "OnnxModule":
+        return self
+
+    def __call__(self, *inputs):
+        import torch
+
+        # The exporter drops the inputs a model ignores, like the text of the CTC recognizer
+        feed = {
+            name: value.cpu().numpy() for name, value in zip(self.input_names, inputs)
+        }
+        outputs = [torch.from_numpy(output) for output in self.session.run(None, feed)]
+        return outputs[0] if len(outputs) == 1 else tuple(outputs)
+
+
+def _export(model, args: tuple, path: str, input_names: list, output_names: list, dynamic_axes: dict) -> None:
+    import torch
+
+    logger.info(f"exporting EasyOCR model to {path}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            model.eval(), args, tmp_path,
+            input_names=input_names, output_names=output_names,
+            dynamic_axes=dynamic_axes, opset_version=17,
+        )
+    os.replace(tmp_path, path)
+
+
+def use_onnx_runtime(reader: "easyocr.Reader", onnx_dir: str = OCR_ONNX_DIR) -> "easyocr.Reader":
+    """Replaces the detection and recognition models of a reader with their ONNX Runtime versions.
+
+    The models are exported on first use and kept in `onnx_dir`. The reader must have been
+    created with `quantize=False`, since dynamically quantized torch models cannot be exported.
+
+    Args:
+        reader (easyocr.Reader): Reader to convert
+        onnx_dir (str): Directory of the exported models. Defaults to OCR_ONNX_DIR.
+
+    Returns:
+        easyocr.Reader: The same reader, now running on ONNX Runtime
+    """
+    import torch
+
+    detector_path = os.path.join(onnx_dir, "craft_detector.onnx")
+    if not os.path.exists(detector_path):
+        _export(
+            reader.detector, (torch.zeros(1, 3, 640, 640),), detector_path,
+            input_names=["image"], output_names=["y", "feature"],
+            dynamic_axes={
+                "image": {0: "batch", 2: "height", 3: "width"},
+                "y": {0: "batch", 1: "height", 2: "width"},
+                "feature": {0: "batch", 2: "height", 3: "width"},
+            },
+        )
+
+    recognizer_path = os.path.join(onnx_dir, f"recognizer_{'_'.join(reader.lang_list)}.onnx")
+    if not os.path.exists(recognizer_path):
+        _export(
+            reader.recognizer, (torch.zeros(1, 1, 64, 256), torch.zeros(1, 1, dtype=torch.long)), recognizer_path,
+            input_names=["image", "text"], output_names=["preds"],
+            dynamic_axes={"image": {0: "batch", 3: "width"}, "preds": {0: "batch", 1: "length"}},
+        )
+
+    reader.detector = OnnxModule(detector_path)
+    reader.recognizer = OnnxModule(recognizer_path)
+    return reader
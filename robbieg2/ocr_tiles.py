@@ -0,0 +1,276 @@
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import List, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from .img import Box
+
+logger = logging.getLogger(__name__)
+logger.setLevel(int(os.getenv("LOG_LEVEL", logging.DEBUG)))
+
+
+def available_cpus() -> int:
+    """Number of CPUs the process may use, following the CPU affinity and the cgroup quota of the container"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    # cgroup v2 keeps "<quota> <period>", v1 keeps them in two files; "max" or -1 means no quota
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = f.read().strip()
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = f.read().strip()
+        except OSError:
+            return cpus
+    if quota in ("max", "-1"):
+        return cpus
+    return max(1, min(cpus, int(quota) // int(period)))
+
+
+OCR_TILE_SIZE = int(os.getenv("OCR_TILE_SIZE", 1024)) # Width and height of a tile
+OCR_TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", 128)) # Overlap between neighbouring tiles, should exceed the tallest text line
+OCR_TILE_WORKERS = int(os.getenv("OCR_TILE_WORKERS", min(available_cpus(), 4))) # Number of OCR processes
+OCR_TILE_DEDUP_OVERLAP = float(os.getenv("OCR_TILE_DEDUP_OVERLAP", 0.6)) # Share of the smaller box that must be covered to be a duplicate
+
+# Each worker process keeps its own reader, loaded once by the pool initializer
+_worker_reader = None
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+# Every worker puts its pid there once its reader is loaded
+_ready_queue: Optional[multiprocessing.Queue] = None
+_pool_ready = threading.Event()
+
+
+def _init_worker(languages: List[str], ready: multiprocessing.Queue) -> None:
+    global _worker_reader
+    import torch
+    from .easyocr import create_reader
+
+    # The parallelism comes from the processes, one thread each avoids oversubscribing the CPU
+    torch.set_num_threads(1)
+    _worker_reader = create_reader(languages)
+    ready.put(os.getpid())
+
+
+def _read_tile(tile: np.ndarray, offset_x: int, offset_y: int) -> [dict]:
+    from .easyocr import _process_results
+
+    return _process_results(_worker_reader.readtext(tile), offset_x=offset_x, offset_y=offset_y)
+
+
+def get_tile_pool() -> ProcessPoolExecutor:
+    """Returns the process pool used for tiled OCR, starting it on first use."""
+    global _pool, _ready_queue
+    with _pool_lock:
+        if _pool is None:
+            from .easyocr import OCR_LANGUAGES
+
+            context = multiprocessing.get_context("spawn")
+            _ready_queue = context.Queue()
+            _pool = ProcessPoolExecutor(
+                max_workers=OCR_TILE_WORKERS,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(OCR_LANGUAGES, _ready_queue),
+            )
+        return _pool
+
+
+def _noop() -> None:
+    pass
+
+
+def warmup_tile_pool(timeout: Optional[float] = None) -> None:
+    """Starts the OCR processes and waits until every one of them has loaded its reader.
+
+    Args:
+        timeout (Optional[float]): Seconds to wait for the readers. Defaults to OCR_LEASE_TIMEOUT.
+    """
+    from .easyocr import OCR_LEASE_TIMEOUT
+
+    if _pool_ready.is_set():
+        return
+    pool = get_tile_pool()
+    # The pool starts a process for every task sent while none is idle
+    futures = [pool.submit(_noop) for _ in range(OCR_TILE_WORKERS)]
+    done, _ = wait(futures, timeout=timeout or OCR_LEASE_TIMEOUT)
+    for future in done:
+        # Raises if a process died while loading its reader
+        future.result()
+    try:
+        for _ in range(OCR_TILE_WORKERS):
+            _ready_queue.get(timeout=timeout or OCR_LEASE_TIMEOUT)
+    except queue.Empty:
+        raise TimeoutError(f"The OCR tile processes did not load their readers in {timeout or OCR_LEASE_TIMEOUT}s")
+    _pool_ready.set()
+
+
+def is_tile_pool_ready() -> bool:
+    """Whether every OCR process has loaded its reader."""
+    return _pool_ready.is_set()
+
+
+def shutdown_tile_pool() -> None:
+    global _pool, _ready_queue
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+            _ready_queue = None
+            _pool_ready.clear()
+
+
+def split_into_tiles(
+    width: int, height: int, tile_size: int = OCR_TILE_SIZE, overlap: int = OCR_TILE_OVERLAP
+) -> List[Box]:
+    """Splits an image into overlapping tiles covering all of it.
+
+    Args:
+        width (int): Width of the image
+        height (int): Height of the image
+        tile_size (int): Width and height of a tile. Defaults to OCR_TILE_SIZE.
+        overlap (int): Overlap between neighbouring tiles. Defaults to OCR_TILE_OVERLAP.
+
+    Returns:
+        List[Box]: The tiles, row by row
+    """
+    step = max(tile_size - overlap, 1)
+
+    def starts(length: int) -> List[int]:
+        # Spread the tiles evenly, so that none of them ends up almost fully overlapping another
+        if length <= tile_size:
+            return [0]
+        count = math.ceil((length - overlap) / step)
+        return [round(i * (length - tile_size) / (count - 1)) for i in range(count)]
+
+    return [
+        Box(left, top, min(left + tile_size, width), min(top + tile_size, height))
+        for top in starts(height)
+        for left in starts(width)
+    ]
+
+
+def _same_row(a: dict, b: dict) -> bool:
+    inter_h = min(a["y"] + a["h"], b["y"] + b["h"]) - max(a["y"], b["y"])
+    return inter_h >= 0.5 * min(a["h"], b["h"])
+
+
+def _join_text(left: str, right: str, overlap: float) -> str:
+    """Joins the text of two fragments of a line read by two tiles, dropping the words both of them read.
+
+    Args:
+        left (str): Text of the left fragment
+        right (str): Text of the right fragment
+        overlap (float): Share of the right fragment that the left one covers, used when the
+            words read twice do not match exactly
+
+    Returns:
+        str: The text of the whole line
+    """
+    left_words, right_words = left.split(), right.split()
+    for count in range(min(len(left_words), len(right_words)), 0, -1):
+        if left_words[-count:] == right_words[:count]:
+            return " ".join(left_words + right_words[count:])
+    return " ".join(left_words + right_words[round(len(right_words) * overlap):])
+
+
+def merge_text_boxes(results: [dict], overlap: float = OCR_TILE_DEDUP_OVERLAP) -> [dict]:
+    """Merges the text found by overlapping tiles.
+
+    When two boxes cover the same text, the larger one is kept, since the smaller one is
+    usually the same text cut by the edge of a tile. A line longer than the overlap of two
+    tiles is read as two fragments instead, each one cut by the edge of its tile, so boxes of
+    the same row that overlap, or touch, and both stick out of each other are joined, along
+    with their text in x order.
+
+    Args:
+        results ([dict]): Text boxes from all the tiles
+        overlap (float): Share of the smaller box that must be covered by the larger one
+            for them to be duplicates. Defaults to OCR_TILE_DEDUP_OVERLAP.
+
+    Returns:
+        [dict]: Merged text boxes
+    """
+    ordered = sorted(results, key=lambda r: (r["w"] * r["h"], r["confidence"]), reverse=True)
+    kept = []
+    for result in ordered:
+        area = max(result["w"] * result["h"], 1)
+        duplicate = False
+        for other in kept:
+            inter_w = min(result["x"] + result["w"], other["x"] + other["w"]) - max(result["x"], other["x"])
+            inter_h = min(result["y"] + result["h"], other["y"] + other["h"]) - max(result["y"], other["y"])
+            # A fragment sticks out of the larger box by more than a character or so, a duplicate does not
+            sticks_out = max(other["x"] - result["x"], result["x"] + result["w"] - other["x"] - other["w"])
+            if inter_w > 0 and inter_h > 0 and inter_w * inter_h >= overlap * area and sticks_out <= max(result["h"], other["h"]):
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(result)
+
+    joined = []
+    for result in sorted(kept, key=lambda r: r["x"]):
+        for i, other in enumerate(joined):
+            other_right = other["x"] + other["w"]
+            if _same_row(result, other) and result["x"] <= other_right < result["x"] + result["w"]:
+                top = min(other["y"], result["y"])
+                bottom = max(other["y"] + other["h"], result["y"] + result["h"])
+                joined[i] = {
+                    **other,
+                    "y": top,
+                    "w": result["x"] + result["w"] - other["x"],
+                    "h": bottom - top,
+                    "text": _join_text(other["text"], result["text"], (other_right - result["x"]) / max(result["w"], 1)),
+                    "confidence": min(other["confidence"], result["confidence"]),
+                }
+                break
+        else:
+            joined.append(result)
+    return sorted(joined, key=lambda r: (r["y"], r["x"]))
+
+
+def find_all_text_tiled(
+    image: Union[Image.Image, np.ndarray],
+    tile_size: int = OCR_TILE_SIZE,
+    overlap: int = OCR_TILE_OVERLAP,
+) -> [dict]:
+    """Finds all the text in the image, reading overlapping tiles in parallel processes.
+
+    Meant for large and high-DPI screenshots, where a single EasyOCR call is effectively
+    single-threaded. Every worker process holds its own reader, so the memory cost grows
+    with OCR_TILE_WORKERS.
+
+    Args:
+        image (Union[Image.Image, np.ndarray]): The image to read
+        tile_size (int): Width and height of a tile. Defaults to OCR_TILE_SIZE.
+        overlap (int): Overlap between neighbouring tiles. Defaults to OCR_TILE_OVERLAP.
+
+    Returns:
+        [dict]: Text boxes with the keys x, y, w, h, text and confidence, like `find_all_text_with_bounding_boxes`
+    """
+    if isinstance(image, Image.Image):
+        image = np.asarray(image.convert("RGB"))
+    height, width = image.shape[:2]
+
+    pool = get_tile_pool()
+    futures = [
+        pool.submit(_read_tile, np.ascontiguousarray(image[tile.top:tile.bottom, tile.left:tile.right]), tile.left, tile.top)
+        for tile in split_into_tiles(width, height, tile_size, overlap)
+    ]
+    results = []
+    for future in futures:
+        results += future.result()
+    return merge_text_boxes(results)
@@ -0,0 +1,63 @@
+from typing import Optional
+
+from PIL import Image
+
+from .img import Box, ImageHandle
+
+
+class Region:
+    """A view of a region of a screenshot, upscaled by `scale`, as the zoom levels of the clicker see it.
+
+    It only holds a reference to the screenshot, the absolute box of the region and the scale;
+    the upscaled pixels are produced on the first call to `image`, when they are about to be
+    sent to the model, and kept for the following calls.
+    """
+
+    def __init__(self, source: Image.Image, box: Optional[Box] = None, scale: int = 1):
+        self.source = source
+        self.box = box or Box(0, 0, source.width, source.height)
+        self.scale = scale
+        self._image: Optional[Image.Image] = None
+        self._handle: Optional[ImageHandle] = None
+
+    @property
+    def width(self) -> int:
+        return self.box.width() * self.scale
+
+    @property
+    def height(self) -> int:
+        return self.box.height() * self.scale
+
+    def image(self) -> Image.Image:
+        """Materializes the region, cropped from the screenshot and upscaled with nearest neighbour"""
+        if self._image is None:
+            if self.scale == 1 and (self.box.width(), self.box.height()) == self.source.size:
+                self._image = self.source
+            else:
+                image = self.box.crop_image(self.source)
+                if self.scale != 1:
+                    image = image.resize((self.width, self.height), resample=Image.NEAREST)
+                self._image = image
+        return self._image
+
+    def handle(self) -> ImageHandle:
+        """The materialized region as a handle, shared by everything that encodes it"""
+        if self._handle is None:
+            self._handle = ImageHandle(self.image())
+        return self._handle
+
+    def to_absolute(self, relative_box: Box) -> Box:
+        """Converts a box in the coordinates of the upscaled region to the coordinates of the screenshot"""
+        return relative_box.to_absolute_with_upscale(self.box, self.scale)
+
+    def zoom(self, relative_box: Box, upscale: int = 1) -> "Region":
+        """The region of a box in the coordinates of this one, upscaled by `upscale` more.
+
+        Args:
+            relative_box (Box): The box, in the coordinates of this region
+            upscale (int): Additional upscale of the new region. Defaults to 1.
+
+        Returns:
+            Region: A view of the same screenshot, no pixels are copied
+        """
+        return Region(self.source, self.to_absolute(relative_box), self.scale * upscale)
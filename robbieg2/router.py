@@ -0,0 +1,4 @@
+from mllm import Router
+
+# The one router shared by the agent, the semantic desktop and the clicker
+router = Router.from_env()
@@ -1,15 +1,19 @@
+import asyncio
 import logging
 import os
 import sys
 from contextlib import asynccontextmanager
-from typing import Final
+from typing import Final, Optional
 
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from surfkit.server.routes import task_router
 
 from .agent import Agent, router
+from .ocr_tiles import shutdown_tile_pool
+from .vision_worker import vision
 
 # Configure logging
 logger: Final = logging.getLogger("robbieg2")
@@ -28,12 +32,28 @@ ALLOW_ORIGINS = os.getenv("ALLOW_ORIGINS", "*").split(",")
 ALLOW_METHODS = os.getenv("ALLOW_METHODS", "*").split(",")
 ALLOW_HEADERS = os.getenv("ALLOW_HEADERS", "*").split(",")
 
+# Set when the background initialization of the agent failed
+init_error: Optional[BaseException] = None
+
+
+def _init_done(future: asyncio.Future) -> None:
+    global init_error
+    if future.cancelled():
+        return
+    init_error = future.exception()
+    if init_error is not None:
+        logger.error("agent initialization failed", exc_info=init_error)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Initialize the agent type before the server comes live
-    Agent.init()
+    # Initialize the agent type in the background, so the server comes live right away
+    # and reports ready on /ready once the models are resident
+    init_future = asyncio.get_running_loop().run_in_executor(None, Agent.init)
+    init_future.add_done_callback(_init_done)
     yield
+    vision.shutdown()
+    shutdown_tile_pool()
 
 
 app = FastAPI(lifespan=lifespan)  # type: ignore
@@ -48,6 +68,16 @@ app.add_middleware(
 
 app.include_router(task_router(Agent, router))
 
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: reports ready only after the OCR models are loaded"""
+    if init_error is not None:
+        return JSONResponse(status_code=503, content={"ready": False, "error": repr(init_error)})
+    if not vision.is_ready():
+        return JSONResponse(status_code=503, content={"ready": False})
+    return {"ready": True}
+
 if __name__ == "__main__":
     port = os.getenv("SERVER_PORT", "9090")
     reload = os.getenv("SERVER_RELOAD", "true") == "true"
@@ -0,0 +1,81 @@
+import logging
+import os
+import time
+from typing import Callable, NamedTuple, Optional
+
+from .change_detection import detect_changes
+from .frame import Frame
+
+logger = logging.getLogger(__name__)
+logger.setLevel(int(os.getenv("LOG_LEVEL", logging.DEBUG)))
+
+SETTLE_WINDOW = float(os.getenv("SETTLE_WINDOW", 0.5)) # Seconds the screen must stay unchanged to be considered settled
+SETTLE_TIMEOUT = float(os.getenv("SETTLE_TIMEOUT", 2.0)) # Max seconds to wait for the screen to settle after an action
+SETTLE_LOAD_WINDOW = float(os.getenv("SETTLE_LOAD_WINDOW", 1.0)) # Stable window after loading a page, which may pause before rendering
+SETTLE_LOAD_TIMEOUT = float(os.getenv("SETTLE_LOAD_TIMEOUT", 5.0)) # Max seconds to wait for a page to load
+SETTLE_INTERVAL = float(os.getenv("SETTLE_INTERVAL", 0.1)) # Seconds between two polled screenshots
+SETTLE_LEVEL = int(os.getenv("SETTLE_LEVEL", 2)) # Pyramid level the polled screenshots are compared at, each level halves the size
+SETTLE_BLOCK_SIZE = int(os.getenv("SETTLE_BLOCK_SIZE", 8)) # Side of the blocks compared at that level
+SETTLE_MAX_CHANGED_BLOCKS = int(os.getenv("SETTLE_MAX_CHANGED_BLOCKS", 2)) # Blocks allowed to change between two polls, e.g. for a blinking cursor across two blocks
+
+
+class Settled(NamedTuple):
+    frame: Frame # The last polled frame
+    stable: bool # False if the timeout was reached first
+    waited: float # Seconds spent waiting
+
+
+def _changed(reference: Frame, frame: Frame, level: int, max_changed_blocks: int) -> bool:
+    if frame is reference:
+        return False
+    changes = detect_changes(reference.pyramid(level), frame.pyramid(level), block_size=SETTLE_BLOCK_SIZE)
+    # A count rather than a share of the blocks, so that a small change is not tolerated on a large screen
+    return changes.blocks > max_changed_blocks
+
+
+def wait_for_stable_screen(
+    capture: Callable[[], Frame],
+    window: float = SETTLE_WINDOW,
+    timeout: float = SETTLE_TIMEOUT,
+    interval: float = SETTLE_INTERVAL,
+    level: int = SETTLE_LEVEL,
+    max_changed_blocks: int = SETTLE_MAX_CHANGED_BLOCKS,
+) -> Settled:
+    """Polls the screen until it stays visually the same for a while, or until the timeout.
+
+    Every polled frame is compared at a low resolution with the first frame of the current
+    stable period, so that slow animations and progressive loading also count as changes.
+
+    Args:
+        capture (Callable[[], Frame]): Takes a new screenshot
+        window (float): Seconds the screen must stay unchanged. Defaults to SETTLE_WINDOW.
+        timeout (float): Max seconds to wait. Defaults to SETTLE_TIMEOUT.
+        interval (float): Seconds between two screenshots. Defaults to SETTLE_INTERVAL.
+        level (int): Pyramid level of the comparison. Defaults to SETTLE_LEVEL.
+        max_changed_blocks (int): Blocks allowed to change between two polls. Defaults to SETTLE_MAX_CHANGED_BLOCKS.
+
+    Returns:
+        Settled: The last frame, whether the screen settled and how long it took
+    """
+    start = time.monotonic()
+    reference = frame = capture()
+    stable_since = start
+    while True:
+        now = time.monotonic()
+        if now - stable_since >= window:
+            return Settled(frame, True, now - start)
+        if now - start >= timeout:
+            logger.debug(f"screen did not settle in {timeout}s")
+            return Settled(frame, False, now - start)
+
+        time.sleep(interval)
+        frame = capture()
+        if _changed(reference, frame, level, max_changed_blocks):
+            reference, stable_since = frame, time.monotonic()
+
+
+def wait_for_page_load(capture: Callable[[], Frame], timeout: Optional[float] = None) -> Settled:
+    """Waits for the screen to settle after opening a page, see `wait_for_stable_screen`"""
+    return wait_for_stable_screen(
+        capture, window=SETTLE_LOAD_WINDOW, timeout=SETTLE_LOAD_TIMEOUT if timeout is None else timeout
+    )
@@ -1,22 +1,30 @@
 import logging
 import os
+import threading
 import time
+from typing import Optional
+
 import requests
 
 from agentdesk.device import Desktop
-from mllm import Router
 from rich.console import Console
 from taskara import Task
 from toolfuse import Tool, action
 
 from .clicker import find_coordinates
+from .easyocr import ocr_cache
+from .frame import Frame
+from .router import router
+from .settle import Settled, wait_for_page_load, wait_for_stable_screen
 
-router = Router.from_env()
 console = Console()
 
 logger = logging.getLogger(__name__)
 logger.setLevel(int(os.getenv("LOG_LEVEL", logging.DEBUG)))
 
+SCREENSHOT_TTL = float(os.getenv("SCREENSHOT_TTL", 2.0)) # Seconds a screenshot is reused without asking the device again
+SCREENSHOT_PROBE = os.getenv("SCREENSHOT_PROBE", "true") == "true" # Reuse the last frame, and all it computed, when a new screenshot is identical
+
 
 class SemanticDesktop(Tool):
     """A semantic desktop replaces click actions with semantic description rather than coordinates"""
@@ -49,6 +57,90 @@ class SemanticDesktop(Tool):
             "failure": 0,
         }
 
+        # The last frame, served again while fresh, until an action changes the screen
+        self._frame: Optional[Frame] = None
+        self._frame_valid = False
+        # Whether the current frame was taken once the screen settled, after the last action
+        self._frame_settled = False
+        self._frame_lock = threading.Lock()
+        self.frame_stats = {"reused": 0, "probed": 0, "captured": 0, "settle_waited": 0.0}
+
+    def take_frame(self, max_age: float = SCREENSHOT_TTL) -> Frame:
+        """Returns a screenshot of the desktop as a Frame, to be shared by everything that looks at it.
+
+        The last frame is returned as is if it is younger than `max_age` and no action has been
+        taken since. Otherwise a new screenshot is taken, and if it is byte for byte the same as
+        the last one, the last frame is kept along with the views it has already computed.
+
+        Args:
+            max_age (float): Maximum age in seconds of a reused frame. Defaults to SCREENSHOT_TTL.
+
+        Returns:
+            Frame: The current screen
+        """
+        with self._frame_lock:
+            frame, valid = self._frame, self._frame_valid
+        if frame is not None and valid and frame.age() <= max_age:
+            self.frame_stats["reused"] += 1
+            return frame
+
+        b64 = self.desktop.take_screenshot()
+        if SCREENSHOT_PROBE and frame is not None and frame.__dict__.get("b64") == b64:
+            self.frame_stats["probed"] += 1
+            frame.captured_at = time.time()
+        else:
+            self.frame_stats["captured"] += 1
+            previous, frame = frame, Frame(b64=b64)
+            if previous is not None:
+                # Only one frame back is kept, not the whole history
+                previous.previous = None
+                frame.previous = previous
+        with self._frame_lock:
+            self._frame, self._frame_valid = frame, True
+        return frame
+
+    def invalidate_frame(self) -> None:
+        """Marks the last frame as outdated, to be called whenever the screen may have changed"""
+        with self._frame_lock:
+            self._frame_valid = self._frame_settled = False
+
+    def wait_until_stable(self, load: bool = False, **kwargs) -> Frame:
+        """Waits for the screen to settle, see `settle.wait_for_stable_screen`.
+
+        The last polled frame becomes the current frame, so the next screenshot is served from it.
+
+        Args:
+            load (bool): Whether a page is loading, which takes a longer stable window. Defaults to False.
+
+        Returns:
+            Frame: The settled screen
+        """
+        with self._frame_lock:
+            before = self._frame
+        capture = lambda: self.take_frame(max_age=0)
+        settled: Settled = wait_for_page_load(capture, **kwargs) if load else wait_for_stable_screen(capture, **kwargs)
+        self.frame_stats["settle_waited"] = round(self.frame_stats["settle_waited"] + settled.waited, 2)
+
+        frame = settled.frame
+        if frame is not before:
+            # The polls in between are not worth keeping, changes are tracked from the frame before the wait
+            frame.previous = before
+            if before is not None:
+                before.previous = None
+        with self._frame_lock:
+            self._frame, self._frame_valid, self._frame_settled = frame, True, True
+        return frame
+
+    def use(self, action, **kwargs):
+        # Every action may change the screen, unless it waited for the screen to settle at its end
+        with self._frame_lock:
+            self._frame_settled = False
+        try:
+            return super().use(action, **kwargs)
+        finally:
+            if not self._frame_settled:
+                self.invalidate_frame()
+
     @action
     def clean_text(self) -> str:
         """Clean the text input or area currently in focus. 
@@ -79,7 +171,7 @@ class SemanticDesktop(Tool):
         
         self.task.post_message(
             role="Clicker",
-            msg=f"Current statistics: {self.results}",
+            msg=f"Current statistics: {self.results}, OCR cache: {ocr_cache.stats()}, screenshots: {self.frame_stats}",
             thread="debug",
         )
         
@@ -122,8 +214,10 @@ class SemanticDesktop(Tool):
         logging.debug("moving mouse")
         body = {"x": int(x), "y": int(y)}
         resp = requests.post(f"{self.desktop.base_url}/move_mouse", json=body)
+        self.invalidate_frame()
         resp.raise_for_status()
-        time.sleep(2)
+        # Let hover effects render
+        self.wait_until_stable()
 
         if type == "single":
             logging.debug("clicking")
@@ -131,14 +225,14 @@ class SemanticDesktop(Tool):
                 f"{self.desktop.base_url}/click", json={"button": button}
             )
             resp.raise_for_status()
-            time.sleep(2)
         elif type == "double":
             logging.debug("double clicking")
             resp = requests.post(
                 f"{self.desktop.base_url}/double_click", json={"button": button}
             )
             resp.raise_for_status()
-            time.sleep(2)
         else:
             raise ValueError(f"unkown click type {type}")
+        self.invalidate_frame()
+        self.wait_until_stable()
         return
@@ -0,0 +1,525 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from .cache import content_hash
+from .img import Box
+
+logger = logging.getLogger(__name__)
+logger.setLevel(int(os.getenv("LOG_LEVEL", logging.DEBUG)))
+
+VISION_WORKERS = int(os.getenv("VISION_WORKERS", 0)) # Number of vision worker processes, 0 runs everything inline
+VISION_TIMEOUT = float(os.getenv("VISION_TIMEOUT", 120)) # Seconds a single vision request may take before its worker is restarted
+VISION_WARMUP = os.getenv("VISION_WARMUP", "true") == "true" # Whether workers load the OCR models as soon as they start
+VISION_RESTART_LIMIT = int(os.getenv("VISION_RESTART_LIMIT", 5)) # Restarts in a row of a worker that dies before it is ready, before giving up
+VISION_RESTART_BACKOFF = float(os.getenv("VISION_RESTART_BACKOFF", 0.5)) # Seconds before the first of those restarts, doubled for every next one
+
+
+ImageLike = Union[Image.Image, np.ndarray]
+
+
+def _as_pil(image: ImageLike) -> Image.Image:
+    return image if isinstance(image, Image.Image) else Image.fromarray(image)
+
+
+# - Operations, executed either inline or in a worker process
+
+
+def _op_find_text(image: ImageLike, **kwargs) -> [dict]:
+    from .easyocr import find_all_text_with_bounding_boxes
+
+    return find_all_text_with_bounding_boxes(image, **kwargs)
+
+
+def _op_find_text_in_region(image: ImageLike, box: Box, upscale: int, **kwargs) -> [dict]:
+    from .easyocr import find_all_text_in_region
+
+    return find_all_text_in_region(_as_pil(image), box, upscale, **kwargs)
+
+
+def _op_refine_text_in_region(image: ImageLike, box: Box, upscale: int, hints: [dict], **kwargs) -> [dict]:
+    from .easyocr import refine_text_in_region
+
+    return refine_text_in_region(_as_pil(image), box, upscale, hints, **kwargs)
+
+
+def _op_update_text(image: ImageLike, previous_results: [dict], changed_boxes: List[Box], **kwargs) -> [dict]:
+    from .easyocr import update_text
+
+    return update_text(image, previous_results, changed_boxes, **kwargs)
+
+
+def _op_create_composite(image: ImageLike, num_clusters: int, **kwargs) -> Tuple[Image.Image, list]:
+    from .canny_composite import create_region_composite
+
+    return create_region_composite(image, num_clusters, **kwargs)
+
+
+def _op_compare_images(image1: ImageLike, image2: ImageLike, **kwargs) -> float:
+    from .cheap_critic import compare_images
+
+    return compare_images(image1, image2, **kwargs)
+
+
+_OPS: Dict[str, Callable] = {
+    "find_text": _op_find_text,
+    "find_text_in_region": _op_find_text_in_region,
+    "refine_text_in_region": _op_refine_text_in_region,
+    "update_text": _op_update_text,
+    "create_composite": _op_create_composite,
+    "compare_images": _op_compare_images,
+}
+
+
+def _warm_imports() -> None:
+    """Imports the heavy vision dependencies ahead of the first request, they are deferred at import time"""
+    import cv2  # noqa: F401
+    import sklearn.cluster  # noqa: F401
+    import skimage.metrics  # noqa: F401
+
+
+# - Worker processes
+
+
+def _attach(spec: Tuple[str, tuple, str]) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    name, shape, dtype = spec
+    # Spawned workers share the resource tracker of the parent, which owns and unlinks the block
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _worker_main(requests: multiprocessing.Queue, results: multiprocessing.Queue, warmup: bool) -> None:
+    from . import easyocr
+
+    # A daemonic process cannot start the tile processes, the parallelism comes from the worker pool itself
+    easyocr.OCR_TILED = False
+    if warmup:
+        from .easyocr import warmup_readers
+
+        try:
+            _warm_imports()
+            warmup_readers()
+        except Exception as e:
+            results.put(("failed", os.getpid(), f"{type(e).__name__}: {e}"))
+            raise
+    results.put(("ready", os.getpid(), None))
+
+    while True:
+        job = requests.get()
+        if job is None:
+            return
+        job_id, op, specs, kwargs = job
+        attached = []
+        try:
+            attached = [_attach(spec) for spec in specs]
+            result = _OPS[op](*[array for _, array in attached], **kwargs)
+            results.put((job_id, True, result))
+        except Exception as e:
+            # Exceptions are not always picklable, so we only send their description back
+            results.put((job_id, False, f"{type(e).__name__}: {e}"))
+        finally:
+            for shm, array in attached:
+                del array
+                shm.close()
+
+
+class _Job:
+    def __init__(self, op: str, arrays: List[np.ndarray], kwargs: dict, timeout: float):
+        self.id = None
+        self.op = op
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.future: Future = Future()
+        self.started_at: Optional[float] = None
+        self.blocks: List[shared_memory.SharedMemory] = []
+        self.specs = []
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+            self.blocks.append(shm)
+            self.specs.append((shm.name, array.shape, array.dtype.str))
+
+    def release(self) -> None:
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+
+class _Worker:
+    def __init__(self, context, results: multiprocessing.Queue, warmup: bool, failures: int = 0):
+        self.requests = context.Queue()
+        self.process = context.Process(
+            target=_worker_main, args=(self.requests, results, warmup), daemon=True
+        )
+        self.process.start()
+        self.job: Optional[_Job] = None
+        self.ready = False
+        # Workers started in a row that died before being ready, and when to start the next one
+        self.failures = failures
+        self.restart_at: Optional[float] = None
+        self.error: Optional[str] = None
+
+
+class VisionWorkerPool:
+    """A pool of worker processes running the OCR, Canny and SSIM work off the agent thread.
+
+    Images are handed to the workers through shared memory, so only their descriptions go
+    through the queues. A supervisor thread dispatches the requests to idle workers, resolves
+    their futures and restarts the workers that crash or exceed the request timeout.
+    Workers that die before they are ready are restarted with an exponential backoff, and
+    after VISION_RESTART_LIMIT of them in a row the pool gives up and fails every request.
+    """
+
+    def __init__(self, size: int = VISION_WORKERS, timeout: float = VISION_TIMEOUT, warmup: bool = VISION_WARMUP):
+        self.size = max(size, 1)
+        self.timeout = timeout
+        self.warmup = warmup
+        self._context = multiprocessing.get_context("spawn")
+        self._results = None
+        self._workers: List[_Worker] = []
+        self._pending: "queue.Queue[_Job]" = queue.Queue()
+        self._jobs: Dict[int, _Job] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._supervisor: Optional[threading.Thread] = None
+        # Set when the workers could not be started
+        self.error: Optional[BaseException] = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._running.is_set() or self.error is not None:
+                return
+            self._results = self._context.Queue()
+            self._workers = [self._spawn() for _ in range(self.size)]
+            self._running.set()
+            self._supervisor = threading.Thread(target=self._supervise, name="vision-supervisor", daemon=True)
+            self._supervisor.start()
+
+    def is_ready(self) -> bool:
+        """Whether every worker has started and loaded its models."""
+        return self._running.is_set() and all(worker.ready for worker in self._workers)
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.is_ready():
+            if self.error is not None:
+                raise self.error
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def submit(self, op: str, images: List[np.ndarray], timeout: Optional[float] = None, **kwargs) -> Future:
+        """Queue an operation on the given images.
+
+        Args:
+            op (str): Name of the operation
+            images (List[np.ndarray]): Images the operation works on, handed over through shared memory
+            timeout (Optional[float]): Seconds the operation may run. Defaults to the pool timeout.
+
+        Returns:
+            Future: Future of the result of the operation
+        """
+        if self.error is not None:
+            future = Future()
+            future.set_exception(self.error)
+            return future
+        if not self._running.is_set():
+            self.start()
+        job = _Job(op, images, kwargs, timeout or self.timeout)
+        job.id = next(self._ids)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._pending.put(job)
+        return job.future
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if not self._running.is_set():
+                return
+            self._running.clear()
+        self._supervisor.join()
+        for worker in self._workers:
+            worker.requests.put(None)
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+        for job in list(self._jobs.values()):
+            self._finish(job, error=RuntimeError("Vision worker pool shut down"))
+
+    def _spawn(self, failures: int = 0) -> _Worker:
+        return _Worker(self._context, self._results, self.warmup, failures)
+
+    def _finish(self, job: _Job, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self._jobs.pop(job.id, None)
+        job.release()
+        if job.future.done():
+            return
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+
+    def _restart(self, index: int) -> None:
+        worker = self._workers[index]
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join()
+        self._workers[index] = self._spawn(0 if worker.ready else worker.failures + 1)
+
+    def _give_up(self, reason: str) -> None:
+        self.error = RuntimeError(f"Vision workers failed to start: {reason}")
+        logger.error(str(self.error))
+        self._running.clear()
+        for worker in self._workers:
+            if worker.process.is_alive():
+                worker.process.kill()
+        while True:
+            try:
+                self._pending.get_nowait()
+            except queue.Empty:
+                break
+        for job in list(self._jobs.values()):
+            self._finish(job, error=self.error)
+
+    def _supervise(self) -> None:
+        while self._running.is_set():
+            try:
+                job_id, ok, payload = self._results.get(timeout=0.05)
+                # Workers announce themselves with ("ready", pid, None) once their models are loaded
+                if job_id == "ready":
+                    for worker in self._workers:
+                        if worker.process.pid == ok:
+                            worker.ready = True
+                elif job_id == "failed":
+                    for worker in self._workers:
+                        if worker.process.pid == ok:
+                            worker.error = payload
+                else:
+                    for worker in self._workers:
+                        if worker.job is not None and worker.job.id == job_id:
+                            worker.job = None
+                    job = self._jobs.get(job_id)
+                    if job is not None:
+                        self._finish(job, result=payload if ok else None, error=None if ok else RuntimeError(payload))
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            for index, worker in enumerate(self._workers):
+                job = worker.job
+                if job is not None and not worker.process.is_alive():
+                    logger.warning(f"vision worker {index} crashed running '{job.op}', restarting it")
+                    worker.job = None
+                    self._finish(job, error=RuntimeError(f"Vision worker crashed running '{job.op}'"))
+                    self._restart(index)
+                elif job is not None and now - job.started_at > job.timeout:
+                    logger.warning(f"vision request '{job.op}' timed out after {job.timeout}s, restarting worker {index}")
+                    worker.job = None
+                    self._finish(job, error=TimeoutError(f"Vision request '{job.op}' timed out after {job.timeout}s"))
+                    self._restart(index)
+                elif job is None and not worker.process.is_alive():
+                    if worker.ready:
+                        self._restart(index)
+                    elif worker.failures >= VISION_RESTART_LIMIT:
+                        self._give_up(worker.error or f"worker exited with code {worker.process.exitcode}")
+                        return
+                    elif worker.restart_at is None:
+                        # Most likely the models failed to load, which will not get better by retrying right away
+                        delay = VISION_RESTART_BACKOFF * 2 ** worker.failures
+                        logger.warning(f"vision worker {index} exited before it was ready ({worker.error}), restarting it in {delay}s")
+                        worker.restart_at = now + delay
+                    elif now >= worker.restart_at:
+                        self._restart(index)
+
+            for worker in self._workers:
+                if worker.job is not None or not worker.ready:
+                    continue
+                try:
+                    job = self._pending.get_nowait()
+                except queue.Empty:
+                    break
+                if job.future.cancelled():
+                    self._finish(job)
+                    continue
+                job.started_at = time.monotonic()
+                worker.job = job
+                worker.requests.put((job.id, job.op, job.specs, job.kwargs))
+
+
+class VisionClient:
+    """Futures client for the vision operations.
+
+    With VISION_WORKERS=0 the operations run inline in the calling thread and the returned
+    futures are already resolved; otherwise they run on a `VisionWorkerPool`. OCR results
+    are cached in this process either way, so cache hits never reach a worker.
+    """
+
+    def __init__(self, workers: int = VISION_WORKERS, timeout: float = VISION_TIMEOUT):
+        self.timeout = timeout
+        self.pool = VisionWorkerPool(workers, timeout) if workers > 0 else None
+
+    def warmup(self) -> None:
+        """Load the models, either in this process or in the worker processes."""
+        if self.pool is None:
+            from .easyocr import warmup_readers
+
+            _warm_imports()
+            warmup_readers()
+        else:
+            self.pool.start()
+            self.pool.wait_ready()
+
+    def is_ready(self) -> bool:
+        if self.pool is None:
+            from .easyocr import readers_ready
+
+            return readers_ready()
+        return self.pool.is_ready()
+
+    def shutdown(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def _run(self, op: str, images: List[ImageLike], timeout: Optional[float] = None, **kwargs) -> Future:
+        if self.pool is None:
+            future = Future()
+            try:
+                future.set_result(_OPS[op](*images, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self.pool.submit(op, [np.asarray(image) for image in images], timeout=timeout, **kwargs)
+
+    def _run_ocr(self, key: tuple, op: str, images: List[ImageLike], timeout: Optional[float], **kwargs) -> Future:
+        from .easyocr import _results_size, ocr_cache
+
+        if self.pool is None:
+            # The OCR functions take care of the cache themselves
+            return self._run(op, images, **kwargs)
+
+        cached = ocr_cache.get(key)
+        if cached is not None:
+            future = Future()
+            future.set_result(list(cached))
+            return future
+
+        def store(done: Future) -> None:
+            # Failed reads come back empty, those are not worth caching
+            if not done.cancelled() and done.exception() is None and done.result():
+                ocr_cache.put(key, done.result(), _results_size(done.result()))
+
+        future = self._run(op, images, timeout=timeout, **kwargs)
+        future.add_done_callback(store)
+        return future
+
+    def find_text(
+        self, image: ImageLike, image_hash: Optional[str] = None, timeout: Optional[float] = None, **kwargs
+    ) -> Future:
+        """Future of `easyocr.find_all_text_with_bounding_boxes` on the image."""
+        from .easyocr import ocr_cache_key
+
+        image_hash = image_hash or content_hash(image)
+        return self._run_ocr(
+            ocr_cache_key("full", image_hash), "find_text", [image], timeout, image_hash=image_hash, **kwargs
+        )
+
+    def find_text_in_region(
+        self,
+        image: ImageLike,
+        box: Box,
+        upscale: int = 1,
+        image_hash: Optional[str] = None,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> Future:
+        """Future of `easyocr.find_all_text_in_region` on the image."""
+        from .easyocr import ocr_cache_key
+
+        image_hash = image_hash or content_hash(image)
+        return self._run_ocr(
+            ocr_cache_key("region", image_hash, box, upscale), "find_text_in_region", [image], timeout,
+            box=box, upscale=upscale, image_hash=image_hash, **kwargs
+        )
+
+    def refine_text_in_region(
+        self,
+        image: ImageLike,
+        box: Box,
+        upscale: int,
+        hints: [dict],
+        image_hash: Optional[str] = None,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> Future:
+        """Future of `easyocr.refine_text_in_region` on the image."""
+        from .easyocr import hints_in_region, ocr_cache_key
+
+        image_hash = image_hash or content_hash(image)
+        inside = hints_in_region(hints, box)
+        if not inside:
+            return self.find_text_in_region(image, box, upscale, image_hash=image_hash, timeout=timeout, **kwargs)
+        return self._run_ocr(
+            ocr_cache_key("refine", image_hash, box, upscale, inside), "refine_text_in_region", [image], timeout,
+            box=box, upscale=upscale, hints=inside, image_hash=image_hash, **kwargs
+        )
+
+    def update_text(
+        self,
+        image: ImageLike,
+        previous_results: [dict],
+        changed_boxes: List[Box],
+        image_hash: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Future:
+        """Future of `easyocr.update_text` on the image, cached like a full read of it."""
+        from .easyocr import ocr_cache_key
+
+        image_hash = image_hash or content_hash(image)
+        return self._run_ocr(
+            ocr_cache_key("full", image_hash), "update_text", [image], timeout,
+            previous_results=previous_results, changed_boxes=changed_boxes, image_hash=image_hash,
+        )
+
+    def create_composite(
+        self,
+        image: ImageLike,
+        num_clusters: int,
+        box: Optional[Box] = None,
+        upscale: int = 1,
+        image_hash: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Future:
+        """Future of `canny_composite.create_region_composite`, the composite of a region of the image and the bounding boxes of its sections.
+
+        The region tree of the image is cached by whichever process builds it, so with worker
+        processes the zoom levels reuse it when they are served by the same worker.
+        """
+        image_hash = image_hash or content_hash(image)
+        return self._run(
+            "create_composite", [image], timeout=timeout,
+            num_clusters=num_clusters, box=box, upscale=upscale, image_hash=image_hash,
+        )
+
+    def compare_images(
+        self, image1: ImageLike, image2: ImageLike, timeout: Optional[float] = None, **kwargs
+    ) -> Future:
+        """Future of `cheap_critic.compare_images`, the SSIM between two images, or between two grayscale arrays."""
+        return self._run("compare_images", [image1, image2], timeout=timeout, **kwargs)
+
+
+vision = VisionClient()
@@ -0,0 +1,62 @@
+import numpy as np
+from PIL import Image
+
+from robbieg2.cache import LRUCache, content_hash
+
+
+def test_evicts_least_recently_used_entry():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_bounded_by_bytes():
+    cache = LRUCache(max_entries=10, max_bytes=100)
+    cache.put("a", 1, size=60)
+    cache.put("b", 2, size=60)
+
+    assert cache.get("a") is None
+    assert cache.stats()["bytes"] == 60
+
+
+def test_skips_values_larger_than_the_cache():
+    cache = LRUCache(max_bytes=100)
+    cache.put("a", 1, size=101)
+
+    assert len(cache) == 0
+
+
+def test_replacing_an_entry_updates_its_size():
+    cache = LRUCache(max_bytes=100)
+    cache.put("a", 1, size=60)
+    cache.put("a", 2, size=30)
+
+    assert cache.get("a") == 2
+    assert cache.stats()["bytes"] == 30
+
+
+def test_counts_hits_and_misses():
+    cache = LRUCache()
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("b")
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_content_hash_follows_pixels_and_layout():
+    pixels = np.zeros((4, 6, 3), dtype=np.uint8)
+    changed = pixels.copy()
+    changed[1, 1] = 255
+
+    assert content_hash(pixels) == content_hash(pixels.copy())
+    assert content_hash(pixels) != content_hash(changed)
+    assert content_hash(pixels) != content_hash(pixels.reshape(6, 4, 3))
+    assert content_hash(Image.fromarray(pixels)) == content_hash(Image.fromarray(pixels.copy()))
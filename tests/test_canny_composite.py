@@ -0,0 +1,164 @@
+import random
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from robbieg2.canny_composite import (
+    CLUSTERING_METHODS,
+    GROUP_MARGIN,
+    MIN_CONTOUR_AREA,
+    RegionTree,
+    cluster_bounding_boxes,
+    cluster_members,
+    create_region_composite,
+    group_elements,
+    pack_cells,
+)
+
+
+def _group_elements_naive(binary_image):
+    """The quadratic grouping `group_elements` replaces: every contour is compared with every grouped one"""
+    contours, _ = cv2.findContours(binary_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    groups = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w * h < MIN_CONTOUR_AREA:
+            continue
+        for group in groups:
+            if any(
+                gx - GROUP_MARGIN <= x <= gx + gw + GROUP_MARGIN and gy - GROUP_MARGIN <= y <= gy + gh + GROUP_MARGIN
+                for gx, gy, gw, gh in map(cv2.boundingRect, group)
+            ):
+                group.append(contour)
+                break
+        else:
+            groups.append([contour])
+    return groups
+
+
+def _signature(groups) -> list:
+    return [[cv2.boundingRect(contour) for contour in group] for group in groups]
+
+
+def test_group_elements_matches_the_naive_grouping():
+    rng = np.random.default_rng(0)
+    edges = np.zeros((800, 1200), dtype=np.uint8)
+    for _ in range(400):
+        x, y = int(rng.integers(0, 1180)), int(rng.integers(0, 780))
+        w, h = int(rng.integers(2, 40)), int(rng.integers(2, 30))
+        cv2.rectangle(edges, (x, y), (x + w, y + h), 255, 1)
+
+    groups = group_elements(edges)
+    assert len(groups) > 1
+    assert _signature(groups) == _signature(_group_elements_naive(edges))
+
+
+def test_group_elements_of_an_empty_image():
+    assert group_elements(np.zeros((100, 100), dtype=np.uint8)) == []
+
+
+@pytest.mark.parametrize("method", sorted(CLUSTERING_METHODS))
+def test_clusters_are_at_most_the_requested_number_and_cover_every_box(method):
+    rng = np.random.default_rng(1)
+    boxes = [
+        (int(x), int(y), int(w), int(h))
+        for x, y, w, h in zip(*rng.integers(0, 2000, (2, 300)), *rng.integers(5, 80, (2, 300)))
+    ]
+    for num_clusters in (1, 3, 10):
+        regions, members = cluster_members(boxes, num_clusters, method)
+        assert len(regions) <= num_clusters
+        assert regions == cluster_bounding_boxes(boxes, num_clusters, method)
+        assert sorted(i for indices in members for i in indices) == list(range(len(boxes)))
+        for (rx, ry, rw, rh), indices in zip(regions, members):
+            for x, y, w, h in (boxes[i] for i in indices):
+                assert rx <= x and ry <= y and x + w <= rx + rw and y + h <= ry + rh
+
+
+def test_fewer_boxes_than_clusters_are_kept_as_they_are():
+    boxes = [(0, 0, 10, 10), (50, 50, 10, 10)]
+    assert cluster_bounding_boxes(boxes, 5) == boxes
+
+
+def _overlap(a, b) -> bool:
+    (ax, ay, aw, ah), (bx, by, bw, bh) = a, b
+    return ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah
+
+
+def test_cells_fit_in_the_sheet_without_overlapping():
+    rng = random.Random(0)
+    sizes = [(rng.randint(20, 400), rng.randint(10, 300)) for _ in range(12)]
+
+    positions, width, height = pack_cells(sizes)
+
+    cells = [(x, y, w, h) for (x, y), (w, h) in zip(positions, sizes)]
+    for x, y, w, h in cells:
+        assert 0 <= x and x + w <= width
+        assert 0 <= y and y + h <= height
+    for i, cell in enumerate(cells):
+        assert not any(_overlap(cell, other) for other in cells[i + 1:])
+
+
+def test_sheet_is_closer_to_a_square_than_a_column():
+    sizes = [(100, 100)] * 9
+
+    _, width, height = pack_cells(sizes)
+
+    assert max(width, height) < 900
+    assert width * height >= 9 * 100 * 100
+
+
+def _inside(inner, outer) -> bool:
+    return (
+        outer[0] <= inner[0] and outer[1] <= inner[1]
+        and inner[0] + inner[2] <= outer[0] + outer[2] and inner[1] + inner[3] <= outer[1] + outer[3]
+    )
+
+
+def test_region_tree_children_are_clusters_of_the_node_elements():
+    rng = np.random.default_rng(2)
+    elements = [(int(x), int(y), 20, 10) for x, y in zip(rng.integers(0, 980, 100), rng.integers(0, 790, 100))]
+    tree = RegionTree(elements, 1000, 800, num_clusters=4)
+
+    children = tree.root.children()
+    assert 1 < len(children) <= 4
+    assert tree.root.children() is children
+    assert sorted(e for child in children for e in child.elements) == sorted(elements)
+    for child in children:
+        assert _inside(child.box, tree.root.box)
+        assert tree.node(child.box) is child
+
+
+def test_region_tree_clips_the_elements_to_an_unknown_region():
+    tree = RegionTree([(0, 0, 100, 100), (500, 500, 10, 10)], 1000, 800, num_clusters=4)
+
+    node = tree.node((50, 50, 1000, 1000))
+
+    assert node.box == (50, 50, 950, 750)
+    assert node.elements == [(50, 50, 50, 50), (500, 500, 10, 10)]
+    assert tree.node((50, 50, 1000, 1000)) is node
+
+
+def _screenshot() -> np.ndarray:
+    image = np.full((600, 800, 3), 255, dtype=np.uint8)
+    for row in range(4):
+        for column in range(5):
+            x, y = 40 + column * 150, 40 + row * 130
+            cv2.rectangle(image, (x, y), (x + 80, y + 50), (40, 40, 40), 2)
+            cv2.putText(image, "ok", (x + 20, y + 35), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 200), 2)
+    return image
+
+
+def test_region_composite_sections_are_relative_to_the_upscaled_region():
+    image = _screenshot()
+
+    _, sections = create_region_composite(image, 4)
+    assert 1 < len(sections) <= 4
+
+    x, y, w, h = sections[0]
+    composite, region_sections = create_region_composite(image, 4, box=(x, y, w, h), upscale=2)
+    assert isinstance(composite, Image.Image)
+    assert 1 < len(region_sections) <= 4
+    for section in region_sections:
+        assert _inside(section, (0, 0, w * 2, h * 2))
@@ -0,0 +1,65 @@
+import numpy as np
+
+from robbieg2.change_detection import Changes, detect_changes, unaffected
+from robbieg2.img import Box
+
+
+def _frame() -> np.ndarray:
+    return np.full((200, 300), 255, dtype=np.uint8)
+
+
+def test_identical_frames_have_no_changes():
+    changes = detect_changes(_frame(), _frame())
+
+    assert not changes
+    assert changes.fraction == 0.0
+
+
+def test_change_is_covered_by_a_block_aligned_box():
+    after = _frame()
+    after[40:50, 70:90] = 0
+
+    changes = detect_changes(_frame(), after, block_size=16)
+
+    assert [(box.left, box.top, box.right, box.bottom) for box in changes.boxes] == [(64, 32, 96, 64)]
+    assert 0 < changes.fraction < 0.1
+    assert changes.blocks == 4
+
+
+def test_distant_changes_stay_apart_and_close_ones_merge():
+    after = _frame()
+    after[10:20, 10:20] = 0
+    after[10:20, 40:50] = 0
+    after[170:180, 250:260] = 0
+
+    changes = detect_changes(_frame(), after, block_size=16)
+
+    assert len(changes.boxes) == 2
+
+
+def test_small_differences_are_ignored():
+    after = _frame()
+    after[50:60, 50:60] -= 5  # Below the pixel threshold
+    after[100, 100] = 0  # Below the changed pixels of a block
+
+    assert not detect_changes(_frame(), after)
+
+
+def test_different_sizes_change_everything():
+    changes = detect_changes(_frame(), np.zeros((100, 100), dtype=np.uint8))
+
+    assert [(box.left, box.top, box.right, box.bottom) for box in changes.boxes] == [(0, 0, 100, 100)]
+    assert changes.fraction == 1.0
+    assert changes.blocks == 7 * 7
+
+
+def test_unaffected_keeps_results_outside_the_changes():
+    results = [
+        {"x": 0, "y": 0, "w": 10, "h": 10},
+        {"x": 45, "y": 45, "w": 10, "h": 10},
+        {"x": 100, "y": 100, "w": 10, "h": 10},
+    ]
+
+    kept = unaffected(results, Changes([Box(40, 40, 60, 60)], 0.1))
+
+    assert kept == [results[0], results[2]]
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from robbieg2.cheap_critic import SSIM_BAND_ROWS, compare_images, fast_ssim
+
+
+def _pair(seed: int, height: int = SSIM_BAND_ROWS * 2 + 37, width: int = 300):
+    rng = np.random.default_rng(seed)
+    gray1 = rng.integers(0, 256, (height, width), dtype=np.uint8)
+    gray2 = gray1.copy()
+    # A changed block and some noise, so the SSIM is neither 1 nor that of unrelated images
+    gray2[40:120, 50:200] = rng.integers(0, 256, (80, 150), dtype=np.uint8)
+    gray2 = np.clip(gray2.astype(int) + rng.integers(-20, 21, gray2.shape), 0, 255).astype(np.uint8)
+    return gray1, gray2
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_fast_ssim_matches_skimage(seed):
+    metrics = pytest.importorskip("skimage.metrics")
+    gray1, gray2 = _pair(seed)
+
+    expected = metrics.structural_similarity(gray1, gray2)
+    assert 0.1 < expected < 0.99
+    assert fast_ssim(gray1, gray2) == pytest.approx(expected, abs=1e-4)
+    assert compare_images(gray1, gray2, level=0, method="fast") == pytest.approx(
+        compare_images(gray1, gray2, method="skimage"), abs=1e-4
+    )
+
+
+def test_threshold_only_stops_below_it():
+    gray1, gray2 = _pair(0)
+    exact = fast_ssim(gray1, gray2)
+
+    assert fast_ssim(gray1, gray2, threshold=exact - 0.01) == pytest.approx(exact)
+    bound = fast_ssim(gray1, gray2, threshold=0.999)
+    assert exact <= bound < 0.999
+
+
+def test_identical_images():
+    gray, _ = _pair(0)
+
+    assert fast_ssim(gray, gray) == pytest.approx(1.0)
+    with pytest.raises(ValueError):
+        fast_ssim(gray, gray[:-1])
@@ -0,0 +1,42 @@
+from robbieg2.easyocr import _group_batches, _uncovered_rects
+from robbieg2.img import Box
+
+
+def _coords(boxes) -> list:
+    return [(box.left, box.top, box.right, box.bottom) for box in boxes]
+
+
+def test_whole_region_is_uncovered_without_hints():
+    assert _coords(_uncovered_rects([], Box(100, 100, 300, 200), 8)) == [(0, 0, 200, 100)]
+
+
+def test_text_next_to_a_hint_on_the_same_row_is_uncovered():
+    # A toolbar row with one detected word: the rest of the row must still be read
+    hints = [{"x": 110, "y": 110, "w": 50, "h": 20}]
+
+    rects = _coords(_uncovered_rects(hints, Box(100, 100, 300, 200), 8))
+
+    assert (60, 0, 200, 100) in rects  # Right of the word, full height
+    assert (0, 30, 200, 100) in rects  # Below the word, full width
+    for left, top, right, bottom in rects:
+        assert right <= 10 or left >= 60 or bottom <= 10 or top >= 30
+
+
+def test_gaps_smaller_than_the_min_gap_are_skipped():
+    hints = [{"x": 0, "y": 0, "w": 96, "h": 100}, {"x": 100, "y": 0, "w": 100, "h": 100}]
+
+    assert _uncovered_rects(hints, Box(0, 0, 200, 100), 8) == []
+
+
+def test_batches_group_crops_of_similar_sizes():
+    shapes = [(20, 400), (400, 20), (22, 380), (390, 24), (20, 30)]
+
+    batches = _group_batches(shapes, batch_size=8, max_padding=0.5)
+
+    assert sorted(sorted(batch) for batch in batches) == [[0, 2], [1, 3], [4]]
+
+
+def test_batches_respect_the_batch_size():
+    batches = _group_batches([(10, 10)] * 5, batch_size=2)
+
+    assert [len(batch) for batch in batches] == [2, 2, 1]
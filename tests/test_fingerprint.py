@@ -0,0 +1,74 @@
+import numpy as np
+from PIL import Image
+
+from robbieg2.fingerprint import ScreenHistory, hamming_distance, screen_fingerprint
+
+
+def _screen(seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (256, 384), dtype=np.uint8)
+
+
+def test_same_screen_has_the_same_fingerprint():
+    assert screen_fingerprint(_screen(0)) == screen_fingerprint(_screen(0).copy())
+
+
+def test_different_screens_are_far_apart():
+    assert hamming_distance(screen_fingerprint(_screen(0)), screen_fingerprint(_screen(1))) > 100
+
+
+def test_fingerprint_has_size_squared_bits():
+    assert screen_fingerprint(_screen(0), size=8) < 2 ** 64
+
+
+def test_hamming_distance_counts_differing_bits():
+    assert hamming_distance(0b1011, 0b0001) == 2
+
+
+def test_history_finds_recent_revisits_only():
+    history = ScreenHistory(capacity=8)
+    for fingerprint in [0b1111, 0, 0b1110, 0, 1]:
+        history.record(fingerprint)
+
+    assert [visit.step for visit in history.revisits(0b1111, max_distance=1)] == [2, 0]
+    assert [visit.step for visit in history.revisits(0b1111, depth=3, max_distance=1)] == [2]
+
+
+def test_history_leaves_out_the_last_step():
+    history = ScreenHistory()
+    history.record(0b1111)
+    history.record(0b1111)
+
+    assert [visit.step for visit in history.revisits(0b1111, max_distance=0)] == [0]
+
+
+def test_history_forgets_beyond_its_capacity():
+    history = ScreenHistory(capacity=2)
+    for fingerprint in [1, 2, 3, 4]:
+        history.record(fingerprint)
+
+    assert history.revisits(1, max_distance=0) == []
+
+
+def test_small_changes_are_not_the_same_screen():
+    screen = np.full((256, 384), 255, dtype=np.uint8)
+    focused = screen.copy()
+    focused[100:102, 50:300] = 0  # A border too thin to change the fingerprint
+    history = ScreenHistory()
+
+    assert history.visit(screen) == []
+    assert history.visit(focused) == []
+    assert history.visit(np.zeros_like(screen)) == []
+    assert [visit.step for visit in history.visit(screen.copy())] == [0]
+
+
+def test_typed_word_on_a_large_screen_is_not_the_same_screen():
+    screen = np.full((1712, 2880, 3), 255, dtype=np.uint8)
+    typed = screen.copy()
+    typed[300:324, 400:520] = 0
+    history = ScreenHistory()
+
+    history.visit(Image.fromarray(screen))
+    history.visit(Image.fromarray(np.zeros_like(screen)))
+    assert history.visit(Image.fromarray(typed)) == []
+    assert [visit.step for visit in history.visit(Image.fromarray(screen.copy()))] == [0]
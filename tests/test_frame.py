@@ -0,0 +1,22 @@
+import numpy as np
+from PIL import Image
+
+from robbieg2.frame import Frame
+
+
+def test_pyramid_halves_the_grayscale_frame():
+    rgb = np.random.default_rng(0).integers(0, 256, (100, 150, 3), dtype=np.uint8)
+    frame = Frame(Image.fromarray(rgb))
+
+    assert frame.pyramid(0) is frame.gray
+    assert frame.gray.shape == (100, 150)
+    assert frame.pyramid(2).shape == (25, 37)
+    assert frame.pyramid(1) is frame.pyramid(1)
+    assert abs(frame.pyramid(1).mean() - frame.gray.mean()) < 1
+
+
+def test_same_pixels_have_the_same_content_hash():
+    rgb = np.random.default_rng(0).integers(0, 256, (20, 30, 3), dtype=np.uint8)
+
+    assert Frame(Image.fromarray(rgb)).content_hash == Frame(Image.fromarray(rgb.copy())).content_hash
+    assert Frame(Image.fromarray(rgb)).content_hash != Frame(Image.fromarray(255 - rgb)).content_hash
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from robbieg2.grid import create_grid_image, overlay_grid, superimpose_images
+
+
+@pytest.mark.parametrize("opacity", [1, 0.6])
+def test_overlay_grid_matches_superimposing_the_grid_image(opacity):
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (300, 500, 3), dtype=np.uint8))
+
+    expected = superimpose_images(image, create_grid_image(500, 300, "yellow", "green", 4), opacity).convert("RGB")
+    merged = overlay_grid(image, "yellow", "green", 4, opacity)
+
+    assert merged.mode == "RGB" and merged.size == image.size
+    difference = np.abs(np.asarray(merged, dtype=int) - np.asarray(expected, dtype=int))
+    assert difference.max() <= 1
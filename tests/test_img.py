@@ -0,0 +1,101 @@
+import base64
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from robbieg2 import img
+from robbieg2.img import (
+    DEFAULT_QUALITY,
+    EncodePolicy,
+    ImageHandle,
+    _policy_from_env,
+    as_handle,
+    b64_to_image,
+    encode_image,
+)
+
+
+def _noisy(width: int = 400, height: int = 300) -> Image.Image:
+    return Image.fromarray(np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def _decoded_bytes(uri: str) -> bytes:
+    return base64.b64decode(uri.split(",", 1)[1])
+
+
+def test_png_policy_is_lossless():
+    image = _noisy()
+
+    uri = encode_image(image, "actor")
+
+    assert uri.startswith("data:image/png;base64,")
+    assert b64_to_image(uri).tobytes() == image.tobytes()
+
+
+def test_images_are_downscaled_to_the_pixel_budget(monkeypatch):
+    monkeypatch.setitem(img.IMAGE_POLICIES, "test", EncodePolicy("jpeg", 80, max_pixels=10_000))
+
+    uri = encode_image(_noisy(), "test")
+
+    assert uri.startswith("data:image/jpeg;base64,")
+    decoded = Image.open(BytesIO(_decoded_bytes(uri)))
+    assert decoded.format == "JPEG"
+    assert decoded.width * decoded.height <= 10_000
+    assert decoded.width / decoded.height == pytest.approx(4 / 3, rel=0.05)
+
+
+def test_encodings_are_downscaled_to_the_byte_budget(monkeypatch):
+    monkeypatch.setitem(img.IMAGE_POLICIES, "test", EncodePolicy("png", 6, max_bytes=50_000))
+
+    assert len(_decoded_bytes(encode_image(_noisy(), "test"))) <= 50_000
+
+
+@pytest.mark.parametrize(
+    "spec, expected",
+    [
+        ("", EncodePolicy("png", 6)),
+        ("quality=1", EncodePolicy("png", 1)),
+        ("format=jpeg", EncodePolicy("jpeg", DEFAULT_QUALITY["jpeg"])),
+        ("format=webp,max_pixels=1000", EncodePolicy("webp", DEFAULT_QUALITY["webp"], max_pixels=1000)),
+        ("format=jpeg,quality=60", EncodePolicy("jpeg", 60)),
+        ("format=png", EncodePolicy("png", 6)),
+    ],
+)
+def test_policy_overrides_from_the_environment(monkeypatch, spec, expected):
+    monkeypatch.setenv("IMAGE_POLICY_TEST", spec)
+
+    assert _policy_from_env("test", EncodePolicy("png", 6)) == expected
+
+
+def test_handle_from_a_png_keeps_its_bytes():
+    png = BytesIO()
+    _noisy().save(png, format="PNG", compress_level=1)
+    b64 = base64.b64encode(png.getvalue()).decode("utf-8")
+
+    handle = ImageHandle(b64=f"data:image/png;base64,{b64}")
+
+    assert handle.b64 == b64
+    assert handle.png_bytes == png.getvalue()
+    assert handle.encoded("actor") == f"data:image/png;base64,{b64}"
+    assert handle.pil.tobytes() == _noisy().tobytes()
+    assert handle.size == (400, 300)
+
+
+def test_handle_from_an_image_encodes_it_once(monkeypatch):
+    image = _noisy()
+    handle = as_handle(image)
+    calls = []
+    monkeypatch.setattr(img, "_encode", lambda *args: calls.append(args) or b"png")
+
+    assert as_handle(handle) is handle
+    assert handle.pil is image
+    assert handle.png_bytes == handle.png_bytes == b"png"
+    assert len(calls) == 1
+    assert handle.gray.shape == (300, 400)
+
+
+def test_handle_needs_an_image():
+    with pytest.raises(ValueError):
+        ImageHandle()
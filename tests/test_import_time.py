@@ -0,0 +1,45 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+IMPORT_TIME_BUDGET = float(os.getenv("IMPORT_TIME_BUDGET", 5.0))
+HEAVY_MODULES = ["torch", "easyocr", "cv2", "sklearn", "skimage"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+try:
+    import robbieg2.server
+except ModuleNotFoundError as e:
+    if e.name.split(".")[0] == "robbieg2":
+        raise
+    print(json.dumps({{"missing": e.name}}))
+    sys.exit(0)
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+@pytest.fixture(scope="module")
+def server_import() -> dict:
+    # A fresh interpreter, so that nothing imported by the other tests is counted
+    process = subprocess.run(
+        [sys.executable, "-c", PROBE.format(heavy=HEAVY_MODULES)],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(__file__)),
+    )
+    assert process.returncode == 0, process.stderr
+    report = json.loads(process.stdout.strip().splitlines()[-1])
+    if "missing" in report:
+        pytest.skip(f"the server dependencies are not installed: {report['missing']}")
+    return report
+
+
+def test_server_import_is_within_budget(server_import):
+    assert server_import["seconds"] <= IMPORT_TIME_BUDGET
+
+
+def test_server_import_defers_heavy_dependencies(server_import):
+    assert server_import["heavy"] == []
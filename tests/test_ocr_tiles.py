@@ -0,0 +1,55 @@
+from robbieg2.ocr_tiles import merge_text_boxes, split_into_tiles
+
+
+def _text_box(x, y, w, h, text, confidence=0.9) -> dict:
+    return {"x": x, "y": y, "w": w, "h": h, "text": text, "confidence": confidence}
+
+
+def test_tiles_cover_the_image_with_the_overlap():
+    tiles = split_into_tiles(2880, 1712, tile_size=1024, overlap=128)
+
+    lefts = sorted({tile.left for tile in tiles})
+    tops = sorted({tile.top for tile in tiles})
+    assert lefts[0] == 0 and tops[0] == 0
+    assert max(tile.right for tile in tiles) == 2880
+    assert max(tile.bottom for tile in tiles) == 1712
+    for starts in (lefts, tops):
+        for previous, start in zip(starts, starts[1:]):
+            assert previous + 1024 - start >= 128
+
+
+def test_small_image_is_one_tile():
+    tiles = split_into_tiles(800, 600, tile_size=1024)
+
+    assert [(tile.left, tile.top, tile.right, tile.bottom) for tile in tiles] == [(0, 0, 800, 600)]
+
+
+def test_duplicates_keep_the_larger_box():
+    merged = merge_text_boxes([
+        _text_box(2000, 100, 100, 20, "Settings"),
+        _text_box(2004, 100, 94, 20, "Setting", confidence=0.5),
+    ])
+
+    assert [result["text"] for result in merged] == ["Settings"]
+
+
+def test_line_across_a_seam_is_joined():
+    # The tile at 0..1024 cuts the line at its right edge, the tile at 619..1643 at its left one
+    merged = merge_text_boxes([
+        _text_box(500, 100, 524, 20, "The quick brown fox"),
+        _text_box(619, 101, 681, 20, "brown fox jumps over", confidence=0.8),
+    ])
+
+    assert len(merged) == 1
+    assert (merged[0]["x"], merged[0]["w"]) == (500, 800)
+    assert merged[0]["text"] == "The quick brown fox jumps over"
+    assert merged[0]["confidence"] == 0.8
+
+
+def test_boxes_of_other_rows_are_not_joined():
+    merged = merge_text_boxes([
+        _text_box(500, 100, 524, 20, "first line"),
+        _text_box(619, 140, 681, 20, "second line"),
+    ])
+
+    assert [result["text"] for result in merged] == ["first line", "second line"]
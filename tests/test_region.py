@@ -0,0 +1,40 @@
+from PIL import Image
+
+from robbieg2.img import Box
+from robbieg2.region import Region
+
+
+def _screenshot() -> Image.Image:
+    image = Image.new("RGB", (100, 80), "white")
+    image.putpixel((30, 20), (255, 0, 0))
+    return image
+
+
+def _coords(box: Box) -> tuple:
+    return (box.left, box.top, box.right, box.bottom)
+
+
+def test_whole_screenshot_is_not_copied():
+    screenshot = _screenshot()
+
+    assert Region(screenshot).image() is screenshot
+
+
+def test_image_matches_crop_and_resize():
+    screenshot = _screenshot()
+    region = Region(screenshot, Box(20, 10, 60, 40), scale=3)
+
+    expected = screenshot.crop((20, 10, 60, 40)).resize((120, 90), resample=Image.NEAREST)
+    assert (region.width, region.height) == (120, 90)
+    assert region.image().tobytes() == expected.tobytes()
+    assert region.image() is region.image()
+
+
+def test_zoom_maps_back_to_the_screenshot():
+    region = Region(_screenshot(), Box(20, 10, 60, 40), scale=3)
+
+    zoomed = region.zoom(Box(30, 30, 60, 60), upscale=2)
+
+    assert _coords(zoomed.box) == (30, 20, 40, 30)
+    assert zoomed.scale == 6
+    assert _coords(zoomed.to_absolute(Box(0, 0, 60, 60))) == (30, 20, 40, 30)
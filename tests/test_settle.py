@@ -0,0 +1,71 @@
+import itertools
+
+import numpy as np
+from PIL import Image
+
+from robbieg2.frame import Frame
+from robbieg2.change_detection import detect_changes
+from robbieg2.settle import SETTLE_BLOCK_SIZE, SETTLE_LEVEL, wait_for_stable_screen
+
+
+def _frame(value: int) -> Frame:
+    pixels = np.full((64, 96, 3), 255, dtype=np.uint8)
+    pixels[: value * 8] = 0
+    return Frame(Image.fromarray(pixels))
+
+
+def test_returns_the_last_frame_once_stable():
+    # The screen changes for the first four polls, then stays the same
+    frames = (_frame(min(i, 4)) for i in itertools.count())
+
+    settled = wait_for_stable_screen(lambda: next(frames), window=0.05, timeout=2, interval=0.01, level=0)
+
+    assert settled.stable
+    assert settled.waited < 2
+    assert np.array_equal(settled.frame.gray, _frame(4).gray)
+
+
+def test_gives_up_at_the_timeout():
+    frames = (_frame(i % 8) for i in itertools.count())
+
+    settled = wait_for_stable_screen(lambda: next(frames), window=0.05, timeout=0.2, interval=0.01, level=0)
+
+    assert not settled.stable
+    assert settled.waited >= 0.2
+
+
+def test_same_frame_is_stable_right_after_the_window():
+    frame = _frame(1)
+
+    settled = wait_for_stable_screen(lambda: frame, window=0.05, timeout=2, interval=0.01)
+
+    assert settled.stable
+    assert settled.frame is frame
+
+
+def _screen(cursor: bool = False, word: bool = False) -> Frame:
+    pixels = np.full((1712, 2880, 3), 255, dtype=np.uint8)
+    if cursor:
+        pixels[100:124, 200:204] = 0
+    if word:
+        pixels[300:324, 400:520] = 0
+    return Frame(Image.fromarray(pixels))
+
+
+def test_blinking_cursor_does_not_count_as_a_change():
+    screens = itertools.cycle([_screen(), _screen(cursor=True)])
+
+    settled = wait_for_stable_screen(lambda: next(screens), window=0.05, timeout=1, interval=0.01)
+
+    assert settled.stable
+
+
+def test_typed_word_on_a_large_screen_counts_as_a_change():
+    # A few blocks out of thousands, which a share of the screen would tolerate
+    changes = detect_changes(_screen().pyramid(SETTLE_LEVEL), _screen(word=True).pyramid(SETTLE_LEVEL), SETTLE_BLOCK_SIZE)
+    assert changes.fraction < 0.002
+
+    screens = itertools.cycle([_screen(), _screen(word=True)])
+    settled = wait_for_stable_screen(lambda: next(screens), window=0.05, timeout=0.3, interval=0.01)
+
+    assert not settled.stable
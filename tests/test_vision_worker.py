@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from robbieg2 import vision_worker
+from robbieg2.vision_worker import VisionWorkerPool
+
+
+def _gray(height: int, width: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, (height, width), dtype=np.uint8)
+
+
+@pytest.fixture
+def pool():
+    pool = VisionWorkerPool(1, timeout=60, warmup=False)
+    pool.start()
+    assert pool.wait_ready(timeout=60)
+    yield pool
+    pool.shutdown()
+
+
+def test_compare_images_runs_in_a_worker(pool):
+    image = _gray(64, 64)
+    assert pool.submit("compare_images", [image, image], method="fast").result(timeout=60) == pytest.approx(1.0)
+
+
+def test_timed_out_request_restarts_the_worker(pool):
+    pid = pool._workers[0].process.pid
+    large = [_gray(4000, 4000, 1), _gray(4000, 4000, 2)]
+    with pytest.raises(TimeoutError):
+        pool.submit("compare_images", large, timeout=0.001, method="skimage").result(timeout=60)
+
+    small = _gray(64, 64)
+    assert pool.submit("compare_images", [small, small], method="fast").result(timeout=60) == pytest.approx(1.0)
+    assert pool._workers[0].process.pid != pid
+
+
+def test_crashed_idle_worker_is_restarted(pool):
+    worker = pool._workers[0]
+    worker.process.kill()
+    worker.process.join()
+
+    image = _gray(64, 64)
+    assert pool.submit("compare_images", [image, image], method="fast").result(timeout=60) == pytest.approx(1.0)
+    assert pool._workers[0].process.pid != worker.process.pid
+
+
+def test_pool_gives_up_when_the_workers_cannot_start(monkeypatch):
+    # The spawned workers read the backend from the environment, so their warmup fails
+    monkeypatch.setenv("OCR_BACKEND", "bogus")
+    monkeypatch.setattr(vision_worker, "VISION_RESTART_LIMIT", 1)
+    monkeypatch.setattr(vision_worker, "VISION_RESTART_BACKOFF", 0.01)
+    pool = VisionWorkerPool(1, timeout=60, warmup=True)
+    try:
+        image = _gray(64, 64)
+        future = pool.submit("compare_images", [image, image], method="fast")
+        with pytest.raises(RuntimeError, match="failed to start"):
+            future.result(timeout=120)
+        with pytest.raises(RuntimeError, match="failed to start"):
+            pool.wait_ready(timeout=1)
+    finally:
+        pool.shutdown()
+
+
+def test_workers_run_ocr_with_tiling_on(monkeypatch):
+    pytest.importorskip("easyocr")
+    from PIL import Image, ImageDraw
+
+    # Daemonic workers cannot start the tile processes, they must fall back to the untiled OCR
+    monkeypatch.setenv("OCR_TILED", "true")
+    monkeypatch.setenv("OCR_TILED_MIN_PIXELS", "0")
+    image = Image.new("RGB", (400, 100), "white")
+    ImageDraw.Draw(image).text((20, 40), "Hello", fill="black")
+
+    pool = VisionWorkerPool(1, timeout=600, warmup=True)
+    try:
+        pool.start()
+        assert pool.wait_ready(timeout=600)
+        results = pool.submit("find_text", [np.asarray(image)]).result(timeout=600)
+        assert isinstance(results, list)
+    finally:
+        pool.shutdown()